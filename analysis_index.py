@@ -0,0 +1,173 @@
+import os
+import json
+import sqlite3
+import threading
+
+DEFAULT_INDEX_NAME = "analysis_index.sqlite"
+
+
+def get_cache_dir():
+    """Get persistent cache directory shared by all mixer instances"""
+    cache_dir = os.environ.get("MUSIC_MIXER_CACHE_DIR")
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "music_mixer")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+class AnalysisIndex:
+    """Persistent sample analysis results keyed by path, size and mtime"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "data TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _normalize(path):
+        return os.path.abspath(path)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def get(self, path):
+        """Get analysis record for file, None if missing or outdated"""
+        return self.get_many([path]).get(path)
+
+    def get_many(self, paths):
+        """Get fresh analysis records for many files in one query"""
+        stats = {}
+        for path in paths:
+            stat = self._stat(path)
+            if stat:
+                stats[self._normalize(path)] = (path, stat)
+
+        if not stats:
+            return {}
+
+        records = {}
+        keys = list(stats)
+        with self._lock:
+            # Stay well below SQLite's bound parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT path, size, mtime_ns, data FROM samples WHERE path IN ({placeholders})",
+                    chunk
+                ).fetchall()
+
+                for norm_path, size, mtime_ns, data in rows:
+                    path, stat = stats[norm_path]
+                    if (size, mtime_ns) == stat:
+                        records[path] = json.loads(data)
+
+        return records
+
+    def update(self, path, **fields):
+        """Merge analysis fields into file record"""
+        self.update_many({path: fields})
+
+    def update_many(self, updates):
+        """Merge analysis fields for many files in one transaction"""
+        if not updates:
+            return
+
+        current = self.get_many(list(updates))
+        rows = []
+        for path, fields in updates.items():
+            stat = self._stat(path)
+            if not stat:
+                continue
+            record = dict(current.get(path, {}))
+            record.update(fields)
+            rows.append((self._normalize(path), stat[0], stat[1], json.dumps(record)))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO samples (path, size, mtime_ns, data) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def invalidate(self, path):
+        """Forget analysis results for file"""
+        with self._lock:
+            self._conn.execute("DELETE FROM samples WHERE path = ?", (self._normalize(path),))
+            self._conn.commit()
+
+    def clear(self, root=None):
+        """Forget all results, or only those under root directory"""
+        with self._lock:
+            if root is None:
+                cursor = self._conn.execute("DELETE FROM samples")
+            else:
+                prefix = os.path.join(self._normalize(root), "")
+                cursor = self._conn.execute(
+                    "DELETE FROM samples WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix)
+                )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def prune(self, root=None):
+        """Remove records of deleted or modified files"""
+        with self._lock:
+            rows = self._conn.execute("SELECT path, size, mtime_ns FROM samples").fetchall()
+
+        prefix = os.path.join(self._normalize(root), "") if root else None
+        stale = []
+        for path, size, mtime_ns in rows:
+            if prefix and not path.startswith(prefix):
+                continue
+            if self._stat(path) != (size, mtime_ns):
+                stale.append((path,))
+
+        with self._lock:
+            self._conn.executemany("DELETE FROM samples WHERE path = ?", stale)
+            self._conn.commit()
+
+        return len(stale)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_shared_index():
+    """Get process-wide analysis index stored in the cache directory"""
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            try:
+                _shared_index = AnalysisIndex(os.path.join(get_cache_dir(), DEFAULT_INDEX_NAME))
+            except (OSError, sqlite3.Error) as e:
+                print(f"Analysis index unavailable: {e}")
+                return None
+        return _shared_index
@@ -1,5 +1,7 @@
 import os
+import hashlib
 import tempfile
+import time
 import zipfile
 import gradio as gr
 from pathlib import Path
@@ -7,42 +9,118 @@ import shutil
 
 # Import MusicMixer class
 from music_mixer_logic import MusicMixer
+from analysis_index import get_cache_dir
+from sample_library import forget_library, get_library
+from mix_engine import encoder_available
+from workspace import get_workspace, start_shared_janitor
+from sample_ingest import extract_audio_members, ingest_uploads
+from tracing import Trace
 
-# Global variables
-current_mixer = None
-current_samples_dir = None
 DEFAULT_SAMPLES_ZIP = "samples.zip"  # Pre-loaded samples archive
 
+# Staging directories of extractions untouched this long were left by a crashed process
+STALE_EXTRACTION_SECONDS = 3600
+
+# How many mixes are generated or rendered at the same time, further requests wait in the queue
+GENERATION_CONCURRENCY = int(os.environ.get("AHA_GENERATION_CONCURRENCY", max(1, (os.cpu_count() or 2) // 2)))
+GENERATION_QUEUE_SIZE = int(os.environ.get("AHA_GENERATION_QUEUE_SIZE", 32))
+
+# Formats offered for full renders, compressed ones first to save bandwidth
+DOWNLOAD_FORMATS = [
+    (label, fmt) for label, fmt in [
+        ("MP3 (small)", "mp3"), ("OGG Vorbis (small)", "ogg"), ("FLAC (lossless)", "flac"), ("WAV (uncompressed)", "wav")
+    ] if encoder_available(fmt)
+]
+
+def new_session():
+    """Create per-session state: chosen library, its mixer and the last planned composition"""
+    return {'samples_dir': None, 'mixer': None, 'plan': None}
+
+def set_samples_dir(session, samples_dir):
+    """Point session at a sample directory, keeping its uploads from eviction while it lives"""
+    workspace = get_workspace()
+    previous = session['samples_dir']
+    if previous and previous != samples_dir and workspace.contains(previous, 'uploads'):
+        # Its TTL starts counting from the moment the session lets go
+        workspace.touch(previous)
+        workspace.release(previous)
+    if samples_dir and workspace.contains(samples_dir, 'uploads'):
+        workspace.hold(samples_dir)
+    session['samples_dir'] = samples_dir
+
+# Content hashes of archives, memoized by (path, size, mtime)
+_archive_digests = {}
+
+def get_archive_digest(zip_path):
+    """Get content hash of archive, computed once per file version"""
+    st = os.stat(zip_path)
+    memo_key = (os.path.abspath(zip_path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _archive_digests:
+        digest = hashlib.sha256()
+        with open(zip_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _archive_digests[memo_key] = digest.hexdigest()
+    return _archive_digests[memo_key]
+
+def remove_stale_extractions(cache_dir):
+    """Remove staging directories that killed or crashed extractions left behind"""
+    now = time.time()
+    for staging_dir in cache_dir.glob(".extracting_*"):
+        try:
+            if now - staging_dir.stat().st_mtime > STALE_EXTRACTION_SECONDS:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+        except OSError:
+            pass
+
 def extract_default_samples():
-    """Extract pre-loaded samples archive"""
+    """Extract pre-loaded samples archive once into the shared cache"""
+    cache_dir = Path(get_cache_dir())
     try:
         if os.path.exists(DEFAULT_SAMPLES_ZIP):
-            temp_dir = Path(tempfile.mkdtemp(prefix="default_samples_"))
-            with zipfile.ZipFile(DEFAULT_SAMPLES_ZIP, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            return str(temp_dir)
+            target_dir = cache_dir / f"default_samples_{get_archive_digest(DEFAULT_SAMPLES_ZIP)[:16]}"
+            if target_dir.is_dir():
+                return str(target_dir)
+            
+            # Extract into a private directory, then rename it into place so
+            # concurrent workers never see a partially extracted library
+            remove_stale_extractions(cache_dir)
+            staging_dir = Path(tempfile.mkdtemp(prefix=".extracting_", dir=cache_dir))
+            try:
+                # The bundled archive is trusted, so no size limits
+                extract_audio_members(DEFAULT_SAMPLES_ZIP, staging_dir, max_bytes=None, max_members=None)
+                os.rename(staging_dir, target_dir)
+            except OSError:
+                # Another worker finished extraction first
+                if not target_dir.is_dir():
+                    raise
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            return str(target_dir)
         else:
-            # If archive doesn't exist, create empty directory
-            temp_dir = Path(tempfile.mkdtemp(prefix="empty_samples_"))
-            return str(temp_dir)
+            # If archive doesn't exist, use an empty directory
+            empty_dir = cache_dir / "empty_samples"
+            empty_dir.mkdir(exist_ok=True)
+            return str(empty_dir)
     except Exception as e:
         print(f"Error extracting archive: {e}")
-        temp_dir = Path(tempfile.mkdtemp(prefix="error_samples_"))
+        temp_dir = Path(get_workspace().new_dir('uploads', 'error_samples'))
         return str(temp_dir)
 
-def process_uploaded_files(files, use_default_samples):
+def process_uploaded_files(files, use_default_samples, session):
     """Process uploaded files"""
-    global current_samples_dir
-    
+    session = session or new_session()
+    status = _load_samples(files, use_default_samples, session)
+    return status, session
+
+def _load_samples(files, use_default_samples, session):
     try:
         if use_default_samples:
             # Use pre-loaded samples
-            current_samples_dir = extract_default_samples()
+            set_samples_dir(session, extract_default_samples())
             
             # Check if there are files in the extracted archive
-            default_dir = Path(current_samples_dir)
-            audio_files = list(default_dir.rglob("*.wav")) + list(default_dir.rglob("*.mp3")) + \
-                         list(default_dir.rglob("*.flac")) + list(default_dir.rglob("*.aiff"))
+            audio_files = get_library(session['samples_dir']).samples
             
             if audio_files:
                 return f"✅ Using pre-loaded samples. Found {len(audio_files)} audio files."
@@ -51,39 +129,29 @@ def process_uploaded_files(files, use_default_samples):
         else:
             # User uploads their own files
             if files:
-                temp_dir = Path(tempfile.mkdtemp(prefix="user_samples_"))
-                file_count = 0
+                temp_dir = Path(get_workspace().new_dir('uploads', 'user_samples'))
                 
-                for file in files:
-                    file_path = Path(file.name)
-                    
-                    # If it's a zip archive - extract it
-                    if file_path.suffix.lower() == '.zip':
-                        with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                            zip_ref.extractall(temp_dir)
-                            extracted = len(zip_ref.namelist())
-                            file_count += extracted
-                    else:
-                        # Otherwise copy the audio file
-                        shutil.copy(file_path, temp_dir / file_path.name)
-                        file_count += 1
+                # Only audio files are kept; archives are unpacked member by member
+                try:
+                    stats = ingest_uploads([file.name for file in files], str(temp_dir))
+                except (ValueError, zipfile.BadZipFile):
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    raise
                 
-                current_samples_dir = str(temp_dir)
+                set_samples_dir(session, str(temp_dir))
                 
                 # Check if there are audio files
-                audio_files = list(temp_dir.rglob("*.wav")) + list(temp_dir.rglob("*.mp3")) + \
-                             list(temp_dir.rglob("*.flac")) + list(temp_dir.rglob("*.aiff"))
+                audio_files = get_library(temp_dir).samples
+                skipped = f" Skipped {stats['skipped']} non-audio files." if stats['skipped'] else ""
                 
                 if audio_files:
-                    return f"✅ Uploaded {file_count} files. Found {len(audio_files)} audio files."
+                    return f"✅ Uploaded {len(audio_files)} audio files.{skipped}"
                 else:
                     return "⚠️ Files uploaded, but no audio files found (.wav, .mp3, .flac, .aiff)"
             else:
-                # Check if current_samples_dir is already set via custom path
-                if current_samples_dir and os.path.exists(current_samples_dir):
-                    dir_path = Path(current_samples_dir)
-                    audio_files = list(dir_path.rglob("*.wav")) + list(dir_path.rglob("*.mp3")) + \
-                                 list(dir_path.rglob("*.flac")) + list(dir_path.rglob("*.aiff"))
+                # Check if samples dir is already set via custom path
+                if session['samples_dir'] and os.path.exists(session['samples_dir']):
+                    audio_files = get_library(session['samples_dir']).samples
                     
                     if audio_files:
                         return f"✅ Using custom directory. Found {len(audio_files)} audio files."
@@ -95,66 +163,120 @@ def process_uploaded_files(files, use_default_samples):
     except Exception as e:
         return f"❌ Error processing files: {str(e)}"
 
-def set_custom_path(path, use_default):
+def set_custom_path(path, use_default, session):
     """Set custom samples directory path"""
-    global current_samples_dir
+    session = session or new_session()
     if path and os.path.exists(path):
-        current_samples_dir = path
-        return f"✅ Custom directory set: {path}"
+        set_samples_dir(session, path)
+        return f"✅ Custom directory set: {path}", session
     else:
-        return "❌ Directory not found or path is invalid"
+        return "❌ Directory not found or path is invalid", session
 
-def init_mixer(target_bpm, current_key, use_experimental):
-    """Initialize the mixer"""
-    global current_mixer, current_samples_dir
-    
-    if current_samples_dir is None:
+def init_mixer(session, target_bpm, current_key, use_experimental, tempo_mode="resample", seed=None):
+    """Initialize the session's mixer"""
+    if session['samples_dir'] is None:
         # If nothing selected, use pre-loaded samples
-        current_samples_dir = extract_default_samples()
+        set_samples_dir(session, extract_default_samples())
     
     try:
         # Check if directory exists
-        if not os.path.exists(current_samples_dir):
+        if not os.path.exists(session['samples_dir']):
             return None, "❌ Sample directory not found"
+        if get_workspace().contains(session['samples_dir'], 'uploads'):
+            # Reusing the uploads counts as using them
+            get_workspace().touch(session['samples_dir'])
         
-        # Create mixer
-        current_mixer = MusicMixer(
-            samples_dir=current_samples_dir,
-            target_bpm=target_bpm,
-            current_key=current_key,
-            experimental_mode=use_experimental
-        )
+        mixer = session['mixer']
+        if mixer is not None and mixer.samples_dir == session['samples_dir']:
+            # Reuse the session's mixer so its in-memory caches survive between clicks
+            mixer.target_bpm = target_bpm
+            mixer.current_key = current_key
+            mixer.experimental_mode = use_experimental
+            mixer.tempo_mode = tempo_mode
+            mixer.seed = seed
+        else:
+            if mixer is not None:
+                mixer.cleanup()
+            
+            # Create mixer (analysis index and sample cache are shared by all sessions)
+            mixer = MusicMixer(
+                samples_dir=session['samples_dir'],
+                target_bpm=target_bpm,
+                current_key=current_key,
+                experimental_mode=use_experimental,
+                tempo_mode=tempo_mode,
+                seed=seed
+            )
+            session['mixer'] = mixer
         
         # Check if there are samples
-        samples = current_mixer.get_all_samples()
+        samples = mixer.get_all_samples()
         if not samples:
             return None, f"❌ No audio files found. Try uploading different files."
         
-        return current_mixer, f"✅ Mixer ready. Analyzed {len(samples)} samples"
+        return mixer, f"✅ Mixer ready. Analyzed {len(samples)} samples"
         
     except Exception as e:
         return None, f"❌ Initialization error: {str(e)}"
 
-def generate_mix(num_layers, target_bpm, current_key, use_experimental, progress=gr.Progress()):
+def generate_mix(num_layers, target_bpm, current_key, use_experimental, tempo_mode, seed, session,
+                 progress=gr.Progress()):
     """Main mix generation function"""
-    global current_mixer
+    session = session or new_session()
+    # Empty seed box means a new random composition every time
+    seed = int(seed) if seed not in (None, "") else None
+    audio_path, description = _generate_mix(
+        session, num_layers, target_bpm, current_key, use_experimental, tempo_mode, seed, progress
+    )
+    return audio_path, description, session
+
+def render_full_mix(output_format, session, progress=gr.Progress()):
+    """Render the previewed composition at full quality"""
+    session = session or new_session()
+    if session.get('plan') is None or session['mixer'] is None:
+        return None, "❌ Generate a mix first", session
     
+    try:
+        progress(0.1, desc="🎚️ Rendering full mix...")
+        mixer = session['mixer']
+        
+        def report_layers(done, total, sample):
+            progress(0.1 + 0.4 * done / total, desc=f"🎚️ Preparing layers ({done}/{total})...")
+        
+        with Trace('render') as trace:
+            audio_path = mixer.render_plan(session['plan'], output_format, progress_callback=report_layers)
+        description = mixer.format_composition_info(mixer.get_composition_info(session['plan'], trace))
+        progress(1.0, desc="✅ Done!")
+        return audio_path, description, session
+        
+    except Exception as e:
+        return None, f"❌ Error rendering mix: {str(e)}", session
+
+def _generate_mix(session, num_layers, target_bpm, current_key, use_experimental, tempo_mode, seed, progress):
     try:
         progress(0.1, desc="🎵 Initializing mixer...")
         
         # Initialize mixer
-        mixer, status = init_mixer(target_bpm, current_key, use_experimental)
+        mixer, status = init_mixer(session, target_bpm, current_key, use_experimental, tempo_mode, seed)
         if mixer is None:
             return None, status
         
-        current_mixer = mixer
+        progress(0.1, desc="🎵 Selecting samples and creating composition...")
+        
+        def report_analysis(done, total, sample):
+            progress(0.1 + 0.5 * done / total, desc=f"🎵 Analyzing samples ({done}/{total})...")
         
-        progress(0.4, desc="🎵 Analyzing samples and creating composition...")
+        def report_layers(done, total, sample):
+            progress(0.6 + 0.2 * done / total, desc=f"🎚️ Preparing layers ({done}/{total})...")
         
-        # Generate mix
-        audio_path, description, composition_info = current_mixer.generate_complete_mix(
-            num_layers=num_layers
+        # Pick the layers and render a short draft; the full mix is rendered on demand
+        audio_path, description, plan = mixer.generate_preview_mix(
+            num_layers=num_layers,
+            progress_callback=report_analysis,
+            render_callback=report_layers
         )
+        session['plan'] = plan
+        description += "\n*Draft preview (mono, first bars). Press \"Render full quality\" for the complete mix.*"
         
         progress(0.8, desc="💾 Saving result...")
         
@@ -172,39 +294,62 @@ def generate_mix(num_layers, target_bpm, current_key, use_experimental, progress
     except Exception as e:
         return None, f"❌ Error creating mix: {str(e)}"
 
-def update_sample_info():
+def update_sample_info(session):
     """Update information about loaded samples"""
-    global current_samples_dir
-    if current_samples_dir and os.path.exists(current_samples_dir):
-        dir_path = Path(current_samples_dir)
-        wav_files = list(dir_path.rglob("*.wav"))
-        mp3_files = list(dir_path.rglob("*.mp3"))
-        flac_files = list(dir_path.rglob("*.flac"))
-        aiff_files = list(dir_path.rglob("*.aiff"))
-        
-        total = len(wav_files) + len(mp3_files) + len(flac_files) + len(aiff_files)
+    samples_dir = session['samples_dir'] if session else None
+    if samples_dir and os.path.exists(samples_dir):
+        dir_path = Path(samples_dir)
+        library = get_library(samples_dir)
+        formats = library.counts_by_format()
+        categories = library.counts_by_category(MusicMixer.categorize_sample)
+        category_lines = "\n".join(
+            f"        - {category}: {count}" for category, count in sorted(categories.items())
+        )
         
         info_text = f"""
         **📊 Sample Statistics:**
-        - Total audio files: {total}
-        - WAV files: {len(wav_files)}
-        - MP3 files: {len(mp3_files)}
-        - FLAC files: {len(flac_files)}
-        - AIFF files: {len(aiff_files)}
+        - Total audio files: {len(library)}
+        - WAV files: {formats['wav']}
+        - MP3 files: {formats['mp3']}
+        - FLAC files: {formats['flac']}
+        - AIFF files: {formats['aiff']}
+        
+        **🗂️ Categories:**
+{category_lines}
         
         **📂 Source:** {dir_path.name}
+        
+        **💽 Workspace:** {format_workspace_usage()}
         """
         return info_text
     return "Sample information not available"
 
-def cleanup_temp_dirs():
+def cleanup_temp_dirs(session):
     """Clean up temporary directories"""
-    global current_mixer
-    if current_mixer:
-        current_mixer.cleanup()
+    if session and session['mixer']:
+        session['mixer'].cleanup()
+    
+    # Uploaded samples belong to the session alone
+    if session and session['samples_dir'] and get_workspace().contains(session['samples_dir'], 'uploads'):
+        get_workspace().release(session['samples_dir'])
+        shutil.rmtree(session['samples_dir'], ignore_errors=True)
+        forget_library(session['samples_dir'])
+
+def format_workspace_usage():
+    """Describe disk space used by generated files"""
+    usage = get_workspace().usage()
+    areas = ", ".join(
+        f"{name} {area['bytes'] / (1024 * 1024):.1f} MB ({area['entries']})"
+        for name, area in usage['areas'].items()
+    )
+    return (f"{usage['bytes'] / (1024 * 1024):.1f} of {usage['max_bytes'] / (1024 * 1024):.0f} MB used: {areas}; "
+            f"{usage['evicted_entries']} entries evicted")
 
 # Create Gradio interface
 with gr.Blocks(title="Artificial Harmony Algorithm") as demo:
+    # Library and mixer of the current browser session
+    session_state = gr.State(new_session(), delete_callback=cleanup_temp_dirs)
+    
     # Добавляем CSS через мета-тег в HTML
     gr.HTML("""
     <style>
@@ -261,14 +406,14 @@ with gr.Blocks(title="Artificial Harmony Algorithm") as demo:
                 custom_path_status = gr.Textbox(label="Status", interactive=False)
                 use_custom_path_btn.click(
                     set_custom_path,
-                    inputs=[custom_samples_path, use_default_samples],
-                    outputs=[custom_path_status]
+                    inputs=[custom_samples_path, use_default_samples, session_state],
+                    outputs=[custom_path_status, session_state]
                 )
             
             with gr.Accordion("📤 Upload your own samples (optional)", open=False):
                 file_upload = gr.File(
                     label="Select audio files or ZIP archive",
-                    file_types=[".wav", ".mp3", ".flac", ".aiff", ".zip"],
+                    file_types=[".wav", ".mp3", ".flac", ".aiff", ".aif", ".zip"],
                     file_count="multiple",
                     interactive=True
                 )
@@ -281,11 +426,6 @@ with gr.Blocks(title="Artificial Harmony Algorithm") as demo:
             
             load_samples_btn = gr.Button("📁 Load Samples", variant="primary")
             
-            load_samples_btn.click(
-                process_uploaded_files,
-                inputs=[file_upload, use_default_samples],
-                outputs=[upload_status]
-            )
             
             gr.Markdown("---")
             
@@ -317,11 +457,41 @@ with gr.Blocks(title="Artificial Harmony Algorithm") as demo:
                 interactive=True
             )
             
+            tempo_mode = gr.Dropdown(
+                choices=[
+                    ("Resample (fast, shifts pitch)", "resample"),
+                    ("Phase vocoder (keeps pitch)", "phase_vocoder"),
+                    ("Beat slicing (keeps pitch)", "beat_slice")
+                ],
+                value="resample",
+                label="Tempo engine",
+                interactive=True
+            )
+            
+            seed = gr.Number(
+                value=None,
+                precision=0,
+                label="Seed (empty for random)",
+                interactive=True
+            )
+            
             generate_btn = gr.Button(
                 "🎵 Generate Mix",
                 variant="primary",
                 size="lg"
             )
+            
+            output_format = gr.Dropdown(
+                choices=DOWNLOAD_FORMATS,
+                value=DOWNLOAD_FORMATS[0][1],
+                label="Full quality format",
+                interactive=True
+            )
+            
+            render_btn = gr.Button(
+                "🎚️ Render full quality",
+                variant="secondary"
+            )
         
         with gr.Column(scale=2):
             # Results section
@@ -349,16 +519,31 @@ with gr.Blocks(title="Artificial Harmony Algorithm") as demo:
                 sample_info = gr.Markdown("Information will appear after loading samples")
             
             load_samples_btn.click(
+                process_uploaded_files,
+                inputs=[file_upload, use_default_samples, session_state],
+                outputs=[upload_status, session_state]
+            ).then(
                 update_sample_info,
-                inputs=[],
+                inputs=[session_state],
                 outputs=[sample_info]
             )
     
     # Generation handler
     generate_btn.click(
         generate_mix,
-        inputs=[num_layers, target_bpm, current_key, use_experimental],
-        outputs=[audio_output, text_output]
+        inputs=[num_layers, target_bpm, current_key, use_experimental, tempo_mode, seed, session_state],
+        outputs=[audio_output, text_output, session_state],
+        concurrency_limit=GENERATION_CONCURRENCY,
+        concurrency_id="generation"
+    )
+    
+    # Full renders share the generation slots, so together they stay within the limit
+    render_btn.click(
+        render_full_mix,
+        inputs=[output_format, session_state],
+        outputs=[audio_output, text_output, session_state],
+        concurrency_limit=GENERATION_CONCURRENCY,
+        concurrency_id="generation"
     )
     
     # Preset examples
@@ -399,7 +584,11 @@ if __name__ == "__main__":
         print(f"⚠️  Pre-loaded archive not found: {DEFAULT_SAMPLES_ZIP}")
         print("   Users will need to upload their own samples")
     
+    # Evict old mixes and uploads in the background
+    start_shared_janitor()
+    
     # Launch application
+    demo.queue(max_size=GENERATION_QUEUE_SIZE)
     demo.launch(
         server_name="0.0.0.0", 
         server_port=7860, 
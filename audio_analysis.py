@@ -0,0 +1,402 @@
+import warnings
+import librosa
+import numpy as np
+import soundfile as sf
+from scipy.signal import lfilter
+
+from candidate_index import pitch_class_to_camelot
+from mix_engine import BAR_TOLERANCE
+
+# Suppress librosa warnings
+warnings.filterwarnings("ignore", category=UserWarning, module='librosa')
+
+# Files are decoded once at the rate of the fast tempo tier, which is
+# plenty for tempo, key and loudness and halves the work of every feature
+ANALYSIS_SAMPLE_RATE = 11025
+ANALYSIS_DURATION = 15
+ANALYSIS_N_FFT = 2048
+ANALYSIS_HOP_LENGTH = 256
+
+# Bump when the feature record layout changes so old records are recomputed
+FEATURES_VERSION = 3
+
+# Range detected tempos are folded into
+MIN_BPM = 80
+MAX_BPM = 180
+
+# Fast tempo tier: onset autocorrelation over the start of the audio at a
+# reduced rate; full beat tracking only runs when its confidence is lower
+FAST_TEMPO_SAMPLE_RATE = 11025
+FAST_TEMPO_DURATION = 8
+FAST_TEMPO_N_FFT = 512
+FAST_TEMPO_HOP_LENGTH = 128
+FAST_TEMPO_MIN_CONFIDENCE = 0.4
+
+# Beat periods whose autocorrelation is averaged into the score of a tempo
+TEMPO_COMB_PERIODS = 4
+TEMPO_CANDIDATES = np.arange(MIN_BPM, MAX_BPM + 0.25, 0.5)
+
+# Onset envelope is high-passed by subtracting its mean over this window,
+# longer than the beat period of MAX_BPM
+ONSET_DETREND_SECONDS = 0.5
+
+# Half or double tempo scoring at least this share of the chosen one makes
+# the estimate ambiguous; it is flagged and the alternative kept
+TEMPO_AMBIGUITY_RATIO = 0.75
+
+# Of two ambiguous tempos the one closer to this is reported first, dance
+# loops cluster around it
+TEMPO_PRIOR_BPM = 125
+
+# Minimum profile correlation for a detected key to be trusted
+KEY_MIN_CONFIDENCE = 0.6
+
+# Krumhansl-Kessler key profiles, starting from the tonic
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+def _build_key_templates():
+    """Z-normalized profiles for all 24 keys and their Camelot names"""
+    templates = []
+    keys = []
+    for pitch_class in range(12):
+        templates.append(np.roll(MAJOR_PROFILE, pitch_class))
+        keys.append(pitch_class_to_camelot(pitch_class))
+    for pitch_class in range(12):
+        templates.append(np.roll(MINOR_PROFILE, pitch_class))
+        keys.append(pitch_class_to_camelot(pitch_class, minor=True))
+
+    templates = np.array(templates)
+    templates = (templates - templates.mean(axis=1, keepdims=True)) / templates.std(axis=1, keepdims=True)
+    return templates, keys
+
+
+KEY_TEMPLATES, KEY_NAMES = _build_key_templates()
+
+COMMON_BPMS = [80, 85, 90, 95, 100, 105, 110, 115, 120,
+               122, 124, 126, 128, 130, 132, 135, 138,
+               140, 145, 150, 155, 160, 165, 170, 175, 180]
+
+
+def snap_bpm(bpm):
+    """Fold BPM into 80-180 range and snap to common value"""
+    if bpm < MIN_BPM:
+        bpm *= 2
+    elif bpm > MAX_BPM:
+        bpm /= 2
+
+    return min(COMMON_BPMS, key=lambda x: abs(x - bpm))
+
+
+def fast_onset_envelope(y, sr):
+    """Spectral flux of the start of mono audio at reduced rate, returns (envelope, frames per second)"""
+    y = y[:int(FAST_TEMPO_DURATION * sr)]
+
+    # Averaging neighbouring samples is enough of a low-pass for onsets
+    factor = max(1, int(sr // FAST_TEMPO_SAMPLE_RATE))
+    if factor > 1:
+        y = y[:len(y) // factor * factor].reshape(-1, factor).mean(axis=1)
+    if len(y) < FAST_TEMPO_N_FFT:
+        return np.zeros(0), sr / factor / FAST_TEMPO_HOP_LENGTH
+
+    frames = librosa.util.frame(y, frame_length=FAST_TEMPO_N_FFT, hop_length=FAST_TEMPO_HOP_LENGTH)
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FAST_TEMPO_N_FFT)[:, None], axis=0))
+    spectrum = np.log1p(100 * spectrum)
+    flux = np.maximum(np.diff(spectrum, axis=1), 0).mean(axis=0)
+    return flux, sr / factor / FAST_TEMPO_HOP_LENGTH
+
+
+def onset_autocorrelation(onset_env, frame_rate, circular=False):
+    """Autocorrelation of onset envelope normalized to 1 at lag 0
+
+    A whole loop repeats seamlessly, so its envelope is correlated with
+    itself wrapped around; otherwise lags are corrected for their overlap
+    """
+    n = len(onset_env)
+    if n < 2:
+        return np.zeros(max(n, 1))
+
+    # Without its local mean a decaying tail such as a crash's does not
+    # correlate with itself at every short lag
+    width = int(ONSET_DETREND_SECONDS * frame_rate)
+    if n > width > 1:
+        env = onset_env - np.convolve(onset_env, np.ones(width) / width, mode='same')
+    else:
+        env = onset_env - onset_env.mean()
+    if not env.any():
+        return np.zeros(n)
+
+    spectrum = np.fft.rfft(env, n if circular else 2 * n)
+    ac = np.fft.irfft(spectrum * np.conj(spectrum), n if circular else 2 * n)[:n]
+    if not circular:
+        ac = ac / (n - np.arange(n)) * n
+    return ac / ac[0]
+
+
+def tempo_scores(ac, frame_rate, circular=False, bpms=TEMPO_CANDIDATES):
+    """Mean autocorrelation at the first beat periods of every candidate tempo"""
+    periods = 60.0 * frame_rate / bpms
+
+    # Long lags overlap too little of a linear envelope to be trusted; all
+    # candidates use the same number of periods so none is favoured
+    max_lag = len(ac) - 1 if circular else len(ac) / 2
+    count = int(np.clip(max_lag // periods.max(), 1, TEMPO_COMB_PERIODS))
+    lags = periods[:, None] * np.arange(1, count + 1)
+
+    values = np.interp(lags, np.arange(len(ac)), ac)
+    valid = lags <= max_lag
+    counts = valid.sum(axis=1)
+    return np.where(counts > 0, (values * valid).sum(axis=1) / np.maximum(counts, 1), 0.0)
+
+
+def score_tempo(scores, bpm, bpms=TEMPO_CANDIDATES):
+    """Confidence of bpm and its half or double tempo if that is about as likely"""
+    confidence = float(np.clip(np.interp(bpm, bpms, scores), 0.0, 1.0))
+
+    alternative = None
+    for other in (bpm * 2, bpm / 2):
+        if MIN_BPM <= other <= MAX_BPM:
+            other_score = float(np.interp(other, bpms, scores))
+            if confidence > 0 and other_score >= TEMPO_AMBIGUITY_RATIO * confidence:
+                alternative = snap_bpm(other)
+    return confidence, alternative
+
+
+def pick_tempo(scores):
+    """Best scoring tempo, snapped, with its confidence and ambiguous alternative
+
+    Of a tempo and its about as likely half or double, the one closer to
+    TEMPO_PRIOR_BPM is picked
+    """
+    bpm = snap_bpm(float(TEMPO_CANDIDATES[int(np.argmax(scores))]))
+    confidence, alternative = score_tempo(scores, bpm)
+    if alternative and abs(np.log2(alternative / TEMPO_PRIOR_BPM)) < abs(np.log2(bpm / TEMPO_PRIOR_BPM)):
+        bpm = alternative
+        confidence, alternative = score_tempo(scores, bpm)
+    return bpm, confidence, alternative
+
+
+def is_whole_bars(duration, bpm):
+    """Check if duration is a whole number of 4/4 bars at bpm, within the tolerance loops are cut with"""
+    bars = duration * bpm / 240.0
+    return round(bars) >= 1 and abs(bars - round(bars)) * 4 <= BAR_TOLERANCE
+
+
+def beat_grid(onset_env, frame_rate, bpm, duration):
+    """Beat times at bpm over duration, in the phase that lines up best with the onsets"""
+    period = 60.0 * frame_rate / bpm
+    if not len(onset_env) or period <= 0:
+        return np.zeros(0)
+
+    positions = np.arange(0, len(onset_env), period)
+    offsets = np.arange(int(np.ceil(period)))
+    indices = np.round(offsets[:, None] + positions[None, :]).astype(int)
+    strength = np.where(indices < len(onset_env), onset_env[np.minimum(indices, len(onset_env) - 1)], 0).sum(axis=1)
+    phase = offsets[int(np.argmax(strength))] / frame_rate
+    return np.arange(phase, duration, 60.0 / bpm)
+
+
+def estimate_tempo(y, sr):
+    """Estimate tempo of decoded mono audio, cheaply when the loop is clearly periodic
+
+    Returns BPM, its confidence from 0 to 1, the method that found it, the
+    half or double tempo when that is about as likely (None otherwise), beat
+    times and the onset envelope with its frame rate
+    """
+    onset_env, frame_rate = fast_onset_envelope(y, sr)
+    duration = len(y) / sr
+    scores = tempo_scores(onset_autocorrelation(onset_env, frame_rate), frame_rate)
+    bpm, confidence, alternative = pick_tempo(scores)
+
+    # A short clip is also correlated wrapped around, as a seamless loop
+    # would be, and that estimate is kept only if the clip is a whole number
+    # of bars at it; one-shots and cut-off audio would show false periodicity
+    if duration <= FAST_TEMPO_DURATION:
+        circular_scores = tempo_scores(onset_autocorrelation(onset_env, frame_rate, True), frame_rate, True)
+        circular = pick_tempo(circular_scores)
+        if is_whole_bars(duration, circular[0]):
+            scores = circular_scores
+            bpm, confidence, alternative = circular
+
+    # Clear periodicity is enough, even if it leaves the tempo octave open
+    if scores.max() >= FAST_TEMPO_MIN_CONFIDENCE:
+        return {
+            'bpm': bpm,
+            'confidence': confidence,
+            'method': 'autocorrelation',
+            'alternative': alternative,
+            'beats': beat_grid(onset_env, frame_rate, bpm, len(y) / sr),
+            'onset_env': onset_env,
+            'frame_rate': frame_rate,
+        }
+
+    # Not clearly periodic: track beats over the whole analysis window
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
+    frame_rate = sr / ANALYSIS_HOP_LENGTH
+    try:
+        tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
+        method = 'beat_track'
+    except Exception:
+        tempo = librosa.feature.rhythm.tempo(onset_envelope=onset_env, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
+        beat_frames = np.array([], dtype=int)
+        method = 'tempo'
+
+    bpm = snap_bpm(float(np.atleast_1d(tempo)[0]))
+    confidence, alternative = score_tempo(tempo_scores(onset_autocorrelation(onset_env, frame_rate), frame_rate), bpm)
+    return {
+        'bpm': bpm,
+        'confidence': confidence,
+        'method': method,
+        'alternative': alternative,
+        'beats': librosa.frames_to_time(beat_frames, sr=sr, hop_length=ANALYSIS_HOP_LENGTH),
+        'onset_env': onset_env,
+        'frame_rate': frame_rate,
+    }
+
+
+def analysis_spectrum(y):
+    """Magnitude spectrogram of decoded mono audio shared by spectral features"""
+    return np.abs(librosa.stft(y, n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP_LENGTH))
+
+
+def estimate_key(y, sr, spectrum=None):
+    """Estimate Camelot key of decoded mono audio, returns (key, confidence)"""
+    if spectrum is None:
+        spectrum = analysis_spectrum(y)
+
+    # Loops are produced in tune, so no tuning is estimated
+    chroma = librosa.feature.chroma_stft(S=spectrum ** 2, sr=sr, n_fft=ANALYSIS_N_FFT, tuning=0.0)
+    profile = chroma.mean(axis=1)
+    if profile.std() < 1e-6:
+        return None, 0.0
+
+    # Correlate the averaged chroma with all 24 rotated key profiles at once
+    profile = (profile - profile.mean()) / profile.std()
+    correlations = KEY_TEMPLATES @ profile / len(profile)
+    best = int(np.argmax(correlations))
+    confidence = float(correlations[best])
+
+    if confidence < KEY_MIN_CONFIDENCE:
+        return None, confidence
+    return KEY_NAMES[best], confidence
+
+
+def _high_shelf(sr, gain_db=3.999843853973347, q=0.7071752369554196, fc=1681.974450955533):
+    a = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * fc / sr
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    b = [a * ((a + 1) + (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha),
+         -2 * a * ((a - 1) + (a + 1) * cos_w0),
+         a * ((a + 1) + (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha)]
+    den = [(a + 1) - (a - 1) * cos_w0 + 2 * np.sqrt(a) * alpha,
+           2 * ((a - 1) - (a + 1) * cos_w0),
+           (a + 1) - (a - 1) * cos_w0 - 2 * np.sqrt(a) * alpha]
+    return b, den
+
+
+def _high_pass(sr, q=0.5003270373238773, fc=38.13547087602444):
+    w0 = 2 * np.pi * fc / sr
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    den = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    return b, den
+
+
+def integrated_loudness(y, sr):
+    """Gated integrated loudness in LUFS (ITU-R BS.1770) of mono audio"""
+    for b, a in (_high_shelf(sr), _high_pass(sr)):
+        y = lfilter(b, a, y)
+
+    # Mean square of 400 ms blocks with 75% overlap from one cumulative sum
+    block = int(0.4 * sr)
+    step = int(0.1 * sr)
+    if len(y) < block:
+        block = step = len(y)
+    if block == 0:
+        return -70.0
+
+    energy = np.concatenate([[0.0], np.cumsum(y.astype(np.float64) ** 2)])
+    starts = np.arange(0, len(y) - block + 1, step)
+    z = (energy[starts + block] - energy[starts]) / block
+
+    z = z[-0.691 + 10 * np.log10(np.maximum(z, 1e-12)) > -70]
+    if not len(z):
+        return -70.0
+
+    relative_gate = -0.691 + 10 * np.log10(z.mean()) - 10
+    z = z[-0.691 + 10 * np.log10(z) > relative_gate]
+    return float(-0.691 + 10 * np.log10(z.mean()))
+
+
+def extract_features(y, sr, with_key=True):
+    """Compute feature record of decoded mono audio"""
+    tempo = estimate_tempo(y, sr)
+
+    # Onsets are counted over the part of the audio the envelope covers
+    onset_env = tempo['onset_env']
+    onsets = librosa.onset.onset_detect(onset_envelope=onset_env, sr=tempo['frame_rate'], hop_length=1)
+    onset_window = len(onset_env) / tempo['frame_rate']
+    window = len(y) / sr
+
+    peak = float(np.abs(y).max()) if len(y) else 0.0
+    rms = float(np.sqrt(np.mean(y.astype(np.float64) ** 2))) if len(y) else 0.0
+    spectrum = analysis_spectrum(y)
+    centroid = librosa.feature.spectral_centroid(S=spectrum, sr=sr, n_fft=ANALYSIS_N_FFT)
+
+    features = {
+        'bpm': tempo['bpm'],
+        'bpm_confidence': round(tempo['confidence'], 3),
+        'bpm_method': tempo['method'],
+        'bpm_ambiguous': tempo['alternative'] is not None,
+        'bpm_alternative': tempo['alternative'],
+        'beats': [round(float(t), 3) for t in tempo['beats']],
+        'duration': round(window, 3),
+        'peak_db': round(float(20 * np.log10(max(peak, 1e-10))), 2),
+        'rms_db': round(float(20 * np.log10(max(rms, 1e-10))), 2),
+        'lufs': round(integrated_loudness(y, sr), 2),
+        'spectral_centroid': round(float(centroid.mean()), 1),
+        'onset_density': round(len(onsets) / onset_window, 3) if onset_window else 0.0,
+        'features_version': FEATURES_VERSION,
+    }
+
+    if with_key:
+        key, confidence = estimate_key(y, sr, spectrum)
+        features['key'] = key
+        features['key_confidence'] = round(confidence, 3)
+    return features
+
+
+def get_file_duration(file_path):
+    """Get full file duration from header when possible"""
+    try:
+        return sf.info(file_path).duration
+    except Exception:
+        return librosa.get_duration(path=file_path)
+
+
+def load_for_analysis(file_path):
+    """Decode start of file as mono audio at analysis rate"""
+    return librosa.load(file_path, duration=ANALYSIS_DURATION, mono=True, sr=ANALYSIS_SAMPLE_RATE)
+
+
+def analyze_file(file_path, with_key=True):
+    """Compute feature record from one decode of the file"""
+    y, sr = load_for_analysis(file_path)
+
+    features = extract_features(y, sr, with_key)
+    features['duration'] = round(get_file_duration(file_path), 3)
+    return features
+
+
+def analyze_batch(file_paths, with_key=True):
+    """Analyze several files, None for files that fail"""
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append((file_path, analyze_file(file_path, with_key)))
+        except Exception:
+            results.append((file_path, None))
+    return results
@@ -0,0 +1,229 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+
+from candidate_index import CAMELOT_KEYS
+from mix_engine import BIT_DEPTHS, OUTPUT_FORMATS
+from music_mixer_logic import MusicMixer
+from sample_ingest import link_or_copy
+from time_stretch import TEMPO_MODES
+from tracing import Trace
+
+# Mixer of the current worker process, reused for all its jobs so the
+# decoded sample cache and in-memory analysis results carry over
+_worker_mixer = None
+
+MIX_MODES = ('standard', 'experimental')
+
+# Workers render into this directory inside the output directory, so mixes
+# are linked on the same filesystem and nothing is left in the shared workspace
+RENDER_CACHE_DIR = '.render_cache'
+
+
+def build_grid(layers, bpms, keys, modes, seeds, tempo_modes=('resample',)):
+    """Expand parameter lists into a job for every combination"""
+    return [
+        {'layers': n, 'bpm': bpm, 'key': key, 'mode': mode, 'seed': seed, 'tempo_mode': tempo_mode}
+        for n, bpm, key, mode, seed, tempo_mode in itertools.product(layers, bpms, keys, modes, seeds, tempo_modes)
+    ]
+
+
+def load_jobs(path):
+    """Load job list from JSON file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        jobs = json.load(f)
+    if isinstance(jobs, dict):
+        jobs = jobs.get('jobs', [])
+    return jobs
+
+
+def validate_job(job):
+    """Raise ValueError describing the first setting of job that can't be rendered"""
+    if not isinstance(job, dict):
+        raise ValueError(f"Job must be an object, got {job!r}")
+
+    layers = job.get('layers', 3)
+    if not isinstance(layers, int) or isinstance(layers, bool) or layers < 1:
+        raise ValueError(f"Invalid layers: {layers!r}, expected a positive integer")
+
+    bpm = job.get('bpm', 128)
+    if not isinstance(bpm, (int, float)) or isinstance(bpm, bool) or bpm <= 0:
+        raise ValueError(f"Invalid bpm: {bpm!r}, expected a positive number")
+
+    key = job.get('key', '8A')
+    if key not in CAMELOT_KEYS:
+        raise ValueError(f"Invalid key: {key!r}, expected a Camelot key like 8A")
+
+    mode = job.get('mode', 'standard')
+    if mode not in MIX_MODES:
+        raise ValueError(f"Invalid mode: {mode!r}, expected one of {', '.join(MIX_MODES)}")
+
+    tempo_mode = job.get('tempo_mode', 'resample')
+    if tempo_mode not in TEMPO_MODES:
+        raise ValueError(f"Invalid tempo_mode: {tempo_mode!r}, expected one of {', '.join(TEMPO_MODES)}")
+
+
+def _init_worker(library_dir, render_cache_dir):
+    global _worker_mixer
+    _worker_mixer = MusicMixer(samples_dir=library_dir, analysis_workers=1, render_cache_dir=render_cache_dir)
+    # Pool workers skip atexit handlers, multiprocessing finalizers still run
+    Finalize(_worker_mixer, _worker_mixer.cleanup, exitpriority=10)
+
+
+def render_job(index, job, output_dir, duration_ms, output_format, bit_depth=None, frame_rate=None):
+    """Render one job in the current worker process"""
+    mixer = _worker_mixer
+    mixer.target_bpm = job.get('bpm', 128)
+    mixer.current_key = job.get('key', '8A')
+    mixer.experimental_mode = job.get('mode', 'standard') == 'experimental'
+    mixer.tempo_mode = job.get('tempo_mode', 'resample')
+
+    seed = job.get('seed')
+    mixer.seed = seed
+
+    name = (f"mix_{index:04d}_{job.get('layers', 3)}l_{mixer.target_bpm}bpm_{mixer.current_key}_"
+            f"{job.get('mode', 'standard')}_s{seed}.{output_format}")
+    output_path = os.path.join(output_dir, name)
+
+    start = time.perf_counter()
+    entry = {'index': index, 'job': job, 'output': None, 'frame_rate': None, 'channels': None, 'composition': None,
+             'error': None}
+    try:
+        with Trace('batch_mix') as trace:
+            plan = mixer.plan_composition(job.get('layers', 3), duration_ms=job.get('duration_ms', duration_ms))
+            plan = mixer.resolve_plan(plan)
+            if not plan['layers']:
+                raise ValueError("Could not create composition")
+
+            # Repeated plans are served from the render cache
+            rendered_path = mixer.render_plan(plan, output_format, bit_depth, frame_rate)
+        link_or_copy(rendered_path, output_path)
+        entry['output'] = name
+        # Raw output has no header, its layout is only known from here
+        entry['frame_rate'], entry['channels'] = mixer.render_layout(plan, output_format, frame_rate)
+        entry['composition'] = mixer.get_composition_info(plan, trace)
+    except Exception as e:
+        entry['error'] = str(e)
+
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run_batch(library_dir, jobs, output_dir, workers=None, duration_ms=30000, output_format='wav',
+              analyze_library=True, progress_callback=None, bit_depth=None, frame_rate=None):
+    """Render all jobs in parallel worker processes and write a JSON manifest"""
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    if analyze_library:
+        # Analyze the whole library once up front; workers then read the shared index
+        mixer = MusicMixer(samples_dir=library_dir, analysis_workers=workers)
+        try:
+            mixer.analyze_samples(mixer.get_all_samples())
+        finally:
+            mixer.cleanup()
+
+    # Jobs with invalid settings fail up front instead of rendering something else
+    entries = []
+    valid = []
+    for index, job in enumerate(jobs):
+        try:
+            validate_job(job)
+            valid.append((index, job))
+        except ValueError as e:
+            entries.append({'index': index, 'job': job, 'output': None, 'frame_rate': None, 'channels': None,
+                            'composition': None, 'error': str(e), 'seconds': 0.0})
+            if progress_callback:
+                progress_callback(len(entries), len(jobs), entries[-1])
+
+    # Repeated plans within the run are still served from the render cache
+    render_cache_dir = os.path.join(output_dir, RENDER_CACHE_DIR)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(library_dir, render_cache_dir)) as executor:
+            futures = [
+                executor.submit(render_job, index, job, output_dir, duration_ms, output_format, bit_depth, frame_rate)
+                for index, job in valid
+            ]
+            for future in as_completed(futures):
+                entries.append(future.result())
+                if progress_callback:
+                    progress_callback(len(entries), len(jobs), entries[-1])
+    finally:
+        shutil.rmtree(render_cache_dir, ignore_errors=True)
+
+    entries.sort(key=lambda entry: entry['index'])
+    elapsed = time.perf_counter() - start
+    succeeded = sum(1 for entry in entries if not entry['error'])
+
+    manifest = {
+        'library': os.path.abspath(library_dir),
+        'format': output_format,
+        'bit_depth': bit_depth,
+        'sample_rate': frame_rate,
+        'jobs': len(jobs),
+        'succeeded': succeeded,
+        'failed': len(jobs) - succeeded,
+        'elapsed_seconds': round(elapsed, 3),
+        'mixes_per_minute': round(succeeded / elapsed * 60, 2) if elapsed else 0.0,
+        'mixes': entries,
+    }
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render many mixes from a sample library without the web UI")
+    parser.add_argument("library", help="Directory with audio samples")
+    parser.add_argument("-o", "--output", default="mixes", help="Output directory (default: mixes)")
+    parser.add_argument("--jobs", help="JSON file with a list of jobs instead of a parameter grid")
+    parser.add_argument("--layers", type=int, nargs="+", default=[3])
+    parser.add_argument("--bpm", type=int, nargs="+", default=[128])
+    parser.add_argument("--key", nargs="+", choices=CAMELOT_KEYS, default=["8A"], metavar="KEY")
+    parser.add_argument("--mode", nargs="+", choices=MIX_MODES, default=["standard"])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--tempo-mode", nargs="+", choices=TEMPO_MODES, default=["resample"])
+    parser.add_argument("--duration", type=float, default=30, help="Mix length in seconds")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), default="wav",
+                        help="Output format; f32 is headerless little-endian float32 for other tools")
+    parser.add_argument("--bit-depth", type=int, choices=sorted({d for depths in BIT_DEPTHS.values() for d in depths}),
+                        help="Sample bit depth for wav/flac output")
+    parser.add_argument("--sample-rate", type=int, help="Output sample rate (default: highest sample rate)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--no-analyze", action="store_true", help="Skip analyzing the whole library first")
+    args = parser.parse_args()
+
+    if args.jobs:
+        jobs = load_jobs(args.jobs)
+    else:
+        jobs = build_grid(args.layers, args.bpm, args.key, args.mode, args.seeds, args.tempo_mode)
+
+    def report(done, total, entry):
+        status = entry['output'] if not entry['error'] else f"failed: {entry['error']}"
+        print(f"[{done}/{total}] {status}")
+
+    manifest = run_batch(
+        args.library, jobs, args.output,
+        workers=args.workers,
+        duration_ms=int(args.duration * 1000),
+        output_format=args.format,
+        analyze_library=not args.no_analyze,
+        progress_callback=report,
+        bit_depth=args.bit_depth,
+        frame_rate=args.sample_rate
+    )
+
+    print(f"Rendered {manifest['succeeded']}/{manifest['jobs']} mixes in {manifest['elapsed_seconds']:.1f} s "
+          f"({manifest['mixes_per_minute']:.1f} mixes/min)")
+
+
+if __name__ == "__main__":
+    main()
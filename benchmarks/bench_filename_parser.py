@@ -0,0 +1,118 @@
+import argparse
+import os
+import random
+import re
+import time
+
+from candidate_index import CAMELOT_KEYS
+from filename_parser import CATEGORY_KEYWORDS, FilenameParser
+
+MUSICAL_KEYS = {
+    'cmaj': '8B', 'c major': '8B', 'c#maj': '3B', 'c# major': '3B',
+    'dmaj': '10B', 'd major': '10B', 'd#maj': '5B', 'd# major': '5B',
+    'emaj': '12B', 'e major': '12B', 'fmaj': '7B', 'f major': '7B',
+    'f#maj': '2B', 'f# major': '2B', 'gmaj': '9B', 'g major': '9B',
+    'g#maj': '4B', 'g# major': '4B', 'amaj': '11B', 'a major': '11B',
+    'a#maj': '6B', 'a# major': '6B', 'bmaj': '1B', 'b major': '1B',
+    'cmin': '5A', 'c minor': '5A', 'c#min': '12A', 'c# minor': '12A',
+    'dmin': '7A', 'd minor': '7A', 'd#min': '2A', 'd# minor': '2A',
+    'emin': '9A', 'e minor': '9A', 'fmin': '4A', 'f minor': '4A',
+    'f#min': '11A', 'f# minor': '11A', 'gmin': '6A', 'g minor': '6A',
+    'g#min': '1A', 'g# minor': '1A', 'amin': '8A', 'a minor': '8A',
+    'a#min': '3A', 'a# minor': '3A', 'bmin': '10A', 'b minor': '10A',
+}
+
+
+def legacy_key(filename):
+    """Previous extract_key_from_filename implementation"""
+    for pattern in [r'\b(\d{1,2}[AB])\b', r'key[\s_-]*(\d{1,2}[AB])', r'(\d{1,2}[AB])[\s_-]*key']:
+        match = re.search(pattern, filename, re.IGNORECASE)
+        if match and match.group(1).upper() in CAMELOT_KEYS:
+            return match.group(1).upper()
+
+    for key_pattern, camelot_key in MUSICAL_KEYS.items():
+        if key_pattern in filename.lower():
+            return camelot_key
+    return None
+
+
+def legacy_bpm(filename):
+    """Previous extract_bpm_from_filename implementation"""
+    patterns = [
+        r'(\d{2,3})bpm', r'bpm[\s_-]*(\d{2,3})', r'[\s_-](\d{2,3})[\s_-]bpm',
+        r'^(\d{2,3})[\s_-]', r'[\s_-](\d{2,3})$', r'\((\d{2,3})\)',
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, filename, re.IGNORECASE)
+        if match and 80 <= int(match.group(1)) <= 180:
+            return int(match.group(1))
+    return None
+
+
+def legacy_category(filename):
+    """Previous categorize_sample implementation"""
+    for category, keywords in CATEGORY_KEYWORDS:
+        if any(word in filename for word in keywords):
+            return category
+    return 'other'
+
+
+def legacy_parse_path(file_path):
+    """Previous per-field parsing of file name with parent directory fallback"""
+    filename = os.path.basename(file_path).lower()
+    parent_dir = os.path.basename(os.path.dirname(file_path)).lower()
+    return {
+        'bpm': legacy_bpm(filename) or legacy_bpm(parent_dir),
+        'key': legacy_key(filename) or legacy_key(parent_dir),
+        'category': legacy_category(filename),
+    }
+
+
+def make_names(count, seed=0):
+    """Create sample paths in the naming schemes of common sample packs"""
+    rng = random.Random(seed)
+    words = [word for _, keywords in CATEGORY_KEYWORDS for word in keywords] + ['texture', 'perc', 'one shot', 'top']
+    notes = ['C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
+    schemes = [
+        lambda: f"{rng.choice(words)}_{rng.choice(CAMELOT_KEYS)}_{rng.randint(80, 180)}bpm.wav",
+        lambda: f"{rng.randint(80, 180)} {rng.choice(words).title()} {rng.choice(notes)}min.wav",
+        lambda: f"PK_{rng.choice(words)}_loop_{rng.randint(1, 40):02d}.wav",
+        lambda: f"{rng.choice(words)} {rng.choice(notes)} major ({rng.randint(80, 180)}).flac",
+        lambda: f"{rng.choice(words)}-{rng.choice(words)}-key{rng.choice(CAMELOT_KEYS)}.aiff",
+    ]
+    folders = ['', 'Drums', f'{rng.randint(80, 180)} BPM', 'Construction Kit 8A', 'Loops']
+    return [os.path.join('/samples', rng.choice(folders), rng.choice(schemes)()) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure filename metadata parsing throughput")
+    parser.add_argument("--names", type=int, default=1000000)
+    parser.add_argument("--legacy-names", type=int, default=100000,
+                        help="names parsed with the previous implementation, which is much slower")
+    args = parser.parse_args()
+
+    names = make_names(args.names)
+    print(f"{len(names)} synthetic sample paths")
+
+    legacy_names = names[:args.legacy_names]
+    start = time.perf_counter()
+    legacy = [legacy_parse_path(name) for name in legacy_names]
+    legacy_seconds = time.perf_counter() - start
+    print(f"{'legacy':>10}: {len(legacy_names) / legacy_seconds:10.0f} names/s")
+
+    # A fresh parser per run so its cache doesn't hide the work
+    filename_parser = FilenameParser()
+    start = time.perf_counter()
+    parsed = [filename_parser.parse_path(name) for name in names]
+    seconds = time.perf_counter() - start
+    print(f"{'compiled':>10}: {len(names) / seconds:10.0f} names/s "
+          f"({legacy_seconds / len(legacy_names) * len(names) / seconds:.1f}x)")
+
+    for field in ('bpm', 'key', 'category'):
+        differ = sum((new[field] or 'other' if field == 'category' else new[field]) != old[field]
+                     for new, old in zip(parsed, legacy))
+        print(f"{field:>10}: {differ} of {len(legacy)} names read differently than before")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import math
+import time
+
+import numpy as np
+
+from mix_engine import DEFAULT_BLOCK_MS, array_to_segment, conform_array, iter_mix_blocks, write_encoded
+from pydub import AudioSegment
+
+
+def make_layers(num_layers, frame_rate=44100, seed=0):
+    """Create random stereo loops of different lengths"""
+    rng = np.random.default_rng(seed)
+    layers = []
+    for i in range(num_layers):
+        length = int(frame_rate * (4 + i % 4))
+        data = (rng.standard_normal((length, 2)) * 0.1).astype(np.float32)
+        layers.append({
+            'audio': array_to_segment(data, frame_rate), 'data': data, 'frame_rate': frame_rate,
+            'volume': 0.3 + 0.05 * i
+        })
+    return layers
+
+
+def pydub_mix(layers, duration_ms):
+    """Previous generate_mix_audio implementation"""
+    mix_audio = AudioSegment.silent(duration=duration_ms)
+
+    for layer in layers:
+        audio_with_gain = layer['audio'].apply_gain(20 * math.log10(layer['volume']))
+
+        looped_audio = AudioSegment.empty()
+        while len(looped_audio) < duration_ms:
+            looped_audio += audio_with_gain
+
+        mix_audio = mix_audio.overlay(looped_audio[:duration_ms])
+
+    return mix_audio
+
+
+def block_mix(layers, duration_ms, block_ms=DEFAULT_BLOCK_MS):
+    """Current generate_mix_audio implementation: bus gain and block by block mixing"""
+    frame_rate = max(layer['frame_rate'] for layer in layers)
+    channels = max(layer['data'].shape[1] for layer in layers)
+    arrays = [conform_array(layer['data'], layer['frame_rate'], frame_rate, channels) for layer in layers]
+    n_frames = int(round(duration_ms * frame_rate / 1000))
+    block_frames = max(1, int(frame_rate * block_ms / 1000))
+    blocks = iter_mix_blocks(arrays, [layer['volume'] for layer in layers], n_frames, block_frames,
+                             frame_rate=frame_rate)
+    return blocks, frame_rate, channels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pydub mixing with the NumPy block renderer")
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--output", default=None, help="Optional WAV path to also time export")
+    args = parser.parse_args()
+
+    layers = make_layers(args.layers)
+    duration_ms = int(args.minutes * 60000)
+
+    start = time.perf_counter()
+    mixed = pydub_mix(layers, duration_ms)
+    if args.output:
+        mixed.export(args.output, format="wav")
+    pydub_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    blocks, frame_rate, channels = block_mix(layers, duration_ms)
+    if args.output:
+        write_encoded(args.output, blocks, frame_rate, channels)
+    else:
+        for _ in blocks:
+            pass
+    numpy_time = time.perf_counter() - start
+
+    print(f"{args.layers} layers x {args.minutes:g} min")
+    print(f"pydub: {pydub_time:.2f} s")
+    print(f"numpy blocks: {numpy_time:.2f} s ({pydub_time / numpy_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
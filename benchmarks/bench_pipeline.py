@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import librosa
+import numpy as np
+
+from analysis_index import AnalysisIndex
+from audio_analysis import ANALYSIS_SAMPLE_RATE, analyze_file, estimate_tempo
+from benchmarks.synth_library import DEFAULT_UNIQUE, LOOP_BARS, SYNTH_FORMATS, load_library
+from mix_engine import encoder_available
+from music_mixer_logic import MusicMixer
+from sample_cache import DecodedSampleCache
+from sample_library import forget_library, get_library
+from tracing import Trace, peak_rss_bytes
+from workspace import Workspace
+
+# Bump when the layout of the results file changes
+RESULTS_VERSION = 1
+
+
+def summarize(timings):
+    """Min, median, mean and max of timings in seconds"""
+    return {
+        'runs': len(timings),
+        'min': round(min(timings), 6),
+        'median': round(statistics.median(timings), 6),
+        'mean': round(statistics.mean(timings), 6),
+        'max': round(max(timings), 6),
+    }
+
+
+def git_revision():
+    """Short hash of the checked out commit, None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """Versions and hardware the results were measured with"""
+    return {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'librosa': librosa.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def new_mixer(library_dir, work_dir, workers=1):
+    """Mixer with its own empty analysis index, sample cache and workspace"""
+    os.makedirs(work_dir, exist_ok=True)
+    return MusicMixer(
+        samples_dir=library_dir,
+        analysis_index=AnalysisIndex(os.path.join(work_dir, 'analysis_index.sqlite')),
+        analysis_workers=workers,
+        sample_cache=DecodedSampleCache(),
+        workspace=Workspace(os.path.join(work_dir, 'workspace')),
+    )
+
+
+def bench_scan(library_dir, repeat):
+    """Time a full scan of an unknown library and a refresh of an unchanged one"""
+    cold = []
+    for _ in range(repeat):
+        forget_library(library_dir)
+        start = time.perf_counter()
+        library = get_library(library_dir)
+        cold.append(time.perf_counter() - start)
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        get_library(library_dir)
+        warm.append(time.perf_counter() - start)
+
+    return {'files': len(library), 'cold': summarize(cold), 'warm': summarize(warm),
+            'files_per_second': round(len(library) / min(cold), 1)}
+
+
+def bench_classify(library_dir, work_dir, repeat):
+    """Time building the candidate index of a library from names only"""
+    timings = []
+    for run in range(repeat):
+        mixer = new_mixer(library_dir, os.path.join(work_dir, f'classify_{run}'))
+        start = time.perf_counter()
+        mixer.get_candidate_index()
+        timings.append(time.perf_counter() - start)
+        mixer.cleanup()
+    return {'cold': summarize(timings)}
+
+
+def bench_analysis(library_dir, work_dir, truth, limit, workers):
+    """Time analyzing up to limit unique files and check results against the ground truth"""
+    samples = [entry for entry in truth['samples'] if entry['source'] is None][:limit]
+    paths = [os.path.join(library_dir, entry['path']) for entry in samples]
+
+    # Compile librosa's numba kernels first so they aren't timed as analysis;
+    # silence has no periodicity, so it also warms up full beat tracking
+    if paths:
+        analyze_file(paths[0])
+        estimate_tempo(np.zeros(ANALYSIS_SAMPLE_RATE, dtype=np.float32), ANALYSIS_SAMPLE_RATE)
+
+    mixer = new_mixer(library_dir, os.path.join(work_dir, 'analysis'), workers)
+    start = time.perf_counter()
+    mixer.analyze_samples(paths)
+    cold = time.perf_counter() - start
+
+    # A second mixer reads everything back from the persisted index
+    reader = new_mixer(library_dir, os.path.join(work_dir, 'analysis'), workers)
+    start = time.perf_counter()
+    reader.analyze_samples(paths)
+    warm = time.perf_counter() - start
+
+    bpm_exact = bpm_octave = key_exact = key_found = pitched = 0
+    for entry, path in zip(samples, paths):
+        record = mixer.feature_cache.get(path, {})
+        bpm = record.get('bpm')
+        if bpm == entry['bpm']:
+            bpm_exact += 1
+        elif bpm and min(abs(bpm * 2 - entry['bpm']), abs(bpm / 2 - entry['bpm'])) <= 1:
+            bpm_octave += 1
+        if entry['sound'] != 'drums':
+            pitched += 1
+            key_found += record.get('key') is not None
+            key_exact += record.get('key') == entry['key']
+
+    mixer.cleanup()
+    reader.cleanup()
+    return {
+        'files': len(paths),
+        'workers': workers,
+        'cold_seconds': round(cold, 4),
+        'warm_seconds': round(warm, 4),
+        'files_per_second': round(len(paths) / cold, 2) if cold else None,
+        'bpm_accuracy': round(bpm_exact / len(paths), 3) if paths else None,
+        'bpm_octave_errors': round(bpm_octave / len(paths), 3) if paths else None,
+        'key_accuracy': round(key_exact / pitched, 3) if pitched else None,
+        'key_detected': round(key_found / pitched, 3) if pitched else None,
+    }
+
+
+def bench_composition(mixer, layer_counts, repeat):
+    """Time planning compositions of several layer counts; picked samples are analyzed when rendering"""
+    results = []
+    for num_layers in layer_counts:
+        timings = []
+        layers = []
+        for run in range(repeat):
+            mixer.seed = run
+            start = time.perf_counter()
+            plan = mixer.plan_composition(num_layers)
+            timings.append(time.perf_counter() - start)
+            layers.append(len(plan['layers']))
+        results.append({'layers': num_layers, 'planned_layers': statistics.mean(layers), 'seconds': summarize(timings)})
+    return results
+
+
+def bench_render(mixer, layer_counts, durations, repeat, output_format, trace_memory):
+    """Time rendering new plans, the first run of each with an empty decoded sample cache"""
+    results = []
+    seed = 1000
+    for num_layers in layer_counts:
+        for duration in durations:
+            timings = []
+            traces = []
+            errors = 0
+            mixer.sample_cache.clear()
+            for _ in range(repeat):
+                # A new seed every run so the render cache never answers
+                seed += 1
+                mixer.seed = seed
+                plan = mixer.plan_composition(num_layers, duration_ms=int(duration * 1000))
+                try:
+                    with Trace('benchmark', memory=trace_memory) as trace:
+                        start = time.perf_counter()
+                        mixer.render_plan(plan, output_format)
+                        timings.append(time.perf_counter() - start)
+                    traces.append(trace.report())
+                except Exception as e:
+                    errors += 1
+                    print(f"  render failed: {e}")
+
+            results.append({
+                'layers': num_layers,
+                'duration_seconds': duration,
+                'format': output_format,
+                'seconds': summarize(timings) if timings else None,
+                'realtime_factor': round(duration / min(timings), 1) if timings else None,
+                'errors': errors,
+                'traces': traces,
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time scan, analysis, composition and render on synthetic libraries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Library sizes in files (up to 50000)")
+    parser.add_argument("--layers", type=int, nargs="+", default=[2, 4, 6])
+    parser.add_argument("--durations", type=float, nargs="+", default=[10, 30], help="Mix lengths in seconds")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--formats", nargs="+", choices=sorted(SYNTH_FORMATS), default=['wav'],
+                        help="Sample formats in the libraries; all but wav need ffmpeg to render")
+    parser.add_argument("--unique", type=int, default=DEFAULT_UNIQUE, help="Files synthesized per library")
+    parser.add_argument("--max-bars", type=int, choices=LOOP_BARS, default=4)
+    parser.add_argument("--analysis-files", type=int, default=100,
+                        help="Files analyzed per library, analysis of large libraries takes hours")
+    parser.add_argument("--workers", type=int, default=1, help="Analysis worker processes")
+    parser.add_argument("--render-format", default="wav")
+    parser.add_argument("--trace-memory", action="store_true", help="Record peak allocations per render stage")
+    parser.add_argument("--libraries", help="Directory to keep generated libraries in for later runs")
+    parser.add_argument("-o", "--output", help="Write results as JSON to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Layers are decoded with pydub, which only reads WAV without ffmpeg
+    if shutil.which('ffmpeg') is None and set(args.formats) - {'wav'}:
+        skipped = sorted(set(args.formats) - {'wav'})
+        args.formats = [name for name in args.formats if name == 'wav']
+        print(f"ffmpeg not found, skipping {', '.join(skipped)} samples")
+        if not args.formats:
+            parser.error("no sample format left to render without ffmpeg")
+    if not encoder_available(args.render_format):
+        parser.error(f"cannot write {args.render_format} output here")
+
+    work_root = tempfile.mkdtemp(prefix='aha_bench_')
+    libraries_root = args.libraries or os.path.join(work_root, 'libraries')
+    results = {
+        'version': RESULTS_VERSION,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'parameters': vars(args),
+        'libraries': [],
+    }
+
+    try:
+        for size in args.sizes:
+            library_dir = os.path.join(libraries_root, f"library_{size}_s{args.seed}")
+            start = time.perf_counter()
+            truth = load_library(library_dir, size, tuple(args.formats), args.unique, seed=args.seed,
+                                 max_bars=args.max_bars)
+            generate_seconds = time.perf_counter() - start
+            work_dir = os.path.join(work_root, f"work_{size}")
+            print(f"Library of {size} files ({truth['synthesized']} synthesized) ready in {generate_seconds:.1f} s")
+
+            scan = bench_scan(library_dir, args.repeat)
+            print(f"  scan: {scan['cold']['min'] * 1000:.1f} ms cold, {scan['warm']['min'] * 1000:.1f} ms warm")
+
+            classify = bench_classify(library_dir, work_dir, args.repeat)
+            print(f"  classify: {classify['cold']['min'] * 1000:.1f} ms")
+
+            analysis = bench_analysis(library_dir, work_dir, truth, args.analysis_files, args.workers)
+            print(f"  analysis: {analysis['files_per_second']} files/s, BPM accuracy {analysis['bpm_accuracy']}, "
+                  f"key accuracy {analysis['key_accuracy']}")
+
+            # Compose and render with the analyzed index, like a warmed-up server
+            mixer = new_mixer(library_dir, os.path.join(work_dir, 'analysis'), args.workers)
+            composition = bench_composition(mixer, args.layers, args.repeat)
+            for entry in composition:
+                print(f"  plan {entry['layers']} layers: {entry['seconds']['median'] * 1000:.1f} ms")
+
+            render = bench_render(mixer, args.layers, args.durations, args.repeat, args.render_format,
+                                  args.trace_memory)
+            for entry in render:
+                if entry['seconds']:
+                    print(f"  render {entry['layers']} layers x {entry['duration_seconds']:g} s: "
+                          f"{entry['seconds']['median']:.2f} s ({entry['realtime_factor']}x real time)")
+            mixer.cleanup()
+
+            results['libraries'].append({
+                'size': size,
+                'synthesized': truth['synthesized'],
+                'generate_seconds': round(generate_seconds, 3),
+                'scan': scan,
+                'classify': classify,
+                'analysis': analysis,
+                'composition': composition,
+                'render': render,
+                'peak_rss_bytes': peak_rss_bytes(),
+            })
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import time
+
+import numpy as np
+
+from time_stretch import TEMPO_MODES, stretch
+
+
+def make_loop(seconds, bpm, frame_rate=44100, seed=0):
+    """Create stereo loop with decaying tones on every beat"""
+    rng = np.random.default_rng(seed)
+    data = np.zeros((int(seconds * frame_rate), 2), dtype=np.float32)
+    beat = int(frame_rate * 60 / bpm)
+    t = np.arange(beat) / frame_rate
+    for start in range(0, len(data) - beat, beat):
+        tone = np.sin(2 * np.pi * rng.uniform(100, 1000) * t) * np.exp(-t * 8)
+        data[start:start + beat] += tone[:, None].astype(np.float32) * 0.5
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure tempo engine throughput")
+    parser.add_argument("--seconds", type=float, default=16)
+    parser.add_argument("--bpm", type=float, default=120)
+    parser.add_argument("--target-bpm", type=float, default=128)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frame_rate = 44100
+    speed = args.target_bpm / args.bpm
+
+    print(f"{args.seconds:g} s stereo loop, {args.bpm:g} -> {args.target_bpm:g} BPM")
+    for mode in TEMPO_MODES:
+        timings = []
+        for i in range(args.repeat):
+            data = make_loop(args.seconds, args.bpm, frame_rate, seed=i + 1)
+            start = time.perf_counter()
+            stretch(data, frame_rate, speed, mode, bpm=args.bpm)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        print(f"{mode:>14}: {best * 1000:8.1f} ms, real-time factor {best / args.seconds:.4f} "
+              f"({args.seconds / best:.0f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
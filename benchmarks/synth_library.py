@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import soundfile as sf
+
+from candidate_index import pitch_class_to_camelot
+from sample_ingest import link_or_copy
+
+# Formats written, with the soundfile format and subtype of each
+SYNTH_FORMATS = {
+    'wav': ('WAV', 'PCM_16'),
+    'flac': ('FLAC', 'PCM_16'),
+    'aiff': ('AIFF', 'PCM_16'),
+    'mp3': ('MP3', 'MPEG_LAYER_III'),
+}
+
+# Sounds synthesized and the mixer category their names put them in
+SYNTH_SOUNDS = {'drums': 'drums', 'bass': 'bass', 'pad': 'harmony'}
+SYNTH_BPMS = (90, 100, 110, 120, 124, 126, 128, 130, 140, 150, 170)
+LOOP_BARS = (1, 2, 4, 8)
+
+# Naming schemes of common sample packs; 'plain' names carry no metadata
+NAMING_SCHEMES = ('camelot', 'musical', 'folder', 'plain')
+
+NOTE_NAMES = ['C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
+
+# Camelot key -> (tonic pitch class, minor)
+CAMELOT_TONICS = {
+    pitch_class_to_camelot(pitch_class, minor): (pitch_class, minor)
+    for pitch_class in range(12) for minor in (False, True)
+}
+
+# Files synthesized at most; the rest of a library are hard links to them under new names
+DEFAULT_UNIQUE = 200
+
+
+def note_frequency(pitch_class, octave):
+    """Frequency of pitch class in octave (A4 = 440 Hz)"""
+    return 440.0 * 2 ** ((pitch_class - 9) / 12 + octave - 4)
+
+
+def _envelope(n, frame_rate, decay):
+    return np.exp(-np.arange(n) / frame_rate * decay)
+
+
+def synth_drums(bpm, bars, frame_rate, rng):
+    """Kick on every beat, snare on 2 and 4, closed hats on the off-beats"""
+    beat = frame_rate * 60.0 / bpm
+    n = int(round(beat * 4 * bars))
+    out = np.zeros(n)
+
+    hit = int(0.25 * frame_rate)
+    t = np.arange(hit) / frame_rate
+    kick = np.sin(2 * np.pi * (45 + 90 * np.exp(-t * 30)) * t) * _envelope(hit, frame_rate, 12)
+    snare = rng.standard_normal(hit) * _envelope(hit, frame_rate, 25) * 0.5
+    hat = rng.standard_normal(hit // 4) * _envelope(hit // 4, frame_rate, 80) * 0.2
+
+    for beat_number in range(4 * bars):
+        start = int(round(beat_number * beat))
+        off = int(round((beat_number + 0.5) * beat))
+        for sound, position in ((kick, start), (hat, off)) + (((snare, start),) if beat_number % 2 else ()):
+            end = min(n, position + len(sound))
+            out[position:end] += sound[:end - position]
+    return out
+
+
+def synth_bass(bpm, bars, frame_rate, pitch_class, minor, rng):
+    """Eighth-note bassline on root and fifth of the key"""
+    step = frame_rate * 30.0 / bpm
+    n = int(round(step * 8 * bars))
+    out = np.zeros(n)
+    third = 3 if minor else 4
+
+    for i in range(8 * bars):
+        interval = rng.choice([0, 0, 7, third, 12])
+        length = int(step * 0.9)
+        t = np.arange(length) / frame_rate
+        phase = (note_frequency(pitch_class + interval, 2) * t) % 1.0
+        start = int(round(i * step))
+        end = min(n, start + length)
+        out[start:end] += ((2 * phase - 1) * _envelope(length, frame_rate, 6) * 0.6)[:end - start]
+    return out
+
+
+def synth_pad(bpm, bars, frame_rate, pitch_class, minor, rng):
+    """Sustained triad of the key's tonic chord with slow swell, in stereo"""
+    n = int(round(frame_rate * 60.0 / bpm * 4 * bars))
+    t = np.arange(n) / frame_rate
+    third = 3 if minor else 4
+
+    out = np.zeros((n, 2))
+    for interval in (0, third, 7, 12):
+        for channel in range(2):
+            detune = 1 + rng.uniform(-0.003, 0.003)
+            out[:, channel] += np.sin(2 * np.pi * note_frequency(pitch_class + interval, 4) * detune * t)
+
+    swell = np.minimum(1.0, t / 0.5) * np.minimum(1.0, (t[-1] - t) / 0.5 + 0.05)
+    return out * swell[:, None] * 0.15
+
+
+def synth_loop(sound, bpm, key, bars, frame_rate, rng):
+    """Synthesize loop of sound at BPM in Camelot key"""
+    pitch_class, minor = CAMELOT_TONICS[key]
+    if sound == 'drums':
+        data = synth_drums(bpm, bars, frame_rate, rng)
+    elif sound == 'bass':
+        data = synth_bass(bpm, bars, frame_rate, pitch_class, minor, rng)
+    else:
+        data = synth_pad(bpm, bars, frame_rate, pitch_class, minor, rng)
+
+    peak = np.abs(data).max()
+    return (data / peak * 0.8 if peak > 0 else data).astype(np.float32)
+
+
+def sample_name(entry, number, scheme):
+    """Relative path of sample in naming scheme, embedding its metadata or not"""
+    sound, bpm, key, fmt = entry['sound'], entry['bpm'], entry['key'], entry['format']
+    pitch_class, minor = CAMELOT_TONICS[key]
+    note = NOTE_NAMES[pitch_class]
+
+    if scheme == 'camelot':
+        return f"{sound}_{key}_{bpm}bpm_{number:05d}.{fmt}"
+    if scheme == 'musical':
+        return f"{bpm} {sound.title()} {note}{'min' if minor else 'maj'} {number:05d}.{fmt}"
+    if scheme == 'folder':
+        return os.path.join(f"{bpm} BPM {key}", f"{sound.title()} Loop {number:05d}.{fmt}")
+    return f"{sound}_{number:05d}.{fmt}"
+
+
+def generate_library(root, count, formats=tuple(SYNTH_FORMATS), unique=DEFAULT_UNIQUE, frame_rate=44100,
+                     seed=0, max_bars=max(LOOP_BARS)):
+    """Write a library of count loops with known BPM and key under root, returns its ground truth
+
+    Only the first unique files are synthesized, the others are hard links
+    to them under names of another scheme and pack, so even libraries of
+    tens of thousands of files are quick to create and take little space
+    """
+    if os.path.isdir(root) and os.listdir(root):
+        raise ValueError(f"Library directory is not empty: {root}")
+
+    settings = {'count': count, 'formats': list(formats), 'unique': unique, 'frame_rate': frame_rate, 'seed': seed,
+                'max_bars': max_bars}
+    rng = np.random.default_rng(seed)
+    os.makedirs(root, exist_ok=True)
+    keys = sorted(CAMELOT_TONICS)
+    bars_choices = [bars for bars in LOOP_BARS if bars <= max_bars]
+
+    samples = []
+    for number in range(count):
+        pack = os.path.join(root, f"pack_{number // 500:03d}")
+        scheme = NAMING_SCHEMES[int(rng.integers(len(NAMING_SCHEMES)))]
+
+        if number < unique:
+            sound = list(SYNTH_SOUNDS)[int(rng.integers(len(SYNTH_SOUNDS)))]
+            entry = {
+                'sound': sound,
+                'category': SYNTH_SOUNDS[sound],
+                'bpm': int(rng.choice(SYNTH_BPMS)),
+                'key': keys[int(rng.integers(len(keys)))],
+                'bars': int(rng.choice(bars_choices)),
+                'format': formats[int(rng.integers(len(formats)))],
+            }
+            path = os.path.join(pack, sample_name(entry, number, scheme))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            data = synth_loop(sound, entry['bpm'], entry['key'], entry['bars'], frame_rate, rng)
+            sf.write(path, data, frame_rate, format=SYNTH_FORMATS[entry['format']][0],
+                     subtype=SYNTH_FORMATS[entry['format']][1])
+            entry['source'] = None
+        else:
+            source = samples[int(rng.integers(unique))]
+            entry = {field: source[field] for field in ('sound', 'category', 'bpm', 'key', 'bars', 'format')}
+            path = os.path.join(pack, sample_name(entry, number, scheme))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            link_or_copy(os.path.join(root, source['path']), path)
+            entry['source'] = source['path']
+
+        entry['path'] = os.path.relpath(path, root)
+        entry['scheme'] = scheme
+        entry['seconds'] = round(entry['bars'] * 4 * 60.0 / entry['bpm'], 3)
+        samples.append(entry)
+
+    truth = {'settings': settings, 'count': count, 'synthesized': min(count, unique), 'samples': samples}
+    with open(os.path.join(root, 'library.json'), 'w', encoding='utf-8') as f:
+        json.dump(truth, f, indent=1)
+    return truth
+
+
+def load_library(root, count, formats=tuple(SYNTH_FORMATS), unique=DEFAULT_UNIQUE, frame_rate=44100, seed=0,
+                 max_bars=max(LOOP_BARS)):
+    """Reuse library under root if it was generated with the same settings, else generate it again"""
+    settings = {'count': count, 'formats': list(formats), 'unique': unique, 'frame_rate': frame_rate, 'seed': seed,
+                'max_bars': max_bars}
+    truth_path = os.path.join(root, 'library.json')
+    if os.path.exists(truth_path):
+        try:
+            with open(truth_path, 'r', encoding='utf-8') as f:
+                truth = json.load(f)
+            if truth.get('settings') == settings:
+                return truth
+        except (OSError, ValueError):
+            pass
+
+        # library.json marks the directory as generated, so it's safe to replace
+        shutil.rmtree(root)
+
+    return generate_library(root, count, formats, unique, frame_rate, seed, max_bars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthesize a sample library with known BPM and key")
+    parser.add_argument("root", help="Directory to write the library to")
+    parser.add_argument("--count", type=int, default=100, help="Number of files")
+    parser.add_argument("--formats", nargs="+", choices=sorted(SYNTH_FORMATS), default=list(SYNTH_FORMATS))
+    parser.add_argument("--unique", type=int, default=DEFAULT_UNIQUE,
+                        help="Files synthesized, the rest are hard links with other names")
+    parser.add_argument("--frame-rate", type=int, default=44100)
+    parser.add_argument("--max-bars", type=int, choices=LOOP_BARS, default=max(LOOP_BARS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    truth = generate_library(args.root, args.count, tuple(args.formats), args.unique, args.frame_rate, args.seed,
+                             args.max_bars)
+    print(f"Wrote {truth['count']} files ({truth['synthesized']} synthesized) to {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+from collections import defaultdict
+
+import numpy as np
+
+CAMELOT_KEYS = [f"{num}{letter}" for letter in "AB" for num in range(1, 13)]
+
+# Width of BPM buckets inside each (category, key) group
+BPM_BUCKET_WIDTH = 5
+
+# Buckets on each side of the target tempo's bucket searched first; the
+# window doubles until it holds a sample that can be used
+BPM_BUCKET_RADIUS = 2
+
+# Distance in BPM at which a candidate is half as likely to be picked
+BPM_WEIGHT_SCALE = 10.0
+
+# Pick weight of samples with unknown BPM
+UNKNOWN_BPM_WEIGHT = 0.5
+
+# Random draws tried before falling back to scanning for a sample not yet tried
+MAX_REJECTIONS = 8
+
+
+def pitch_class_to_camelot(pitch_class, minor=False):
+    """Camelot key of the major or minor key with given tonic (C major = 8B)"""
+    if minor:
+        # Minor key shares its number with the relative major a minor third up
+        pitch_class += 3
+    return f"{(7 * pitch_class + 7) % 12 + 1}{'A' if minor else 'B'}"
+
+
+def camelot_neighbours(key):
+    """Key itself, its relative major/minor and the adjacent keys on the wheel"""
+    if key not in CAMELOT_KEYS:
+        return (key,)
+
+    num = int(key[:-1])
+    letter = key[-1]
+    next_num = num + 1 if num < 12 else 1
+    prev_num = num - 1 if num > 1 else 12
+    return (key, f"{num}{'B' if letter == 'A' else 'A'}", f"{next_num}{letter}", f"{prev_num}{letter}")
+
+
+# Compatible keys of all 24 keys, computed once
+CAMELOT_NEIGHBOURS = {key: camelot_neighbours(key) for key in CAMELOT_KEYS}
+
+
+def bpm_bucket(bpm):
+    """BPM bucket number, -1 for unknown BPM"""
+    return int(bpm // BPM_BUCKET_WIDTH) if bpm else -1
+
+
+class CandidateIndex:
+    """Samples grouped by category, Camelot key and BPM bucket as arrays of sample ids"""
+
+    def __init__(self, entries):
+        # Sample id -> path, key and BPM (NaN when unknown), and path -> sample id
+        self.paths = []
+        self.keys = []
+        bpms = []
+
+        # Category -> key (None when unknown) -> BPM bucket -> sample ids
+        groups = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+
+        for sample_id, (path, category, key, bpm) in enumerate(entries):
+            self.paths.append(path)
+            self.keys.append(key)
+            bpms.append(bpm if bpm else np.nan)
+            groups[category][key][bpm_bucket(bpm)].append(sample_id)
+
+        self.bpms = np.array(bpms, dtype=np.float64)
+        # Lowest and highest bucket of known BPM, where widening windows stop
+        known = [bpm_bucket(bpm) for bpm in bpms if not np.isnan(bpm)]
+        self._bucket_span = (min(known), max(known)) if known else None
+        self.ids = {path: sample_id for sample_id, path in enumerate(self.paths)}
+        self.groups = {
+            category: {
+                key: {bucket: np.array(ids, dtype=np.int32) for bucket, ids in buckets.items()}
+                for key, buckets in keys.items()
+            }
+            for category, keys in groups.items()
+        }
+
+        # Memoized candidate arrays and cumulative pick weights per query
+        self._candidates = {}
+        self._weights = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def count(self, category):
+        """Number of samples in category"""
+        return sum(len(ids) for buckets in self.groups.get(category, {}).values() for ids in buckets.values())
+
+    def bucket_windows(self, bpm):
+        """Bucket windows (target bucket, radius) around bpm from narrowest to all buckets (None)"""
+        if bpm and self._bucket_span:
+            target = bpm_bucket(bpm)
+            low, high = self._bucket_span
+            radius = BPM_BUCKET_RADIUS
+            while target - radius > low or target + radius < high:
+                yield target, radius
+                radius *= 2
+        yield None
+
+    def candidate_ids(self, category, keys=None, window=None):
+        """Ids of samples in category whose key is one of keys or unknown (all keys if None)
+
+        With a (target bucket, radius) window only samples in buckets that
+        close to the target, or of unknown BPM, are included
+        """
+        query = (category, keys, window)
+        ids = self._candidates.get(query)
+        if ids is None:
+            by_key = self.groups.get(category, {})
+            if keys is None:
+                selected = list(by_key.values())
+            else:
+                selected = [by_key[key] for key in (*keys, None) if key in by_key]
+
+            if window is None:
+                arrays = [ids for buckets in selected for ids in buckets.values()]
+            else:
+                target, radius = window
+                wanted = (-1, *range(target - radius, target + radius + 1))
+                arrays = [buckets[bucket] for buckets in selected for bucket in wanted if bucket in buckets]
+            ids = np.sort(np.concatenate(arrays)) if arrays else np.array([], dtype=np.int32)
+            self._candidates[query] = ids
+        return ids
+
+    def nearest_ids(self, category, keys=None, bpm=None, count=None):
+        """Candidate ids ordered by BPM distance from bpm, unknown BPM last
+
+        The first count are found in the narrowest bucket window holding
+        that many samples closer than its edges
+        """
+        if not bpm:
+            return self.candidate_ids(category, keys)[:count]
+
+        for window in self.bucket_windows(bpm if count else None):
+            ids = self.candidate_ids(category, keys, window)
+            distance = np.abs(self.bpms[ids] - bpm)
+            distance = np.where(np.isnan(distance), np.inf, distance)
+
+            # Samples outside the window can be closer than ones at its edge
+            if window is not None and np.count_nonzero(distance < window[1] * BPM_BUCKET_WIDTH) < count:
+                continue
+            order = np.argsort(distance, kind='stable')
+            return ids[order][:count]
+
+    def _cumulative_weights(self, category, keys, bpm, window):
+        query = (category, keys, bpm, window)
+        weights = self._weights.get(query)
+        if weights is None:
+            ids = self.candidate_ids(category, keys, window)
+            if bpm:
+                # Closer tempo means less stretching, so a higher chance to be picked
+                distance = np.abs(self.bpms[ids] - bpm) / BPM_WEIGHT_SCALE
+                weights = np.where(np.isnan(distance), UNKNOWN_BPM_WEIGHT, 1.0 / (1.0 + distance ** 2))
+            else:
+                weights = np.ones(len(ids))
+            weights = np.cumsum(weights)
+            self._weights[query] = weights
+        return weights
+
+    def pick(self, rng, category, keys=None, bpm=None, exclude=()):
+        """Draw a candidate id weighted by BPM closeness, None if all are excluded
+
+        Samples of nearby tempo (or unknown BPM) are drawn from first, the
+        window widens only when all of them are excluded
+        """
+        for window in self.bucket_windows(bpm):
+            ids = self.candidate_ids(category, keys, window)
+            if not len(ids):
+                continue
+
+            weights = self._cumulative_weights(category, keys, bpm, window)
+            for _ in range(MAX_REJECTIONS):
+                position = int(np.searchsorted(weights, rng.random() * weights[-1], side='right'))
+                sample_id = int(ids[min(position, len(ids) - 1)])
+                if sample_id not in exclude:
+                    return sample_id
+
+            remaining = [int(sample_id) for sample_id in ids if int(sample_id) not in exclude]
+            if remaining:
+                return rng.choice(remaining)
+        return None
@@ -0,0 +1,166 @@
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+
+from candidate_index import pitch_class_to_camelot
+
+# Categories the composer knows how to place, in the order they are tried
+CATEGORIES = ('drums', 'bass', 'melody', 'harmony', 'fx', 'vocals', 'loops')
+
+# Filename keywords per category, checked in order; replace them with a JSON
+# file named by MUSIC_MIXER_CATEGORY_RULES
+CATEGORY_KEYWORDS = [
+    ('drums', ['kick', 'drum', 'bd', 'sd', 'snare', 'hat']),
+    ('bass', ['bass', 'sub', '808', 'low', 'bassline']),
+    ('melody', ['melody', 'lead', 'synth', 'pluck', 'arp']),
+    ('harmony', ['chord', 'pad', 'string', 'harmony', 'stabs']),
+    ('fx', ['fx', 'effect', 'impact', 'sweep', 'rise']),
+    ('vocals', ['vocal', 'voice', 'chant', 'sing', 'vox']),
+    ('loops', ['loop', 'groove', 'full', 'mix']),
+]
+
+MIN_FILENAME_BPM = 80
+MAX_FILENAME_BPM = 180
+
+# Parsed names kept per parser
+PARSE_CACHE_SIZE = 65536
+
+PITCH_CLASSES = {'c': 0, 'd': 2, 'e': 4, 'f': 5, 'g': 7, 'a': 9, 'b': 11}
+
+# BPM groups from most to least explicit
+BPM_GROUPS = ('tagged_bpm', 'bpm_tag', 'lead_bpm', 'tail_bpm', 'paren_bpm')
+
+# Key and BPM tokens; a Camelot key must stand alone or touch the word "key",
+# so "bass_8A_124bpm" is read but "a1b2" is not
+TOKEN_PATTERNS = [
+    r'(?:(?<![a-z0-9])|(?<=key))(?P<camelot>1[0-2]|0?[1-9])(?P<mode>[ab])(?:(?![a-z0-9])|(?=key))',
+    r'(?<![a-z])(?P<note>[a-g])(?P<accidental>#|b)?(?:(?P<quality>maj|min)|[\s_-](?P<quality_word>major|minor))',
+    r'(?<!\d)(?P<tagged_bpm>\d{2,3})[\s_-]*bpm',
+    r'bpm[\s_-]*(?P<bpm_tag>\d{2,3})(?!\d)',
+    r'^(?P<lead_bpm>\d{2,3})[\s_-]',
+    r'[\s_-](?P<tail_bpm>\d{2,3})$',
+    r'\((?P<paren_bpm>\d{2,3})\)',
+]
+
+
+def note_to_camelot(note, accidental, minor):
+    """Camelot key of a note name like c, c# or eb"""
+    return pitch_class_to_camelot(PITCH_CLASSES[note] + {'#': 1, 'b': -1}.get(accidental, 0), minor)
+
+
+def build_pattern(category_keywords):
+    """Compile one regex matching key, BPM and category keyword tokens
+
+    Keywords sit in a lookahead so they match as substrings, even inside
+    each other, without hiding the key and BPM tokens around them
+    """
+    keywords = []
+    seen = set()
+    for rank, (_, words) in enumerate(category_keywords):
+        for word in words:
+            word = word.lower()
+            if word and word not in seen:
+                seen.add(word)
+                keywords.append((rank, -len(word), word))
+
+    # At one position the alternation takes the first keyword that fits,
+    # so earlier categories and then longer words come first
+    alternatives = [f"(?=(?P<word>{'|'.join(re.escape(word) for _, _, word in sorted(keywords))}))"] if keywords else []
+    return re.compile('|'.join(alternatives + TOKEN_PATTERNS))
+
+
+class FilenameParser:
+    """Read BPM, Camelot key and category from sample names in one regex pass"""
+
+    def __init__(self, category_keywords=CATEGORY_KEYWORDS):
+        self.category_keywords = [(category, [word.lower() for word in words]) for category, words in category_keywords]
+        self.word_category = {}
+        for rank, (category, words) in enumerate(self.category_keywords):
+            for word in words:
+                self.word_category.setdefault(word, (rank, category))
+
+        self.pattern = build_pattern(self.category_keywords)
+        self.parse = lru_cache(maxsize=PARSE_CACHE_SIZE)(self._parse)
+
+    def _parse(self, name):
+        """Get {'bpm', 'key', 'category'} of one name, None for what isn't found"""
+        name = name.lower()
+        bpm = None
+        bpm_rank = len(BPM_GROUPS)
+        key = None
+        note_key = None
+        category = None
+        category_rank = len(self.category_keywords)
+
+        for match in self.pattern.finditer(name):
+            kind = match.lastgroup
+            if kind == 'word':
+                rank, word_category = self.word_category[match.group('word')]
+                if rank < category_rank:
+                    category_rank, category = rank, word_category
+            elif kind == 'mode':
+                if key is None:
+                    key = f"{int(match.group('camelot'))}{match.group('mode').upper()}"
+            elif kind in ('quality', 'quality_word'):
+                if note_key is None:
+                    quality = match.group('quality') or match.group('quality_word')
+                    note_key = note_to_camelot(match.group('note'), match.group('accidental'), quality.startswith('min'))
+            elif kind in BPM_GROUPS:
+                rank = BPM_GROUPS.index(kind)
+                value = int(match.group(kind))
+                if rank < bpm_rank and MIN_FILENAME_BPM <= value <= MAX_FILENAME_BPM:
+                    bpm_rank, bpm = rank, value
+
+        return {'bpm': bpm, 'key': key or note_key, 'category': category}
+
+    def parse_path(self, file_path):
+        """Parse file name, taking BPM and key from the parent directory name when missing"""
+        info = self.parse(os.path.basename(file_path))
+        if info['bpm'] and info['key']:
+            return info
+
+        parent = self.parse(os.path.basename(os.path.dirname(file_path)))
+        return {
+            'bpm': info['bpm'] or parent['bpm'],
+            'key': info['key'] or parent['key'],
+            'category': info['category'],
+        }
+
+    def categorize(self, file_path):
+        """Get category of file from its name, 'other' when no keyword matches"""
+        return self.parse(os.path.basename(file_path))['category'] or 'other'
+
+
+def load_category_rules(path):
+    """Read category keyword table from JSON, either {category: [keywords]} or [[category, [keywords]]]"""
+    with open(path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+
+    if isinstance(rules, dict):
+        rules = list(rules.items())
+
+    category_keywords = []
+    for category, words in rules:
+        if category not in CATEGORIES:
+            raise ValueError(f"Unknown category '{category}' in {path}, expected one of {', '.join(CATEGORIES)}")
+        if isinstance(words, str) or not all(isinstance(word, str) for word in words):
+            raise ValueError(f"Keywords of '{category}' in {path} must be a list of strings")
+        category_keywords.append((category, list(words)))
+    return category_keywords
+
+
+_shared_parser = None
+_shared_parser_lock = threading.Lock()
+
+
+def get_filename_parser():
+    """Get process-wide parser using the configured category keywords"""
+    global _shared_parser
+    with _shared_parser_lock:
+        if _shared_parser is None:
+            rules_path = os.environ.get("MUSIC_MIXER_CATEGORY_RULES")
+            category_keywords = load_category_rules(rules_path) if rules_path else CATEGORY_KEYWORDS
+            _shared_parser = FilenameParser(category_keywords)
+        return _shared_parser
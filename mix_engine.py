@@ -0,0 +1,460 @@
+import contextvars
+import math
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import librosa
+import numpy as np
+import soundfile as sf
+from pydub import AudioSegment
+
+# Peaks above this share of the bus ceiling are softly limited toward the ceiling
+LIMITER_KNEE = 0.9
+
+# Mix bus gain keeps peaks at or below -1 dBFS
+MIX_PEAK_CEILING = 10 ** (-1 / 20)
+
+# Length of the blocks the bus peak is measured in
+PEAK_PROBE_MS = 8000
+
+# Length of blocks produced by the streaming renderer
+DEFAULT_BLOCK_MS = 1000
+
+# Crossfade across the seam of prepared loops
+LOOP_CROSSFADE_MS = 10
+
+# Prepared loops are repeated up to at least this many bars
+MIN_LOOP_BARS = 4
+
+# Part of a beat a sample may fall short of a whole bar (or beat) and still count as one
+BAR_TOLERANCE = 0.125
+
+# Detected beats are only accurate to an analysis frame, keep this much before the first one
+BEAT_MARGIN_MS = 25
+
+PCM_SCALE = {1: 128.0, 2: 32768.0, 4: 2147483648.0}
+PCM_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+# Output format -> (soundfile container, default subtype)
+OUTPUT_FORMATS = {
+    'wav': ('WAV', 'PCM_16'),
+    'flac': ('FLAC', 'PCM_16'),
+    'ogg': ('OGG', 'VORBIS'),
+    'opus': ('OGG', 'OPUS'),
+    'mp3': ('MP3', 'MPEG_LAYER_III'),
+    'f32': ('RAW', 'FLOAT'),
+}
+
+# Subtypes of formats with a selectable bit depth
+BIT_DEPTHS = {
+    'wav': {16: 'PCM_16', 24: 'PCM_24', 32: 'FLOAT'},
+    'flac': {16: 'PCM_16', 24: 'PCM_24'},
+}
+
+# Sample rates accepted by encoders that don't take any rate
+SUPPORTED_FRAME_RATES = {
+    'opus': (8000, 12000, 16000, 24000, 48000),
+    'mp3': (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000),
+}
+
+# ffmpeg fallback for lossy formats libsndfile was built without
+FFMPEG_CODECS = {
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '2', '-f', 'mp3'],
+    'ogg': ['-c:a', 'libvorbis', '-q:a', '5', '-f', 'ogg'],
+    'opus': ['-c:a', 'libopus', '-b:a', '128k', '-f', 'ogg'],
+}
+
+# Size of reads from a streaming encoder's output
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def segment_to_array(audio, frame_rate=None, channels=None):
+    """Convert AudioSegment to float32 array of shape (frames, channels)"""
+    if audio.sample_width not in PCM_DTYPES:
+        audio = audio.set_sample_width(2)
+
+    data = np.frombuffer(audio.raw_data, dtype=PCM_DTYPES[audio.sample_width])
+    data = data.reshape(-1, audio.channels).astype(np.float32) / PCM_SCALE[audio.sample_width]
+
+    return conform_array(data, audio.frame_rate, frame_rate, channels)
+
+
+def conform_array(data, source_rate, frame_rate=None, channels=None):
+    """Resample and remix float array to the requested layout"""
+    if channels and data.shape[1] != channels:
+        if data.shape[1] == 1:
+            data = np.repeat(data, channels, axis=1)
+        else:
+            data = data.mean(axis=1, keepdims=True)
+            if channels > 1:
+                data = np.repeat(data, channels, axis=1)
+
+    if frame_rate and source_rate != frame_rate:
+        data = librosa.resample(data.T, orig_sr=source_rate, target_sr=frame_rate).T
+
+    return np.ascontiguousarray(data, dtype=np.float32)
+
+
+def array_to_pcm16(data):
+    """Convert float array to interleaved 16-bit PCM bytes"""
+    pcm = np.clip(data, -1.0, 1.0) * 32767.0
+    return pcm.astype(np.int16).tobytes()
+
+
+def array_to_segment(data, frame_rate):
+    """Convert float array of shape (frames, channels) to 16-bit AudioSegment"""
+    return AudioSegment(
+        array_to_pcm16(data),
+        frame_rate=frame_rate,
+        sample_width=2,
+        channels=data.shape[1]
+    )
+
+
+def soft_clip(buffer, ceiling=1.0, knee=LIMITER_KNEE):
+    """Limit peaks above knee * ceiling with a smooth tanh curve that never exceeds ceiling, in place"""
+    threshold = knee * ceiling
+    magnitude = np.abs(buffer)
+    over = magnitude > threshold
+    if over.any():
+        headroom = ceiling - threshold
+        limited = threshold + headroom * np.tanh((magnitude[over] - threshold) / headroom)
+        buffer[over] = np.sign(buffer[over]) * limited
+    return buffer
+
+
+def add_looped(out, data, gain=1.0, offset=0):
+    """Add looped layer into output buffer starting at loop position offset"""
+    loop_length = len(data)
+    if loop_length == 0:
+        return out
+
+    scaled = data * np.float32(gain) if gain != 1.0 else data
+    position = offset % loop_length
+    start = 0
+    n_frames = len(out)
+
+    # Walk the output buffer one loop period at a time instead of tiling a full copy
+    while start < n_frames:
+        count = min(loop_length - position, n_frames - start)
+        out[start:start + count] += scaled[position:position + count]
+        start += count
+        position = 0
+
+    return out
+
+
+def loop_length(n_available, beat_frames):
+    """Frames in the longest whole number of bars (or beats, for short samples) that fits"""
+    tolerance = BAR_TOLERANCE * beat_frames
+    bars = int((n_available + tolerance) // (4 * beat_frames))
+    if bars >= 1:
+        return int(round(bars * 4 * beat_frames))
+
+    beats = max(1, int((n_available + tolerance) // beat_frames))
+    return int(round(beats * beat_frames))
+
+
+def fit_length(data, n_frames):
+    """Trim or zero-pad float array to n_frames"""
+    if len(data) >= n_frames:
+        return data[:n_frames]
+    padding = np.zeros((n_frames - len(data), data.shape[1]), dtype=data.dtype)
+    return np.concatenate([data, padding])
+
+
+def prepare_loop(data, frame_rate, bpm, beats=None, crossfade_ms=LOOP_CROSSFADE_MS, min_bars=MIN_LOOP_BARS):
+    """Cut float array to whole bars of its beat grid with a smooth seam, tiled to at least min_bars"""
+    if not bpm or bpm <= 0 or len(data) == 0:
+        return data
+
+    beat_frames = frame_rate * 60.0 / bpm
+
+    # Skip leading silence or a pickup before the first detected beat
+    start = 0
+    if beats is not None and len(beats):
+        first = beats[0] * frame_rate
+        if BAR_TOLERANCE * beat_frames < first < beat_frames:
+            start = max(0, int(first - frame_rate * BEAT_MARGIN_MS / 1000))
+
+    available = len(data) - start
+    length = loop_length(available, beat_frames)
+    loop = fit_length(data[start:start + length], length).astype(np.float32)
+
+    fade = min(int(frame_rate * crossfade_ms / 1000), length // 2)
+    if fade > 0:
+        ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+        tail = data[start + length:start + length + fade]
+        if len(tail) == fade:
+            # Blend what follows the loop end into its start so the seam continues naturally
+            loop[:fade] = loop[:fade] * ramp + tail * (1.0 - ramp)
+        elif start >= fade:
+            # Blend the end into what precedes the loop start
+            loop[-fade:] = loop[-fade:] * ramp[::-1] + data[start - fade:start] * ramp
+        # An exactly cut loop already joins its own start, fading it would dip every repetition
+
+    # One tiling operation instead of repeated concatenation
+    repeats = int(np.ceil(min_bars * 4 * beat_frames / length))
+    if repeats > 1:
+        loop = np.tile(loop, (repeats, 1))
+    return loop
+
+
+def mix_layers(arrays, gains, n_frames, limit=True, ceiling=MIX_PEAK_CEILING):
+    """Mix looped float layers into a single preallocated buffer"""
+    channels = max(data.shape[1] for data in arrays)
+    out = np.zeros((n_frames, channels), dtype=np.float32)
+
+    for data, gain in zip(arrays, gains):
+        add_looped(out, data, gain)
+
+    peak = float(np.abs(out).max()) if n_frames else 0.0
+    if ceiling and peak > ceiling:
+        out *= np.float32(ceiling / peak)
+
+    if limit:
+        soft_clip(out, ceiling or 1.0)
+    return out
+
+
+def bus_gain(scaled, n_frames, frame_rate, ceiling=MIX_PEAK_CEILING, probe_ms=PEAK_PROBE_MS):
+    """Gain that keeps the mix bus under ceiling, measured over the whole mix
+
+    The mix repeats once every loop has wrapped around together, so only
+    the first cycle of the loop lengths (at most the whole mix) is summed,
+    one probe block at a time
+    """
+    cycle = 1
+    for data in scaled:
+        if len(data):
+            cycle = math.lcm(cycle, len(data))
+            if cycle >= n_frames:
+                break
+    cycle_frames = min(n_frames, cycle)
+    if cycle_frames <= 0:
+        return 1.0
+
+    channels = max(data.shape[1] for data in scaled)
+    probe_frames = max(1, int(frame_rate * probe_ms / 1000))
+    peak = 0.0
+    for start in range(0, cycle_frames, probe_frames):
+        probe = np.zeros((min(probe_frames, cycle_frames - start), channels), dtype=np.float32)
+        for data in scaled:
+            add_looped(probe, data, offset=start)
+        peak = max(peak, float(np.abs(probe).max()))
+
+    return ceiling / peak if peak > ceiling else 1.0
+
+
+def iter_mix_blocks(arrays, gains, n_frames, block_frames, limit=True,
+                    ceiling=MIX_PEAK_CEILING, frame_rate=44100):
+    """Yield mixed float blocks so memory use doesn't depend on mix length"""
+    channels = max(data.shape[1] for data in arrays)
+    scaled = [data * np.float32(gain) for data, gain in zip(arrays, gains)]
+
+    # Fold the bus gain into the loops so blocks only need summing;
+    # the soft clipper only rounds off peaks near the ceiling
+    if ceiling:
+        master = bus_gain(scaled, n_frames, frame_rate, ceiling)
+        if master != 1.0:
+            scaled = [data * np.float32(master) for data in scaled]
+
+    for start in range(0, n_frames, block_frames):
+        block = np.zeros((min(block_frames, n_frames - start), channels), dtype=np.float32)
+
+        # Each layer is read cyclically from the position matching this block
+        for data in scaled:
+            add_looped(block, data, offset=start)
+
+        if limit:
+            soft_clip(block, ceiling or 1.0)
+        yield block
+
+
+def array_to_pcm(data, bit_depth=16):
+    """Convert float array to interleaved little-endian samples of given bit depth"""
+    if bit_depth == 16:
+        return array_to_pcm16(data)
+    if bit_depth == 32:
+        return np.ascontiguousarray(data, dtype='<f4').tobytes()
+    if bit_depth == 24:
+        pcm = (np.clip(data, -1.0, 1.0) * 8388607.0).astype('<i4')
+        return pcm.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    raise ValueError(f"Unsupported bit depth: {bit_depth}")
+
+
+def wav_header(n_frames, frame_rate, channels, sample_width=2):
+    """Build WAV header for a stream of known length (32-bit samples are float)"""
+    data_size = n_frames * channels * sample_width
+    format_tag = 3 if sample_width == 4 else 1
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, format_tag, channels, frame_rate,
+        frame_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+        b'data', data_size
+    )
+
+
+def iter_wav_bytes(blocks, n_frames, frame_rate, channels, bit_depth=16):
+    """Encode float blocks as a WAV byte stream"""
+    yield wav_header(n_frames, frame_rate, channels, bit_depth // 8)
+    for block in blocks:
+        yield array_to_pcm(block, bit_depth)
+
+
+def native_encoder_available(output_format):
+    """Check if libsndfile can write output format"""
+    container, subtype = OUTPUT_FORMATS[output_format]
+    return container in sf.available_formats() and subtype in sf.available_subtypes(container)
+
+
+def encoder_available(output_format):
+    """Check if output format can be written, natively or through ffmpeg"""
+    if output_format not in OUTPUT_FORMATS:
+        return False
+    if native_encoder_available(output_format):
+        return True
+    return output_format in FFMPEG_CODECS and shutil.which('ffmpeg') is not None
+
+
+def output_subtype(output_format, bit_depth=None):
+    """Get soundfile subtype for output format and optional bit depth"""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if bit_depth is None:
+        return OUTPUT_FORMATS[output_format][1]
+
+    depths = BIT_DEPTHS.get(output_format, {})
+    if bit_depth not in depths:
+        raise ValueError(f"{output_format} output doesn't support {bit_depth}-bit samples")
+    return depths[bit_depth]
+
+
+def output_frame_rate(output_format, frame_rate):
+    """Closest sample rate at or above frame_rate that the format's encoder accepts"""
+    rates = SUPPORTED_FRAME_RATES.get(output_format)
+    if not rates or frame_rate in rates:
+        return frame_rate
+    return min((rate for rate in rates if rate >= frame_rate), default=rates[-1])
+
+
+def iter_soundfile_bytes(blocks, frame_rate, channels, output_format, subtype):
+    """Encode float blocks with libsndfile, yielding output as it is written"""
+    container = OUTPUT_FORMATS[output_format][0]
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    # Writing into a pipe makes libsndfile skip headers it would otherwise
+    # seek back to fill in at the end (such as the MP3 Xing frame count)
+    def encode():
+        try:
+            with sf.SoundFile(write_fd, mode='w', samplerate=frame_rate, channels=channels,
+                              format=container, subtype=subtype, closefd=False) as output:
+                for block in blocks:
+                    output.write(block)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            os.close(write_fd)
+
+    # Run in a copy of the caller's context so the blocks it pulls are traced there
+    writer = threading.Thread(target=contextvars.copy_context().run, args=(encode,), daemon=True)
+    writer.start()
+    with os.fdopen(read_fd, 'rb') as pipe:
+        while True:
+            chunk = pipe.read1(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    writer.join()
+    if errors:
+        raise errors[0]
+
+
+def iter_ffmpeg_bytes(blocks, frame_rate, channels, output_format):
+    """Encode float blocks with an ffmpeg process, yielding output as it arrives"""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None or output_format not in FFMPEG_CODECS:
+        raise ValueError(f"No encoder available for {output_format} output")
+
+    process = subprocess.Popen(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error',
+         '-f', 'f32le', '-ar', str(frame_rate), '-ac', str(channels), '-i', 'pipe:0',
+         *FFMPEG_CODECS[output_format], 'pipe:1'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+
+    def feed():
+        try:
+            for block in blocks:
+                process.stdin.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            process.stdin.close()
+
+    # Feed ffmpeg from a thread so reading its output never deadlocks; like
+    # the caller it sees the active trace, so pulling blocks is still timed
+    writer = threading.Thread(target=contextvars.copy_context().run, args=(feed,), daemon=True)
+    writer.start()
+    try:
+        while True:
+            chunk = process.stdout.read1(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+        writer.join()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {output_format} output")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def iter_encoded_bytes(blocks, n_frames, frame_rate, channels, output_format='wav', bit_depth=None):
+    """Encode float blocks in output format, yielding bytes as blocks are rendered"""
+    subtype = output_subtype(output_format, bit_depth)
+
+    if output_format == 'wav':
+        # Length is known up front, so the header is final from the first chunk
+        yield from iter_wav_bytes(blocks, n_frames, frame_rate, channels, bit_depth or 16)
+    elif output_format == 'f32':
+        for block in blocks:
+            yield array_to_pcm(block, 32)
+    elif native_encoder_available(output_format):
+        yield from iter_soundfile_bytes(blocks, frame_rate, channels, output_format, subtype)
+    else:
+        yield from iter_ffmpeg_bytes(blocks, frame_rate, channels, output_format)
+
+
+def write_stream(path, blocks, frame_rate, channels, format='WAV', subtype='PCM_16'):
+    """Write float blocks to an audio file as they are produced"""
+    with sf.SoundFile(path, mode='w', samplerate=frame_rate, channels=channels,
+                      format=format, subtype=subtype) as output:
+        for block in blocks:
+            output.write(block)
+    return path
+
+
+def write_encoded(path, blocks, frame_rate, channels, output_format='wav', bit_depth=None):
+    """Write float blocks to a file in output format as they are produced"""
+    subtype = output_subtype(output_format, bit_depth)
+    if native_encoder_available(output_format):
+        return write_stream(path, blocks, frame_rate, channels, OUTPUT_FORMATS[output_format][0], subtype)
+
+    with open(path, 'wb') as output:
+        for chunk in iter_ffmpeg_bytes(blocks, frame_rate, channels, output_format):
+            output.write(chunk)
+    return path
+
+
+def write_wav(path, data, frame_rate, subtype='PCM_16'):
+    """Write float array to WAV file"""
+    sf.write(path, data, frame_rate, subtype=subtype, format='WAV')
+    return path
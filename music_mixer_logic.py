@@ -1,25 +1,30 @@
 import os
 import random
-import tempfile
-from collections import defaultdict
-import librosa
+import threading
+import hashlib
+import json
+import multiprocessing
+import queue
 import numpy as np
-import warnings
-import math
+import soundfile as sf
 from datetime import datetime
-import re
 from pydub import AudioSegment
 
-# Suppress librosa warnings
-warnings.filterwarnings("ignore", category=UserWarning, module='librosa')
-
-# Camelot Wheel System
-CAMELOT_WHEEL = {
-    "1A": "B", "2A": "F", "3A": "C", "4A": "G", "5A": "D", "6A": "A", 
-    "7A": "E", "8A": "B", "9A": "F#", "10A": "C#", "11A": "G#", "12A": "D#",
-    "1B": "G#", "2B": "D#", "3B": "A#", "4B": "F", "5B": "C", "6B": "G",
-    "7B": "D", "8B": "A", "9B": "E", "10B": "B", "11B": "F#", "12B": "C#"
-}
+from analysis_index import get_shared_index
+import librosa
+from audio_analysis import FEATURES_VERSION, analyze_file, analyze_batch
+from sample_cache import get_shared_sample_cache
+from sample_library import get_library
+from candidate_index import CAMELOT_NEIGHBOURS, CandidateIndex
+from filename_parser import get_filename_parser
+from workspace import get_workspace
+from mix_engine import (
+    DEFAULT_BLOCK_MS, conform_array, segment_to_array, iter_mix_blocks, iter_encoded_bytes,
+    mix_layers, encoder_available, fit_length, output_frame_rate, output_subtype, prepare_loop, write_encoded,
+    write_wav
+)
+from time_stretch import TEMPO_MODES, stretch
+from tracing import cache_lookup, count, stage, traced, traced_iter, Trace
 
 STANDARD_PROBABILITIES = {
     'drums': 0.9, 'bass': 0.8, 'melody': 0.7, 'harmony': 0.6,
@@ -31,261 +36,514 @@ EXPERIMENTAL_PROBABILITIES = {
     'vocals': 0.6, 'fx': 0.8, 'loops': 0.4, 'other': 0.9
 }
 
+# Loudness each category is brought to before mixing
+CATEGORY_TARGET_LUFS = {
+    'drums': -16, 'bass': -18, 'melody': -21, 'harmony': -23,
+    'vocals': -19, 'fx': -24, 'loops': -20, 'other': -24
+}
+
+# Limits of the loudness-matching gain applied to a single layer
+MIN_LAYER_GAIN_DB = -30
+MAX_LAYER_GAIN_DB = 12
+
+# Random volume ranges used when a sample's loudness is unknown
+VOLUME_RANGES = {
+    'drums': (0.4, 0.9), 'bass': (0.3, 0.8), 'melody': (0.2, 0.7),
+    'harmony': (0.2, 0.6), 'fx': (0.1, 0.8), 'vocals': (0.3, 0.8),
+    'loops': (0.2, 0.7), 'other': (0.1, 0.9)
+}
+
+# Categories mixed regardless of key
+UNPITCHED_CATEGORIES = ['drums', 'fx', 'other']
+
+# How many samples to try per layer before giving up on a category
+MAX_PICK_ATTEMPTS = 5
+
+# How many unlabelled samples whose detected key clashes to try per layer
+# before falling back to samples named in a compatible key; only 4 of the
+# 24 keys are compatible, so clashes are far more common than decode failures
+MAX_KEY_CLASH_ATTEMPTS = 16
+
+# Files named in the message about analysis that timed out, the rest are counted
+ABANDONED_LOG_LIMIT = 5
+
+# Bump when rendering changes so cached renders of old plans are not reused
+RENDER_VERSION = 3
+
+# Draft previews are mono at a reduced rate and cover the first bars of the mix
+PREVIEW_FRAME_RATE = 22050
+PREVIEW_BARS = 8
+
+def plan_hash(plan):
+    """Stable hash of plan contents and the identity of its sample files"""
+    files = []
+    for layer in plan['layers']:
+        try:
+            st = os.stat(layer['sample'])
+            files.append([os.path.abspath(layer['sample']), st.st_size, st.st_mtime_ns])
+        except OSError:
+            files.append([os.path.abspath(layer['sample']), None, None])
+    
+    canonical = json.dumps(
+        {'plan': plan, 'files': files, 'render_version': RENDER_VERSION},
+        sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:24]
+
 class MusicMixer:
-    def __init__(self, samples_dir, target_bpm=128, current_key="8A", experimental_mode=False):
+    def __init__(self, samples_dir, target_bpm=128, current_key="8A", experimental_mode=False,
+                 analysis_index=None, analysis_workers=None, analysis_chunk_size=4,
+                 analysis_timeout=60, sample_cache=None, tempo_mode='resample', detect_keys=True,
+                 seed=None, render_cache_dir=None, workspace=None, prefer_close_bpm=True):
         self.samples_dir = samples_dir
         self.target_bpm = target_bpm
         self.current_key = current_key
         self.experimental_mode = experimental_mode
         
+        # 'resample' shifts pitch, 'phase_vocoder' and 'beat_slice' keep it
+        if tempo_mode not in TEMPO_MODES:
+            raise ValueError(f"Unknown tempo mode: {tempo_mode}")
+        self.tempo_mode = tempo_mode
+        
+        # Random choices of a plan come from self.rng, seeded from seed
+        # (a fresh random seed for every plan when seed is None)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        
         self.bpm_cache = {}
         self.key_cache = {}
         
-        # Temporary directory for processing
-        self.temp_dir = tempfile.mkdtemp(prefix="music_mixer_")
+        # Samples whose key was looked for in the audio itself
+        self.key_analyzed = set()
+        
+        # Full feature records (BPM, beats, key, duration, loudness...) by sample
+        self.feature_cache = {}
+        self.detect_keys = detect_keys
+        
+        # Samples already looked up in the analysis index, found or not
+        self._index_checked = set()
+        
+        # Samples batch analysis couldn't decode or gave up on, not retried by this mixer
+        self._analysis_failed = set()
+        
+        # Sample lookup by category and filename key and BPM, rebuilt when the library changes
+        self._candidate_index = None
+        self._candidate_index_key = None
+        
+        # Favour samples close to the target BPM so they need less stretching
+        self.prefer_close_bpm = prefer_close_bpm
+        
+        # Persistent analysis results shared between mixer instances
+        self.analysis_index = analysis_index if analysis_index is not None else get_shared_index()
+        
+        # Decoded, loop-optimized and tempo-adjusted samples shared between mixers
+        self.sample_cache = sample_cache if sample_cache is not None else get_shared_sample_cache()
+        
+        # Batch BPM analysis settings (workers=None uses all CPU cores,
+        # timeout is in seconds per file)
+        self.analysis_workers = analysis_workers
+        self.analysis_chunk_size = analysis_chunk_size
+        self.analysis_timeout = analysis_timeout
+        
+        # Renders and mixes live in a workspace that is kept within its quota and TTL
+        self.workspace = workspace if workspace is not None else get_workspace()
+        
+        # Finished renders keyed by plan hash
+        self.render_cache_dir = render_cache_dir or self.workspace.area('renders')
+        
+        # Directory for mixes written without an explicit output path
+        self.temp_dir = self.workspace.new_dir('mixes', 'music_mixer')
         
     def cleanup(self):
         """Clean up temporary files"""
         import shutil
         if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir)
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
     
     @staticmethod
     def extract_key_from_filename(filename):
         """Extract Camelot key from filename"""
-        camelot_patterns = [
-            r'\b(\d{1,2}[AB])\b',
-            r'key[\s_-]*(\d{1,2}[AB])',
-            r'(\d{1,2}[AB])[\s_-]*key',
-        ]
-        
-        for pattern in camelot_patterns:
-            match = re.search(pattern, filename, re.IGNORECASE)
-            if match:
-                key = match.group(1).upper()
-                if key in CAMELOT_WHEEL:
-                    return key
-        
-        musical_keys = {
-            'cmaj': '8B', 'c major': '8B', 'c#maj': '3B', 'c# major': '3B',
-            'dmaj': '10B', 'd major': '10B', 'd#maj': '5B', 'd# major': '5B',
-            'emaj': '12B', 'e major': '12B', 'fmaj': '7B', 'f major': '7B',
-            'f#maj': '2B', 'f# major': '2B', 'gmaj': '9B', 'g major': '9B',
-            'g#maj': '4B', 'g# major': '4B', 'amaj': '11B', 'a major': '11B',
-            'a#maj': '6B', 'a# major': '6B', 'bmaj': '1B', 'b major': '1B',
-            'cmin': '5A', 'c minor': '5A', 'c#min': '12A', 'c# minor': '12A',
-            'dmin': '7A', 'd minor': '7A', 'd#min': '2A', 'd# minor': '2A',
-            'emin': '9A', 'e minor': '9A', 'fmin': '4A', 'f minor': '4A',
-            'f#min': '11A', 'f# minor': '11A', 'gmin': '6A', 'g minor': '6A',
-            'g#min': '1A', 'g# minor': '1A', 'amin': '8A', 'a minor': '8A',
-            'a#min': '3A', 'a# minor': '3A', 'bmin': '10A', 'b minor': '10A',
-        }
-        
-        for key_pattern, camelot_key in musical_keys.items():
-            if key_pattern in filename.lower():
-                return camelot_key
-        
-        return None
+        return get_filename_parser().parse(filename)['key']
     
     @staticmethod
     def extract_bpm_from_filename(filename):
         """Extract BPM from filename"""
-        patterns = [
-            r'(\d{2,3})bpm',
-            r'bpm[\s_-]*(\d{2,3})',
-            r'[\s_-](\d{2,3})[\s_-]bpm',
-            r'^(\d{2,3})[\s_-]',
-            r'[\s_-](\d{2,3})$',
-            r'\((\d{2,3})\)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, filename, re.IGNORECASE)
-            if match:
-                bpm = int(match.group(1))
-                if 80 <= bpm <= 180:
-                    return bpm
-        return None
+        return get_filename_parser().parse(filename)['bpm']
     
     @staticmethod
     def get_compatible_keys(key):
         """Get list of harmonically compatible keys"""
-        if key not in CAMELOT_WHEEL:
-            return [key]
-        
-        num = int(key[:-1])
-        letter = key[-1]
-        
-        compatible = [
-            key,
-            f"{num}{'B' if letter == 'A' else 'A'}",
-        ]
-        
-        next_num = num + 1 if num < 12 else 1
-        prev_num = num - 1 if num > 1 else 12
-        
-        compatible.append(f"{next_num}{letter}")
-        compatible.append(f"{prev_num}{letter}")
-        
-        return compatible
+        return list(CAMELOT_NEIGHBOURS.get(key, (key,)))
     
     def get_all_samples(self, custom_dir=None):
         """Get all audio files from directory"""
         search_dir = custom_dir if custom_dir else self.samples_dir
-        audio_files = []
-        
-        for root, _, files in os.walk(search_dir):
-            for f in files:
-                if f.lower().endswith(('.wav', '.mp3', '.flac', '.aiff')):
-                    audio_files.append(os.path.join(root, f))
-        return audio_files
+        return get_library(search_dir).samples
     
-    def get_bpm(self, file_path):
-        """Detect BPM with caching"""
+    def _filename_bpm(self, file_path):
+        """Get BPM from filename or parent directory name"""
+        return get_filename_parser().parse_path(file_path)['bpm']
+    
+    def _filename_key(self, file_path):
+        """Get key from filename or parent directory name"""
+        return get_filename_parser().parse_path(file_path)['key']
+    
+    def _apply_analysis(self, file_path, record):
+        """Store audio analysis results in memory caches, names take priority"""
+        bpm = self._filename_bpm(file_path) or record.get('bpm')
+        if bpm:
+            self.bpm_cache[file_path] = bpm
+        
+        if 'key' in record:
+            self.key_cache[file_path] = self._filename_key(file_path) or record['key']
+            self.key_analyzed.add(file_path)
+        
+        if record.get('features_version') == FEATURES_VERSION:
+            self.feature_cache[file_path] = record
+    
+    def _lookup_bpm(self, file_path, use_index=True):
+        """Get BPM from cache, filename or analysis index without decoding"""
         if file_path in self.bpm_cache:
             return self.bpm_cache[file_path]
         
+        bpm = self._filename_bpm(file_path)
+        if bpm:
+            self.bpm_cache[file_path] = bpm
+            return bpm
+        
+        if use_index and self.analysis_index is not None:
+            record = self.analysis_index.get(file_path)
+            if record:
+                self._apply_analysis(file_path, record)
+                return self.bpm_cache.get(file_path)
+        
+        return None
+    
+    def _needs_analysis(self, file_path):
+        """Check if sample features can only be found by decoding audio"""
+        if file_path not in self.feature_cache:
+            return True
+        return self.detect_keys and file_path not in self.key_analyzed
+    
+    def get_features(self, file_path):
+        """Get sample feature record, analyzing the sample if needed"""
+        if file_path not in self.feature_cache and self.analysis_index is not None:
+            record = self.analysis_index.get(file_path)
+            if record:
+                self._apply_analysis(file_path, record)
+        if self._needs_analysis(file_path):
+            if file_path in self._analysis_failed:
+                raise ValueError(f"Could not analyze {file_path}")
+            self.analyze_sample(file_path)
+        return self.feature_cache[file_path]
+    
+    @traced('analyze')
+    def analyze_sample(self, file_path):
+        """Compute sample features from a single decode of the sample"""
+        count('samples_analyzed')
+        result = analyze_file(file_path, with_key=self.detect_keys)
+        self._apply_analysis(file_path, result)
+        
+        if self.analysis_index is not None:
+            self.analysis_index.update(file_path, **result)
+        return result
+    
+    def get_bpm(self, file_path):
+        """Detect BPM with caching, None if the tempo can't be found"""
         try:
-            filename = os.path.basename(file_path).lower()
-            bpm_from_name = self.extract_bpm_from_filename(filename)
-            
-            if bpm_from_name:
-                self.bpm_cache[file_path] = bpm_from_name
-                return bpm_from_name
+            bpm = self._lookup_bpm(file_path)
+            if bpm or file_path in self.feature_cache:
+                return bpm
             
-            parent_dir = os.path.basename(os.path.dirname(file_path)).lower()
-            parent_bpm = self.extract_bpm_from_filename(parent_dir)
-            if parent_bpm:
-                self.bpm_cache[file_path] = parent_bpm
-                return parent_bpm
-            
-            # Audio analysis (limit duration for speed)
-            y, sr = librosa.load(file_path, duration=15, mono=True, sr=22050)
+            self.get_features(file_path)
+            return self.bpm_cache.get(file_path)
             
+        except Exception as e:
+            print(f"Tempo detection failed for {file_path}: {e}")
+            return None
+    
+    def get_tempo_source(self, file_path):
+        """Get (method, confidence) of the known BPM of sample, without analyzing it"""
+        if self._filename_bpm(file_path):
+            return 'filename', 1.0
+        record = self.feature_cache.get(file_path, {})
+        if record.get('bpm'):
+            return record.get('bpm_method'), record.get('bpm_confidence')
+        return 'fallback', 0.0
+    
+    @traced('analyze')
+    def analyze_samples(self, samples, progress_callback=None):
+        """Compute features of unanalyzed samples in parallel worker processes"""
+        self._prefetch_analysis(samples)
+        pending = [s for s in samples if self._needs_analysis(s)]
+        total = len(pending)
+        
+        if not total:
+            return 0
+        count('samples_analyzed', total)
+        
+        workers = self.analysis_workers or os.cpu_count() or 1
+        workers = min(workers, total)
+        chunk_size = max(1, self.analysis_chunk_size)
+        chunks = [pending[i:i + chunk_size] for i in range(0, total, chunk_size)]
+        
+        results = {}
+        done = 0
+        
+        def collect(chunk_results):
+            nonlocal done
+            for sample, result in chunk_results:
+                results[sample] = result
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total, sample)
+        
+        if workers <= 1:
+            for chunk in chunks:
+                collect(analyze_batch(chunk, self.detect_keys))
+        else:
+            # A Pool rather than an executor: its workers can be killed when one hangs
+            finished = queue.Queue()
+            pool = multiprocessing.Pool(processes=workers)
             try:
-                tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-                bpm = float(tempo)
-            except:
-                onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-                tempo = librosa.beat.tempo(onset_envelope=onset_env, sr=sr)
-                bpm = float(tempo[0]) if hasattr(tempo, '__iter__') else float(tempo)
-            
-            if bpm < 80:
-                bpm *= 2
-            elif bpm > 180:
-                bpm /= 2
-            
-            common_bpms = [80, 85, 90, 95, 100, 105, 110, 115, 120, 
-                          122, 124, 126, 128, 130, 132, 135, 138, 
-                          140, 145, 150, 155, 160, 165, 170, 175, 180]
-            closest_bpm = min(common_bpms, key=lambda x: abs(x - bpm))
-            
-            self.bpm_cache[file_path] = closest_bpm
-            return closest_bpm
+                for chunk in chunks:
+                    pool.apply_async(
+                        analyze_batch, (chunk, self.detect_keys),
+                        callback=finished.put,
+                        error_callback=lambda e, chunk=chunk: finished.put([(sample, None) for sample in chunk])
+                    )
+                pool.close()
+                
+                for _ in chunks:
+                    # Give up on the batch if no chunk finishes within its time budget
+                    try:
+                        collect(finished.get(
+                            timeout=self.analysis_timeout * chunk_size if self.analysis_timeout else None
+                        ))
+                    except queue.Empty:
+                        break
+            finally:
+                # Stops workers still decoding, e.g. stuck on a broken file
+                pool.terminate()
+                pool.join()
             
-        except Exception as e:
-            self.bpm_cache[file_path] = self.target_bpm
-            return self.target_bpm
+            # Timed out files count as failed
+            abandoned = [s for s in pending if s not in results]
+            if abandoned:
+                more = f" and {len(abandoned) - ABANDONED_LOG_LIMIT} more" if len(abandoned) > ABANDONED_LOG_LIMIT else ""
+                print(f"Analysis timed out, abandoned {len(abandoned)} files: "
+                      f"{', '.join(abandoned[:ABANDONED_LOG_LIMIT])}{more}")
+            collect([(s, None) for s in abandoned])
+        
+        detected = {}
+        for sample, result in results.items():
+            if result:
+                self._apply_analysis(sample, result)
+                detected[sample] = result
+                continue
+            self._analysis_failed.add(sample)
+        
+        if detected and self.analysis_index is not None:
+            self.analysis_index.update_many(detected)
+        
+        return total
     
     def get_sample_key(self, file_path):
         """Get musical key for sample"""
         if file_path in self.key_cache:
             return self.key_cache[file_path]
         
-        filename = os.path.basename(file_path).lower()
-        key = self.extract_key_from_filename(filename)
+        key = self._filename_key(file_path)
         
-        if not key:
-            parent_dir = os.path.basename(os.path.dirname(file_path)).lower()
-            key = self.extract_key_from_filename(parent_dir)
+        if not key and self.analysis_index is not None:
+            record = self.analysis_index.get(file_path)
+            if record:
+                self._apply_analysis(file_path, record)
+                key = record.get('key')
         
         self.key_cache[file_path] = key
         return key
     
+    def _prefetch_analysis(self, samples):
+        """Load persisted analysis results into memory caches in one query"""
+        if self.analysis_index is None:
+            return
+        
+        # Each sample is looked up once: missing and outdated records stay so
+        # until this mixer analyzes the sample itself
+        pending = [s for s in samples if s not in self.feature_cache and s not in self._index_checked]
+        if not pending:
+            return
+        self._index_checked.update(pending)
+        records = self.analysis_index.get_many(pending)
+        
+        for sample, record in records.items():
+            self._apply_analysis(sample, record)
+    
+    def rebuild_analysis_index(self, custom_dir=None):
+        """Drop persisted results for library and analyze it again"""
+        search_dir = custom_dir if custom_dir else self.samples_dir
+        if self.analysis_index is not None:
+            self.analysis_index.clear(search_dir)
+        
+        self.bpm_cache.clear()
+        self.key_cache.clear()
+        self.key_analyzed.clear()
+        self.feature_cache.clear()
+        self._index_checked.clear()
+        
+        samples = self.get_all_samples(search_dir)
+        self.analyze_samples(samples)
+        return len(samples)
+    
+    def prune_analysis_index(self, custom_dir=None):
+        """Remove persisted results of deleted or modified files"""
+        if self.analysis_index is None:
+            return 0
+        return self.analysis_index.prune(custom_dir)
+    
     @staticmethod
-    def optimize_audio_length(audio, target_bpm):
-        """Optimize audio length for smooth looping"""
-        beat_duration = 60000 / target_bpm
-        measure_duration = beat_duration * 4
-        ideal_length = measure_duration * 4
-        
-        current_length = len(audio)
-        
-        if current_length < ideal_length:
-            looped = AudioSegment.empty()
-            while len(looped) < ideal_length:
-                looped += audio
-            return looped[:ideal_length]
-        
-        return audio
+    def optimize_audio_length(data, frame_rate, bpm, beats=None):
+        """Trim sample to whole bars of its beat grid and loop it to at least four bars"""
+        return prepare_loop(data, frame_rate, bpm, beats)
     
     @staticmethod
-    def change_tempo(audio_segment, current_bpm, target_bpm):
-        """Change audio tempo"""
-        if current_bpm == target_bpm or current_bpm <= 0:
-            return audio_segment
-        
+    def categorize_sample(file_path):
+        """Get sample category from its filename"""
+        return get_filename_parser().categorize(file_path)
+    
+    def get_layer_volume(self, sample_path, category, rng=None):
+        """Get linear gain that brings sample to its category's loudness target"""
         try:
-            speed_factor = target_bpm / current_bpm
-            new_sample_rate = int(audio_segment.frame_rate * speed_factor)
-            
-            tempo_changed = audio_segment._spawn(
-                audio_segment.raw_data, 
-                overrides={'frame_rate': new_sample_rate}
-            ).set_frame_rate(audio_segment.frame_rate)
-            
-            return tempo_changed
-            
-        except Exception as e:
-            return audio_segment
+            lufs = self.get_features(sample_path)['lufs']
+        except Exception:
+            lufs = None
+        
+        if lufs is None or lufs <= -70:
+            # Loudness unknown: fall back to a random level for the category
+            vol_range = VOLUME_RANGES.get(category, (0.2, 0.7))
+            return (rng or self.rng).uniform(vol_range[0], vol_range[1])
+        
+        gain_db = CATEGORY_TARGET_LUFS.get(category, -22) - lufs
+        gain_db = min(max(gain_db, MIN_LAYER_GAIN_DB), MAX_LAYER_GAIN_DB)
+        return 10 ** (gain_db / 20)
+    
+    def load_layer_audio(self, sample_path, original_bpm, target_bpm=None, tempo_mode=None):
+        """Decode sample and prepare it for looping at target BPM, with caching
+        
+        Returns float32 array of shape (frames, channels) and its frame rate;
+        the loop stays in float until layer gains are applied in the mix
+        """
+        target_bpm = target_bpm or self.target_bpm
+        tempo_mode = tempo_mode or self.tempo_mode
+        # The only cache of stretched audio: file, tempo ratio and engine identify it
+        key = self.sample_cache.make_key(sample_path, original_bpm, target_bpm, tempo_mode)
+        cached = self.sample_cache.get(key)
+        cache_lookup('samples', cached is not None)
+        if cached is not None:
+            return cached
+        
+        with stage('decode'):
+            audio = AudioSegment.from_file(sample_path)
+        count('bytes_decoded', len(audio.raw_data))
+        data = self._prepare_layer(
+            segment_to_array(audio), audio.frame_rate, sample_path, original_bpm, target_bpm, tempo_mode
+        )
+        
+        self.sample_cache.put(key, (data, audio.frame_rate), data.nbytes)
+        return data, audio.frame_rate
+    
+    def load_preview_audio(self, sample_path, original_bpm, target_bpm=None, tempo_mode=None,
+                           frame_rate=PREVIEW_FRAME_RATE):
+        """Decode sample as mono float array at preview rate, prepared like load_layer_audio"""
+        target_bpm = target_bpm or self.target_bpm
+        tempo_mode = tempo_mode or self.tempo_mode
+        key = self.sample_cache.make_key(sample_path, 'preview', frame_rate, original_bpm, target_bpm, tempo_mode)
+        data = self.sample_cache.get(key)
+        cache_lookup('samples', data is not None)
+        if data is not None:
+            return data
+        
+        with stage('decode'):
+            y, _ = librosa.load(sample_path, sr=frame_rate, mono=True)
+        count('bytes_decoded', y.nbytes)
+        data = self._prepare_layer(
+            y.astype(np.float32)[:, None], frame_rate, sample_path, original_bpm, target_bpm, tempo_mode
+        )
+        
+        self.sample_cache.put(key, data, data.nbytes)
+        return data
     
-    def classify_samples(self, samples):
-        """Classify samples into categories"""
-        categories = defaultdict(list)
+    def _prepare_layer(self, data, frame_rate, sample_path, original_bpm, target_bpm, tempo_mode):
+        """Cut decoded sample to a bar-aligned loop and bring it to target BPM"""
+        try:
+            beats = self.get_features(sample_path).get('beats')
+        except Exception:
+            beats = None
         
-        for sample in samples:
-            bpm = self.get_bpm(sample)
-            key = self.get_sample_key(sample)
-            filename = os.path.basename(sample).lower()
-            
-            if any(word in filename for word in ['kick', 'drum', 'bd', 'sd', 'snare', 'hat']):
-                categories['drums'].append((sample, bpm, key))
-            elif any(word in filename for word in ['bass', 'sub', '808', 'low', 'bassline']):
-                categories['bass'].append((sample, bpm, key))
-            elif any(word in filename for word in ['melody', 'lead', 'synth', 'pluck', 'arp']):
-                categories['melody'].append((sample, bpm, key))
-            elif any(word in filename for word in ['chord', 'pad', 'string', 'harmony', 'stabs']):
-                categories['harmony'].append((sample, bpm, key))
-            elif any(word in filename for word in ['fx', 'effect', 'impact', 'sweep', 'rise']):
-                categories['fx'].append((sample, bpm, key))
-            elif any(word in filename for word in ['vocal', 'voice', 'chant', 'sing', 'vox']):
-                categories['vocals'].append((sample, bpm, key))
-            elif any(word in filename for word in ['loop', 'groove', 'full', 'mix']):
-                categories['loops'].append((sample, bpm, key))
-            else:
-                categories['other'].append((sample, bpm, key))
-        
-        return categories
-    
-    def create_multilayer_composition(self, num_layers=3, custom_samples_dir=None):
-        """Create multi-layer composition"""
-        # Get samples from specified directory or default
-        if custom_samples_dir:
-            samples = self.get_all_samples(custom_samples_dir)
-        else:
-            samples = self.get_all_samples()
+        with stage('loop'):
+            data = self.optimize_audio_length(data, frame_rate, original_bpm, beats)
         
-        if not samples:
+        if original_bpm > 0 and abs(original_bpm - target_bpm) > 1:
+            # Keep the loop exactly as many beats long at the new tempo so it doesn't drift
+            n_frames = int(round(len(data) * original_bpm / target_bpm))
+            try:
+                with stage('stretch'):
+                    data = fit_length(
+                        stretch(data, frame_rate, target_bpm / original_bpm, tempo_mode, bpm=original_bpm), n_frames
+                    )
+            except Exception as e:
+                pass
+        
+        return data
+    
+    def get_candidate_index(self, custom_dir=None):
+        """Get index of library samples by category, key and BPM bucket
+        
+        Only names are indexed, in library order, so what a seed picks doesn't
+        depend on which samples happen to be analyzed yet
+        """
+        with stage('scan'):
+            library = get_library(custom_dir if custom_dir else self.samples_dir)
+            samples = library.samples
+        
+        with stage('classify'):
+            index_key = (library.root, library.generation)
+            cache_lookup('candidate_index', self._candidate_index_key == index_key)
+            if self._candidate_index is None or self._candidate_index_key != index_key:
+                parser = get_filename_parser()
+                entries = []
+                for sample in samples:
+                    info = parser.parse_path(sample)
+                    entries.append((sample, info['category'] or 'other', info['key'], info['bpm']))
+                self._candidate_index = CandidateIndex(entries)
+                self._candidate_index_key = index_key
+        return self._candidate_index
+    
+    def plan_composition(self, num_layers=3, custom_samples_dir=None, duration_ms=30000):
+        """Choose categories and samples of a composition from names alone, without decoding audio
+        
+        BPM, key and gain of the picked samples are only known once
+        resolve_plan analyzes them
+        """
+        index = self.get_candidate_index(custom_samples_dir)
+        
+        if not len(index):
             raise ValueError("No audio files found")
         
-        categories = self.classify_samples(samples)
-        layers = []
-        composition_info = {
-            'layers': [],
+        # Every plan draws from its own generator so a seed reproduces it exactly
+        seed = self.seed if self.seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(seed)
+        
+        plan = {
+            'seed': seed,
             'bpm': self.target_bpm,
             'key': self.current_key,
             'mode': 'experimental' if self.experimental_mode else 'standard',
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            'tempo_mode': self.tempo_mode,
+            'duration_ms': int(duration_ms),
+            'resolved': False,
+            'layers': []
         }
         
         priority_order = ['drums', 'bass', 'melody', 'harmony', 'vocals', 'fx', 'loops', 'other']
@@ -297,132 +555,367 @@ class MusicMixer:
         
         available_categories = []
         for category in priority_order:
-            if category in categories and categories[category]:
-                if random.random() < probabilities[category]:
+            if index.count(category):
+                if self.rng.random() < probabilities[category]:
                     available_categories.append(category)
         
         if not available_categories:
             available_categories = [cat for cat in priority_order 
-                                  if cat in categories and categories[cat]]
+                                  if index.count(cat)]
         
         if not available_categories:
-            return [], composition_info
+            return plan
         
         actual_layers = min(num_layers, len(available_categories))
-        selected_categories = random.sample(available_categories, actual_layers)
-        
-        volume_ranges = {
-            'drums': (0.4, 0.9), 'bass': (0.3, 0.8), 'melody': (0.2, 0.7),
-            'harmony': (0.2, 0.6), 'fx': (0.1, 0.8), 'vocals': (0.3, 0.8),
-            'loops': (0.2, 0.7), 'other': (0.1, 0.9)
-        }
+        selected_categories = self.rng.sample(available_categories, actual_layers)
         
-        compatible_keys = self.get_compatible_keys(self.current_key)
+        compatible_keys = CAMELOT_NEIGHBOURS.get(self.current_key, (self.current_key,))
+        bpm = self.target_bpm if self.prefer_close_bpm else None
         
         for category in selected_categories:
-            if categories[category]:
-                compatible_samples = []
-                all_samples = []
-                
-                for sample_info in categories[category]:
-                    sample_path, bpm, key = sample_info
-                    all_samples.append((sample_path, bpm, key))
+            sample_id = index.pick(self.rng, category, self._layer_keys(index, category, compatible_keys), bpm)
+            if sample_id is not None:
+                # Name metadata for now, None where the name has none
+                plan['layers'].append({
+                    'category': category,
+                    'sample': index.paths[sample_id],
+                    'original_bpm': self._filename_bpm(index.paths[sample_id]),
+                    'key': index.keys[sample_id],
+                    'volume': None
+                })
+        
+        return plan
+    
+    @staticmethod
+    def _layer_keys(index, category, compatible_keys):
+        """Keys a layer's sample may be in: compatible (or unknown) ones, any if there are none"""
+        if category in UNPITCHED_CATEGORIES or not len(index.candidate_ids(category, compatible_keys)):
+            return None
+        return compatible_keys
+    
+    def resolve_plan(self, plan, custom_samples_dir=None, progress_callback=None):
+        """Analyze the samples of plan and fill in BPM, key and gain of every layer
+        
+        The picked samples are analyzed together in worker processes, with
+        progress_callback(done, total, sample) called as each finishes.
+        Samples that can't be decoded, or whose detected key clashes, are
+        replaced from a generator seeded by the plan, so the resolved plan
+        only depends on the plan and the sample files. A layer that runs out
+        of attempts falls back to a sample named in a compatible key, and is
+        dropped if there is none
+        """
+        if plan.get('resolved'):
+            return plan
+        
+        index = self.get_candidate_index(custom_samples_dir)
+        rng = random.Random(f"{plan['seed']}:resolve")
+        compatible_keys = CAMELOT_NEIGHBOURS.get(plan['key'], (plan['key'],))
+        bpm = plan['bpm'] if self.prefer_close_bpm else None
+        
+        # Replacement picks are rare and analyzed one at a time below
+        self.analyze_samples([layer['sample'] for layer in plan['layers']], progress_callback)
+        
+        layers = []
+        for layer in plan['layers']:
+            category = layer['category']
+            keys = self._layer_keys(index, category, compatible_keys)
+            sample_id = index.ids.get(layer['sample'])
+            sample_path = layer['sample']
+            tried = set()
+            failures = 0
+            clashes = 0
+            
+            # Re-pick another sample if the chosen one can't be used
+            while True:
+                tried.add(sample_id if sample_id is not None else sample_path)
+                try:
+                    self.get_features(sample_path)
+                    original_bpm = self.get_bpm(sample_path)
+                    bpm_method, bpm_confidence = self.get_tempo_source(sample_path)
+                    if not original_bpm:
+                        # Unknown tempo: the sample is looped at the plan's tempo, unstretched
+                        original_bpm = plan['bpm']
+                    sample_key = self.get_sample_key(sample_path)
                     
-                    if category in ['drums', 'fx', 'other']:
-                        compatible_samples.append((sample_path, bpm, key))
+                    # Unlabelled sample: its key is detected now, pick another if it clashes
+                    unlabelled = self._filename_key(sample_path) is None
+                    if (unlabelled and category not in UNPITCHED_CATEGORIES and sample_key
+                            and sample_key not in compatible_keys):
+                        clashes += 1
                     else:
-                        if key is None or key in compatible_keys:
-                            compatible_samples.append((sample_path, bpm, key))
+                        layers.append(dict(
+                            layer, sample=sample_path, original_bpm=original_bpm, key=sample_key,
+                            bpm_method=bpm_method, bpm_confidence=bpm_confidence,
+                            volume=self.get_layer_volume(sample_path, category, rng)
+                        ))
+                        break
+                    
+                except Exception as e:
+                    failures += 1
                 
-                samples_to_use = compatible_samples if compatible_samples else all_samples
+                if failures >= MAX_PICK_ATTEMPTS:
+                    break
                 
-                if samples_to_use:
-                    sample_path, original_bpm, sample_key = random.choice(samples_to_use)
-                    
-                    try:
-                        audio = AudioSegment.from_file(sample_path)
-                        audio = self.optimize_audio_length(audio, self.target_bpm)
-                        
-                        if original_bpm > 0 and abs(original_bpm - self.target_bpm) > 1:
-                            audio = self.change_tempo(audio, original_bpm, self.target_bpm)
-                        
-                        vol_range = volume_ranges.get(category, (0.2, 0.7))
-                        volume = random.uniform(vol_range[0], vol_range[1])
-                        
-                        layers.append({
-                            'category': category,
-                            'sample': sample_path,
-                            'audio': audio,
-                            'original_bpm': original_bpm,
-                            'key': sample_key,
-                            'volume': volume
-                        })
-                        
-                        composition_info['layers'].append({
-                            'category': category,
-                            'sample': os.path.basename(sample_path),
-                            'original_bpm': original_bpm,
-                            'key': sample_key,
-                            'volume': volume
-                        })
-                        
-                    except Exception as e:
-                        continue
-        
-        return layers, composition_info
-    
-    def generate_mix_audio(self, layers, duration_ms=30000):
-        """Generate final audio mix from layers"""
+                sample_id = None
+                if clashes < MAX_KEY_CLASH_ATTEMPTS:
+                    sample_id = index.pick(rng, category, keys, bpm, tried)
+                if sample_id is None:
+                    sample_id = self._labelled_fallback(index, category, compatible_keys, bpm, tried)
+                if sample_id is None:
+                    break
+                sample_path = index.paths[sample_id]
+        
+        return dict(plan, resolved=True, layers=layers)
+    
+    @staticmethod
+    def _labelled_fallback(index, category, compatible_keys, bpm, tried):
+        """Closest-tempo untried sample of category named in a compatible key, None if there is none"""
+        if category in UNPITCHED_CATEGORIES:
+            return None
+        for sample_id in index.nearest_ids(category, compatible_keys, bpm):
+            sample_id = int(sample_id)
+            if index.keys[sample_id] is not None and sample_id not in tried:
+                return sample_id
+        return None
+    
+    def load_plan_layers(self, plan, progress_callback=None):
+        """Load prepared audio of every layer in resolved plan"""
+        layers = []
+        for layer in plan['layers']:
+            audio, frame_rate = self.load_layer_audio(
+                layer['sample'], layer['original_bpm'], plan['bpm'], plan['tempo_mode']
+            )
+            layers.append(dict(layer, audio=audio, frame_rate=frame_rate))
+            if progress_callback:
+                progress_callback(len(layers), len(plan['layers']), layer['sample'])
+        return layers
+    
+    @staticmethod
+    def get_composition_info(plan, trace=None):
+        """Describe plan for display and manifests, with the stage report of trace if given"""
+        info = {
+            'layers': [
+                dict(layer, sample=os.path.basename(layer['sample'])) for layer in plan['layers']
+            ],
+            'bpm': plan['bpm'],
+            'key': plan['key'],
+            'mode': plan['mode'],
+            'tempo_mode': plan['tempo_mode'],
+            'duration_ms': plan['duration_ms'],
+            'seed': plan['seed'],
+            'plan_hash': plan_hash(plan),
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if trace is not None:
+            info['trace'] = trace.report()
+        return info
+    
+    def create_multilayer_composition(self, num_layers=3, custom_samples_dir=None, progress_callback=None):
+        """Create multi-layer composition"""
+        plan = self.plan_composition(num_layers, custom_samples_dir)
+        plan = self.resolve_plan(plan, custom_samples_dir, progress_callback)
+        return self.load_plan_layers(plan), self.get_composition_info(plan)
+    
+    def render_plan(self, plan, output_format='wav', bit_depth=None, frame_rate=None, progress_callback=None):
+        """Render plan, reusing an earlier render of the same plan if there is one
+        
+        progress_callback(done, total, sample) is called as layers are decoded
+        """
+        plan = self.resolve_plan(plan)
+        os.makedirs(self.render_cache_dir, exist_ok=True)
+        name = plan_hash(plan)
+        if bit_depth:
+            name += f"_{bit_depth}bit"
+        if frame_rate:
+            name += f"_{frame_rate}hz"
+        output_path = os.path.join(self.render_cache_dir, f"{name}.{output_format}")
+        
+        cache_lookup('renders', os.path.exists(output_path))
+        if os.path.exists(output_path):
+            # Mark as recently used so workspace cleanup keeps it
+            self.workspace.touch(output_path)
+            return output_path
+        
+        # Render under a private name and move it into place when complete
+        temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            self.generate_mix_audio(
+                self.load_plan_layers(plan, progress_callback), plan['duration_ms'], output_format,
+                output_path=temp_path, bit_depth=bit_depth, frame_rate=frame_rate
+            )
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        return output_path
+    
+    def render_layout(self, plan, output_format='wav', frame_rate=None):
+        """Sample rate and channel count render_plan writes plan in, read from sample headers"""
+        rates = []
+        channels = []
+        for layer in self.resolve_plan(plan)['layers']:
+            try:
+                info = sf.info(layer['sample'])
+                rates.append(info.samplerate)
+                channels.append(info.channels)
+            except Exception:
+                # Formats libsndfile can't read are decoded like the render decodes them
+                audio = AudioSegment.from_file(layer['sample'])
+                rates.append(audio.frame_rate)
+                channels.append(audio.channels)
+        
+        if not rates:
+            raise ValueError("No layers to mix")
+        return output_frame_rate(output_format, frame_rate or max(rates)), max(channels)
+    
+    def render_preview(self, plan, bars=PREVIEW_BARS, progress_callback=None):
+        """Render a quick mono draft of the first bars of plan
+        
+        progress_callback(done, total, sample) is called as layers are decoded
+        """
+        plan = self.resolve_plan(plan)
+        os.makedirs(self.render_cache_dir, exist_ok=True)
+        output_path = os.path.join(self.render_cache_dir, f"{plan_hash(plan)}_preview{bars}.wav")
+        
+        cache_lookup('renders', os.path.exists(output_path))
+        if os.path.exists(output_path):
+            self.workspace.touch(output_path)
+            return output_path
+        
+        duration_ms = min(plan['duration_ms'], bars * 4 * 60000 / plan['bpm'])
+        n_frames = int(round(duration_ms * PREVIEW_FRAME_RATE / 1000))
+        
+        arrays = []
+        for layer in plan['layers']:
+            arrays.append(
+                self.load_preview_audio(layer['sample'], layer['original_bpm'], plan['bpm'], plan['tempo_mode'])
+            )
+            if progress_callback:
+                progress_callback(len(arrays), len(plan['layers']), layer['sample'])
+        gains = [layer['volume'] for layer in plan['layers']]
+        with stage('mix'):
+            mix = mix_layers(arrays, gains, n_frames)
+        
+        temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with stage('encode'):
+                write_wav(temp_path, mix, PREVIEW_FRAME_RATE)
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        
+        return output_path
+    
+    @staticmethod
+    @traced('mix')
+    def _prepare_mix(layers, duration_ms, block_ms, output_format='wav', frame_rate=None):
+        """Convert layers to a common float layout and plan render blocks"""
         if not layers:
             raise ValueError("No layers to mix")
         
-        # Create empty audio of required length
-        mix_audio = AudioSegment.silent(duration=duration_ms)
+        # Convert every layer once (like pydub overlay sync), straight to the output rate
+        frame_rate = frame_rate or max(layer['frame_rate'] for layer in layers)
+        frame_rate = output_frame_rate(output_format, frame_rate)
+        channels = max(layer['audio'].shape[1] for layer in layers)
+        arrays = [conform_array(layer['audio'], layer['frame_rate'], frame_rate, channels) for layer in layers]
+        gains = [layer['volume'] for layer in layers]
+        
+        n_frames = int(round(duration_ms * frame_rate / 1000))
+        block_frames = max(1, int(frame_rate * block_ms / 1000))
+        # Blocks are mixed while the encoder pulls them, time that as mixing too
+        # (the call of this render was counted above)
+        blocks = traced_iter(
+            'mix', iter_mix_blocks(arrays, gains, n_frames, block_frames, frame_rate=frame_rate), calls=0
+        )
+        
+        return blocks, n_frames, frame_rate, channels
+    
+    @staticmethod
+    def _check_output(output_format, bit_depth):
+        """Reject output settings that can't be written before rendering starts"""
+        if not encoder_available(output_format):
+            raise ValueError(f"Unsupported output format: {output_format}")
+        output_subtype(output_format, bit_depth)
+    
+    def generate_mix_audio(self, layers, duration_ms=30000, output_format='wav', block_ms=DEFAULT_BLOCK_MS,
+                           output_path=None, bit_depth=None, frame_rate=None):
+        """Generate final audio mix from layers"""
+        self._check_output(output_format, bit_depth)
         
-        for layer in layers:
-            audio = layer['audio']
-            gain_db = 20 * math.log10(layer['volume'])
-            audio_with_gain = audio.apply_gain(gain_db)
-            
-            # Loop layer to required length
-            looped_audio = AudioSegment.empty()
-            while len(looped_audio) < duration_ms:
-                looped_audio += audio_with_gain
-            
-            looped_audio = looped_audio[:duration_ms]
-            
-            # Overlay layer on mix
-            mix_audio = mix_audio.overlay(looped_audio)
+        blocks, n_frames, frame_rate, channels = self._prepare_mix(
+            layers, duration_ms, block_ms, output_format, frame_rate
+        )
         
-        # Save to temporary file
-        temp_file = os.path.join(self.temp_dir, f"mix_{datetime.now().strftime('%H%M%S')}.wav")
-        mix_audio.export(temp_file, format="wav")
+        # Render block by block straight into the output file
+        if output_path is None:
+            # The directory may have been evicted from the workspace since the mixer was created
+            os.makedirs(self.temp_dir, exist_ok=True)
+            output_path = os.path.join(self.temp_dir, self.workspace.unique_name('mix', f".{output_format}"))
+        with stage('encode'):
+            write_encoded(output_path, blocks, frame_rate, channels, output_format, bit_depth)
         
-        return temp_file
+        return output_path
     
-    def generate_complete_mix(self, num_layers=3, custom_samples_dir=None):
+    def stream_mix_audio(self, layers, duration_ms=30000, block_ms=DEFAULT_BLOCK_MS, output_format='wav',
+                         bit_depth=None, frame_rate=None):
+        """Generate final audio mix as encoded byte chunks, produced while rendering
+        
+        For API callers that forward audio as it is encoded; the web UI
+        shows the draft preview first and serves full renders as files
+        """
+        self._check_output(output_format, bit_depth)
+        
+        blocks, n_frames, frame_rate, channels = self._prepare_mix(
+            layers, duration_ms, block_ms, output_format, frame_rate
+        )
+        return iter_encoded_bytes(blocks, n_frames, frame_rate, channels, output_format, bit_depth)
+    
+    def generate_complete_mix(self, num_layers=3, custom_samples_dir=None, progress_callback=None,
+                              render_callback=None):
         """Complete mix generation process"""
         try:
-            # 1. Create composition
-            layers, composition_info = self.create_multilayer_composition(
-                num_layers, custom_samples_dir
-            )
-            
-            if not layers:
-                raise ValueError("Could not create composition")
-            
-            # 2. Generate audio file
-            audio_path = self.generate_mix_audio(layers)
+            with Trace('complete_mix') as trace:
+                # 1. Plan composition and analyze the samples it picked
+                plan = self.plan_composition(num_layers, custom_samples_dir)
+                plan = self.resolve_plan(plan, custom_samples_dir, progress_callback)
+                
+                if not plan['layers']:
+                    raise ValueError("Could not create composition")
+                
+                # 2. Generate audio file (or reuse the render of an identical plan)
+                audio_path = self.render_plan(plan, progress_callback=render_callback)
             
             # 3. Format description
-            description = self._format_composition_info(composition_info)
+            composition_info = self.get_composition_info(plan, trace)
+            description = self.format_composition_info(composition_info)
             
             return audio_path, description, composition_info
             
         except Exception as e:
             raise
     
-    def _format_composition_info(self, composition_info):
+    def generate_preview_mix(self, num_layers=3, custom_samples_dir=None, progress_callback=None,
+                             render_callback=None):
+        """Plan a composition and render only a quick draft of it
+        
+        progress_callback reports resolving the layers, render_callback
+        decoding them for the draft
+        """
+        with Trace('preview') as trace:
+            plan = self.plan_composition(num_layers, custom_samples_dir)
+            plan = self.resolve_plan(plan, custom_samples_dir, progress_callback)
+            
+            if not plan['layers']:
+                raise ValueError("Could not create composition")
+            
+            preview_path = self.render_preview(plan, progress_callback=render_callback)
+        description = self.format_composition_info(self.get_composition_info(plan, trace))
+        
+        return preview_path, description, plan
+    
+    def format_composition_info(self, composition_info):
         """Format composition information"""
         text = f"""
 🎶 **Generated Mix!**
@@ -432,13 +925,21 @@ class MusicMixer:
 • BPM: {composition_info['bpm']}
 • Key: {composition_info['key']}
 • Mode: {composition_info['mode']}
+• Tempo engine: {composition_info.get('tempo_mode', 'resample')}
+• Seed: {composition_info.get('seed')}
         
 **Mix Composition:**
 """
         
         for i, layer in enumerate(composition_info['layers'], 1):
             key_info = f", key: {layer['key']}" if layer['key'] else ""
+            bpm_info = " (not detected)" if layer.get('bpm_method') == 'fallback' else ""
             text += f"\n{i}. {layer['category']}: {layer['sample']} "
-            text += f"(BPM: {layer['original_bpm']}, volume: {layer['volume']:.2f}{key_info})"
+            text += f"(BPM: {layer['original_bpm']}{bpm_info}, volume: {layer['volume']:.2f}{key_info})"
+        
+        trace = composition_info.get('trace')
+        if trace:
+            stages = ", ".join(f"{name} {record['wall_seconds']:.2f} s" for name, record in trace['stages'].items())
+            text += f"\n\n**Timing:** {trace['wall_seconds']:.2f} s" + (f" ({stages})" if stages else "")
         
         return text
\ No newline at end of file
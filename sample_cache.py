@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Default memory budget for decoded samples, override with MUSIC_MIXER_SAMPLE_CACHE_MB
+DEFAULT_CACHE_MB = 512
+
+
+class DecodedSampleCache:
+    """Thread-safe LRU cache of prepared sample audio with a byte budget"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(file_path, *params):
+        """Build cache key that changes when the file is modified"""
+        st = os.stat(file_path)
+        return (os.path.abspath(file_path), st.st_size, st.st_mtime_ns) + tuple(params)
+
+    def get(self, key):
+        """Get cached value and mark it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store value, evicting least recently used entries over budget"""
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Get cache usage counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_sample_cache():
+    """Get process-wide decoded sample cache"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            budget_mb = float(os.environ.get("MUSIC_MIXER_SAMPLE_CACHE_MB", DEFAULT_CACHE_MB))
+            _shared_cache = DecodedSampleCache(int(budget_mb * 1024 * 1024))
+        return _shared_cache
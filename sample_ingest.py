@@ -0,0 +1,132 @@
+import os
+import shutil
+import zipfile
+
+from sample_library import get_audio_format
+
+# Limits on uploaded archives, checked before anything is extracted;
+# override the size with MUSIC_MIXER_MAX_ARCHIVE_MB
+MAX_ARCHIVE_MEMBERS = 20000
+MAX_ARCHIVE_BYTES = int(float(os.environ.get("MUSIC_MIXER_MAX_ARCHIVE_MB", 4096)) * 1024 * 1024)
+
+# Large members that compress better than this are treated as zip bombs
+MAX_COMPRESSION_RATIO = 100
+RATIO_CHECK_MIN_BYTES = 16 * 1024 * 1024
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def link_or_copy(source, destination):
+    """Hard link file to destination, copying when linking isn't possible"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def unique_path(directory, name):
+    """Path for name in directory that doesn't exist yet, adding " (copy N)" on collisions
+
+    The suffix can't be read as a BPM or key, which a bare number could be
+    """
+    stem, extension = os.path.splitext(name)
+    path = os.path.join(directory, name)
+    copy = 1
+    while os.path.exists(path):
+        copy += 1
+        path = os.path.join(directory, f"{stem} (copy {copy}){extension}")
+    return path
+
+
+def _member_path(name):
+    """Relative path of archive member, None if it would land outside the target"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or ':' in parts[0]:
+        return None
+    return os.path.join(*parts)
+
+
+def list_audio_members(archive):
+    """Audio members of open ZipFile with their relative paths, skipping metadata and nested archives"""
+    members = []
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+
+        path = _member_path(info.filename)
+        if path is None:
+            continue
+
+        # macOS resource forks and hidden files are never samples
+        parts = path.split(os.sep)
+        if parts[0] == '__MACOSX' or any(part.startswith('.') for part in parts):
+            continue
+
+        if get_audio_format(parts[-1]):
+            members.append((info, path))
+    return members
+
+
+def check_archive_limits(archive, members, max_bytes=MAX_ARCHIVE_BYTES, max_members=MAX_ARCHIVE_MEMBERS):
+    """Refuse archive if it has too many entries or its audio would take too much space"""
+    if max_members and len(archive.infolist()) > max_members:
+        raise ValueError(f"Archive has more than {max_members} entries")
+
+    total = 0
+    for info, _ in members:
+        total += info.file_size
+        if (info.file_size > RATIO_CHECK_MIN_BYTES and info.compress_size
+                and info.file_size / info.compress_size > MAX_COMPRESSION_RATIO):
+            raise ValueError(f"Suspicious compression ratio for {info.filename}")
+
+    if max_bytes and total > max_bytes:
+        raise ValueError(f"Archive audio is larger than {max_bytes // (1024 * 1024)} MB")
+    return total
+
+
+def extract_audio_members(zip_path, target_dir, max_bytes=MAX_ARCHIVE_BYTES, max_members=MAX_ARCHIVE_MEMBERS):
+    """Extract only the audio files of an archive, returns their count"""
+    with zipfile.ZipFile(zip_path, 'r') as archive:
+        members = list_audio_members(archive)
+        check_archive_limits(archive, members, max_bytes, max_members)
+
+        written = 0
+        for info, path in members:
+            destination = os.path.join(target_dir, path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+            # Count real bytes, headers can understate member sizes
+            with archive.open(info) as source, open(destination, 'wb') as output:
+                for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                    written += len(chunk)
+                    if max_bytes and written > max_bytes:
+                        raise ValueError(f"Archive audio is larger than {max_bytes // (1024 * 1024)} MB")
+                    output.write(chunk)
+
+    return len(members)
+
+
+def ingest_uploads(file_paths, target_dir):
+    """Bring uploaded audio files and archives into a sample directory
+
+    Each archive is extracted into a directory named after it and loose files
+    that share a name are kept side by side, so no upload replaces another
+    """
+    stats = {'audio_files': 0, 'archives': 0, 'skipped': 0}
+
+    for file_path in file_paths:
+        name = os.path.basename(file_path)
+        if name.lower().endswith('.zip'):
+            archive_dir = unique_path(target_dir, os.path.splitext(name)[0])
+            stats['audio_files'] += extract_audio_members(file_path, archive_dir)
+            stats['archives'] += 1
+        elif get_audio_format(name):
+            # Uploads are already on local disk, link them instead of copying
+            link_or_copy(file_path, unique_path(target_dir, name))
+            stats['audio_files'] += 1
+        else:
+            stats['skipped'] += 1
+
+    return stats
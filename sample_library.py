@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import Counter
+
+# Supported audio extensions and the format they are reported as
+AUDIO_EXTENSIONS = {
+    '.wav': 'wav', '.mp3': 'mp3', '.flac': 'flac', '.aiff': 'aiff', '.aif': 'aiff'
+}
+
+
+def get_audio_format(filename):
+    """Get audio format of file from its extension, None if unsupported"""
+    return AUDIO_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+class SampleLibrary:
+    """Index of audio files under a directory, refreshed incrementally"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+        # Directory path -> (mtime_ns, audio files, subdirectories)
+        self._dirs = {}
+        self._samples = []
+        self._lock = threading.Lock()
+
+        # Incremented whenever the list of samples changes
+        self.generation = 0
+
+    @staticmethod
+    def _scan_dir(path):
+        """List audio files and subdirectories of one directory"""
+        files = []
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif get_audio_format(entry.name) and entry.is_file():
+                    files.append(entry.path)
+        files.sort()
+        subdirs.sort()
+        return files, subdirs
+
+    def refresh(self):
+        """Rescan directories whose modification time changed"""
+        with self._lock:
+            dirs = {}
+            stack = [self.root]
+            rescanned = 0
+
+            while stack:
+                path = stack.pop()
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+
+                cached = self._dirs.get(path)
+                if cached and cached[0] == mtime_ns:
+                    files, subdirs = cached[1], cached[2]
+                else:
+                    try:
+                        files, subdirs = self._scan_dir(path)
+                    except OSError:
+                        continue
+                    rescanned += 1
+
+                dirs[path] = (mtime_ns, files, subdirs)
+                stack.extend(reversed(subdirs))
+
+            if rescanned or len(dirs) != len(self._dirs):
+                self._samples = [f for path in sorted(dirs) for f in dirs[path][1]]
+                self.generation += 1
+            self._dirs = dirs
+            return rescanned
+
+    @property
+    def samples(self):
+        """All audio files in the library"""
+        return list(self._samples)
+
+    def counts_by_format(self):
+        """Number of audio files per format"""
+        counts = Counter(get_audio_format(f) for f in self._samples)
+        return {fmt: counts.get(fmt, 0) for fmt in dict.fromkeys(AUDIO_EXTENSIONS.values())}
+
+    def counts_by_category(self, categorize):
+        """Number of audio files per category given by categorize(path)"""
+        return dict(Counter(categorize(f) for f in self._samples))
+
+    def __len__(self):
+        return len(self._samples)
+
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def get_library(root):
+    """Get shared, freshly refreshed library index for directory"""
+    root = os.path.abspath(root)
+    with _libraries_lock:
+        library = _libraries.get(root)
+        if library is None:
+            library = _libraries[root] = SampleLibrary(root)
+
+    library.refresh()
+    return library
+
+
+def forget_library(root):
+    """Drop cached index of directory"""
+    with _libraries_lock:
+        _libraries.pop(os.path.abspath(root), None)
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from analysis_index import AnalysisIndex
+from audio_analysis import FEATURES_VERSION
+from music_mixer_logic import MusicMixer
+from sample_cache import DecodedSampleCache
+from workspace import Workspace
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = AnalysisIndex(str(tmp_path / 'analysis_index.sqlite'))
+    yield index
+    index.close()
+
+
+def write_file(path, data=b'x'):
+    with open(path, 'wb') as output:
+        output.write(data)
+    return str(path)
+
+
+def set_mtime_ns(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_record_is_dropped_when_file_changes(tmp_path, index):
+    path = write_file(tmp_path / 'kick.wav')
+    index.update(path, bpm=128)
+    index.update(path, key='8A')
+    assert index.get(path) == {'bpm': 128, 'key': '8A'}
+
+    # Same size, new mtime
+    set_mtime_ns(path, os.stat(path).st_mtime_ns + 1_000_000_000)
+    assert index.get(path) is None
+
+    # Same mtime, new size
+    index.update(path, bpm=128)
+    mtime_ns = os.stat(path).st_mtime_ns
+    write_file(path, b'xx')
+    set_mtime_ns(path, mtime_ns)
+    assert index.get(path) is None
+
+    # Fields of a stale record aren't merged into the new one
+    index.update(path, key='9A')
+    assert index.get(path) == {'key': '9A'}
+
+
+def test_many_files_are_read_and_written_at_once(tmp_path, index):
+    paths = [write_file(tmp_path / f'loop_{i}.wav') for i in range(1200)]
+    missing = str(tmp_path / 'missing.wav')
+
+    index.update_many({path: {'bpm': i} for i, path in enumerate(paths + [missing])})
+    assert len(index) == len(paths)
+
+    records = index.get_many(paths + [missing])
+    assert records == {path: {'bpm': i} for i, path in enumerate(paths)}
+
+
+def test_prune_removes_records_of_deleted_and_modified_files(tmp_path, index):
+    kept = write_file(tmp_path / 'kept.wav')
+    deleted = write_file(tmp_path / 'deleted.wav')
+    modified = write_file(tmp_path / 'modified.wav')
+    os.makedirs(tmp_path / 'other')
+    elsewhere = write_file(tmp_path / 'other' / 'gone.wav')
+    index.update_many({path: {'bpm': 120} for path in (kept, deleted, modified, elsewhere)})
+
+    os.remove(deleted)
+    write_file(modified, b'changed')
+    os.remove(elsewhere)
+
+    assert index.prune(str(tmp_path / 'other')) == 1
+    assert index.prune() == 2
+    assert len(index) == 1
+    assert index.get(kept) == {'bpm': 120}
+
+
+def test_records_of_older_feature_versions_are_recomputed(tmp_path, index):
+    path = str(tmp_path / 'Loop.wav')
+    t = np.arange(22050) / 22050
+    sf.write(path, 0.5 * np.sin(2 * np.pi * 220 * t), 22050)
+
+    mixer = MusicMixer(
+        samples_dir=str(tmp_path), analysis_index=index, analysis_workers=1,
+        sample_cache=DecodedSampleCache(), workspace=Workspace(str(tmp_path / 'workspace')),
+    )
+    try:
+        index.update(path, bpm=100, features_version=FEATURES_VERSION - 1)
+        features = mixer.get_features(path)
+        assert features['features_version'] == FEATURES_VERSION
+        assert index.get(path)['features_version'] == FEATURES_VERSION
+    finally:
+        mixer.cleanup()
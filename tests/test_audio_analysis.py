@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from audio_analysis import (
+    ANALYSIS_SAMPLE_RATE, FEATURES_VERSION, FAST_TEMPO_DURATION, estimate_key, estimate_tempo, extract_features,
+)
+
+SR = ANALYSIS_SAMPLE_RATE
+
+
+def click_track(bpm, seconds):
+    """Short decaying 2 kHz clicks on every beat"""
+    y = np.zeros(int(seconds * SR), dtype=np.float32)
+    n = np.arange(int(0.01 * SR))
+    click = (np.exp(-n / (0.002 * SR)) * np.sin(2 * np.pi * 2000 * n / SR)).astype(np.float32)
+    for beat in np.arange(0, seconds, 60.0 / bpm):
+        start = int(beat * SR)
+        segment = y[start:start + len(click)]
+        segment += click[:len(segment)]
+    return y
+
+
+def held_chord(midi_notes, seconds=4):
+    """Equal mix of sine tones at MIDI note numbers"""
+    t = np.arange(int(seconds * SR)) / SR
+    tones = [np.sin(2 * np.pi * 440 * 2 ** ((note - 69) / 12) * t) for note in midi_notes]
+    return (sum(tones) / len(tones)).astype(np.float32)
+
+
+@pytest.mark.parametrize('bpm', [90, 100, 128])
+@pytest.mark.parametrize('bars', [4, None])
+def test_clicks_are_timed_by_the_fast_tier(bpm, bars):
+    # Whole bars within the fast window are read as a loop, anything else linearly
+    seconds = bars * 240.0 / bpm if bars else FAST_TEMPO_DURATION + 4
+    tempo = estimate_tempo(click_track(bpm, seconds), SR)
+    assert (tempo['bpm'], tempo['method'], tempo['alternative']) == (bpm, 'autocorrelation', None)
+    assert tempo['confidence'] > 0.5
+    assert np.allclose(np.diff(tempo['beats']), 60.0 / bpm)
+
+
+def test_fast_tempo_with_half_tempo_in_range_is_flagged():
+    tempo = estimate_tempo(click_track(170, 12), SR)
+    assert (tempo['bpm'], tempo['alternative']) == (170, 85)
+
+
+def test_aperiodic_audio_falls_back_to_beat_tracking():
+    noise = np.random.default_rng(0).standard_normal(SR * 10).astype(np.float32) * 0.1
+    tempo = estimate_tempo(noise, SR)
+    assert tempo['method'] in ('beat_track', 'tempo')
+    assert tempo['confidence'] < 0.4
+
+
+@pytest.mark.parametrize('notes, key', [
+    ([48, 60, 64, 67], '8B'),   # C major
+    ([45, 57, 60, 64], '8A'),   # A minor
+    ([43, 55, 59, 62], '9B'),   # G major
+    ([50, 62, 65, 69], '7A'),   # D minor
+])
+def test_chord_key(notes, key):
+    detected, confidence = estimate_key(held_chord(notes), SR)
+    assert detected == key
+    assert confidence >= 0.6
+
+
+def test_silence_has_no_key():
+    assert estimate_key(np.zeros(SR, dtype=np.float32), SR) == (None, 0.0)
+
+
+def test_feature_record():
+    y = click_track(128, 240.0 / 128 * 4)
+    y *= 0.5 / np.abs(y).max()
+    features = extract_features(y, SR)
+
+    assert features['features_version'] == FEATURES_VERSION
+    assert (features['bpm'], features['bpm_method'], features['bpm_ambiguous']) == (128, 'autocorrelation', False)
+    assert features['duration'] == round(len(y) / SR, 3)
+    assert features['peak_db'] == pytest.approx(-6.02, abs=0.01)
+    assert features['rms_db'] < features['peak_db']
+    assert features['onset_density'] == pytest.approx(128 / 60, rel=0.1)
+    assert 'key' in features and 'key_confidence' in features
+
+    assert 'key' not in extract_features(y, SR, with_key=False)
@@ -0,0 +1,73 @@
+import random
+
+import numpy as np
+import pytest
+
+from candidate_index import CAMELOT_NEIGHBOURS, CandidateIndex
+
+
+def build_index(bpms_by_key, category='bass'):
+    """Index of one category with a sample per (key, BPM), named after both"""
+    return CandidateIndex([
+        (f"{key}_{bpm}.wav", category, key, bpm)
+        for key, bpms in bpms_by_key.items() for bpm in bpms
+    ])
+
+
+LIBRARY = {
+    '8A': [80, 96, 118, 124, 127, 131, 150, 174, None],
+    '9A': [100, 126, 160],
+    '3B': [125, 128],
+    None: [129, None],
+}
+
+
+def names(index, ids):
+    return [index.paths[sample_id] for sample_id in ids]
+
+
+@pytest.mark.parametrize('count', [1, 2, 5, 9, None])
+@pytest.mark.parametrize('bpm', [126, 90, 200])
+def test_nearest_ids_match_a_full_sort(count, bpm):
+    index = build_index(LIBRARY)
+    keys = CAMELOT_NEIGHBOURS['8A']
+
+    candidates = [
+        (abs(sample_bpm - bpm) if sample_bpm else np.inf, f"{key}_{sample_bpm}.wav")
+        for key, bpms in LIBRARY.items() if key is None or key in keys for sample_bpm in bpms
+    ]
+    expected = [distance for distance, _ in sorted(candidates)][:count]
+    nearest = index.nearest_ids('bass', keys, bpm, count)
+    distances = np.abs(index.bpms[nearest] - bpm)
+    assert list(np.where(np.isnan(distances), np.inf, distances)) == expected
+    assert not {'3B_125.wav', '3B_128.wav'} & set(names(index, nearest))
+
+
+def test_pick_stays_near_the_target_tempo_until_those_are_used():
+    index = build_index(LIBRARY)
+    keys = CAMELOT_NEIGHBOURS['8A']
+    rng = random.Random(0)
+    # Buckets 115-139 BPM, and unknown BPM
+    near = {
+        '8A_118.wav', '8A_124.wav', '8A_127.wav', '8A_131.wav', '9A_126.wav',
+        'None_129.wav', '8A_None.wav', 'None_None.wav',
+    }
+
+    picks = {index.paths[index.pick(rng, 'bass', keys, 127)] for _ in range(200)}
+    assert picks == near
+
+    # Keys outside the compatible ones are never drawn, far tempos only once the near ones are excluded
+    exclude = {index.ids[name] for name in near}
+    picks = {index.paths[index.pick(rng, 'bass', keys, 127, exclude)] for _ in range(200)}
+    assert picks and not picks & (near | {'3B_125.wav', '3B_128.wav'})
+
+    exclude = set(range(len(index)))
+    assert index.pick(rng, 'bass', keys, 127, exclude) is None
+
+
+def test_pick_weights_closer_tempos_higher():
+    index = build_index({'8A': [128, 131]})
+    rng = random.Random(1)
+    picks = [index.paths[index.pick(rng, 'bass', None, 128)] for _ in range(2000)]
+    # Weights 1 and 1 / (1 + 0.3 ** 2)
+    assert picks.count('8A_128.wav') / len(picks) == pytest.approx(1 / (1 + 1 / 1.09), abs=0.04)
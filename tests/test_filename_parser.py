@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import filename_parser
+from filename_parser import FilenameParser, get_filename_parser, load_category_rules
+
+
+@pytest.mark.parametrize('name, key', [
+    ('bass_8A_124bpm.wav', '8A'),
+    ('snare 1a.wav', '1A'),
+    ('Key8A chord.wav', '8A'),
+    ('sub 8a-key.wav', '8A'),
+    ('12A 8B chord.wav', '12A'),
+    ('Eb minor pad.wav', '2A'),
+    ('Bbmaj sub.wav', '6B'),
+    ('C#min arp.wav', '12A'),
+    ('F major stabs.wav', '7B'),
+    # Note names must start a word, Camelot keys must stand alone
+    ('admin loop.wav', None),
+    ('a1b2.wav', None),
+    ('synth 13A.wav', None),
+])
+def test_key(name, key):
+    assert FilenameParser().parse(name)['key'] == key
+
+
+@pytest.mark.parametrize('name, bpm', [
+    ('kick 79bpm.wav', None),
+    ('kick 80bpm.wav', 80),
+    ('kick 180 BPM.wav', 180),
+    ('kick 181bpm.wav', None),
+    ('BPM174 vox.wav', 174),
+    ('124_bass.wav', 124),
+    ('Groove (95).wav', 95),
+    ('Lead 10B 128', 128),
+    ('Groove (copy 95).wav', None),
+    # A tagged BPM wins over a bare number
+    ('Drums 120bpm (128).wav', 120),
+])
+def test_bpm(name, bpm):
+    assert FilenameParser().parse(name)['bpm'] == bpm
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('/pack/Pack 8A 124bpm/kick.wav', (124, '8A', 'drums')),
+    ('/pack/Pack 8A 124bpm/kick 126bpm.wav', (126, '8A', 'drums')),
+    ('/pack/Deep 118/Bass 3B.wav', (118, '3B', 'bass')),
+    # The category only comes from the file name
+    ('/pack/Bass/one.wav', (None, None, None)),
+])
+def test_parent_directory_fills_in_bpm_and_key(path, expected):
+    info = FilenameParser().parse_path(path)
+    assert (info['bpm'], info['key'], info['category']) == expected
+
+
+@pytest.mark.parametrize('rules', [
+    {'vocals': ['shout'], 'drums': ['perc', 'shout']},
+    [['vocals', ['shout']], ['drums', ['perc', 'shout']]],
+])
+def test_custom_category_rules(tmp_path, rules):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(rules))
+    parser = FilenameParser(load_category_rules(str(path)))
+
+    assert parser.categorize('Shout 8A.wav') == 'vocals'
+    assert parser.categorize('Perc loop.wav') == 'drums'
+    assert parser.categorize('Kick.wav') == 'other'
+
+
+@pytest.mark.parametrize('rules, message', [
+    ({'percussion': ['perc']}, 'Unknown category'),
+    ({'drums': 'perc'}, 'list of strings'),
+    ([['drums', ['perc', 1]]], 'list of strings'),
+])
+def test_invalid_category_rules_are_refused(tmp_path, rules, message):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(rules))
+    with pytest.raises(ValueError, match=message):
+        load_category_rules(str(path))
+
+
+def test_shared_parser_reads_rules_from_environment(tmp_path, monkeypatch):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({'fx': ['kick']}))
+    monkeypatch.setenv('MUSIC_MIXER_CATEGORY_RULES', str(path))
+    monkeypatch.setattr(filename_parser, '_shared_parser', None)
+
+    assert get_filename_parser().categorize('Kick 01.wav') == 'fx'
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from mix_engine import MIX_PEAK_CEILING, add_looped, bus_gain, conform_array, iter_mix_blocks, mix_layers, prepare_loop
+
+
+def spike_layers(frame_rate):
+    """Two loops of different lengths whose peaks only line up after the first probe block"""
+    late = np.zeros((frame_rate * 10, 1), dtype=np.float32)
+    late[frame_rate * 9] = 0.6
+    steady = np.full((3, 1), 0.5, dtype=np.float32)
+    return [late, steady]
+
+
+def test_bus_peak_stays_under_ceiling_when_loops_line_up_late():
+    frame_rate = 1000
+    arrays = spike_layers(frame_rate)
+    n_frames = frame_rate * 20
+
+    assert bus_gain(arrays, n_frames, frame_rate) < 1.0
+
+    blocks = np.concatenate(list(iter_mix_blocks(arrays, [1.0, 1.0], n_frames, 4096, frame_rate=frame_rate)))
+    assert len(blocks) == n_frames
+    assert np.abs(blocks).max() <= MIX_PEAK_CEILING
+
+    assert np.abs(mix_layers(arrays, [1.0, 1.0], n_frames)).max() <= MIX_PEAK_CEILING
+
+
+def test_limiter_never_exceeds_ceiling():
+    frame_rate = 1000
+    loud = np.full((frame_rate, 2), 0.95, dtype=np.float32)
+    blocks = iter_mix_blocks([loud, loud], [1.0, 1.0], frame_rate * 3, 700, ceiling=None, frame_rate=frame_rate)
+    # Without bus gain only the limiter holds the peak, at full scale
+    assert np.abs(np.concatenate(list(blocks))).max() <= 1.0
+
+
+def test_exactly_cut_loop_has_no_level_dip_at_seam():
+    frame_rate, bpm = 22050, 120
+    bar = frame_rate * 2
+    # Sustained tone with a whole number of cycles per bar, cut exactly to one bar
+    t = np.arange(bar) / frame_rate
+    data = (0.5 * np.sin(2 * np.pi * 105 * t)).astype(np.float32)[:, None]
+
+    loop = prepare_loop(data, frame_rate, bpm)
+    assert len(loop) == 4 * bar
+
+    # Windows of whole cycles, so only a level change moves their RMS
+    window = 4 * frame_rate // 105
+    rms = [
+        float(np.sqrt(np.mean(loop[start:start + window] ** 2)))
+        for start in range(bar - 3 * window, bar + 3 * window, window)
+    ]
+    assert min(rms) > 0.99 * max(rms)
+
+
+def test_layers_are_summed_at_their_gains():
+    a = np.full((4, 1), 0.2, dtype=np.float32)
+    b = np.full((4, 1), -0.1, dtype=np.float32)
+    mixed = mix_layers([a, b], [0.5, 2.0], 4, limit=False)
+    assert np.allclose(mixed, 0.5 * 0.2 - 2.0 * 0.1)
+
+
+def test_loud_mix_is_scaled_to_the_ceiling():
+    loud = np.array([[0.9], [-0.3]], dtype=np.float32)
+    mixed = mix_layers([loud, loud], [1.0, 1.0], 6, limit=False)
+    assert np.abs(mixed).max() == pytest.approx(MIX_PEAK_CEILING)
+    assert np.allclose(mixed[:2, 0], np.array([1.8, -0.6]) * MIX_PEAK_CEILING / 1.8)
+
+
+@pytest.mark.parametrize('offset', [0, 3, 7, 12])
+def test_loop_wraps_around_from_any_offset(offset):
+    data = np.arange(5, dtype=np.float32)[:, None]
+    out = add_looped(np.ones((13, 1), dtype=np.float32), data, gain=2.0, offset=offset)
+    expected = 1.0 + 2.0 * ((np.arange(13) + offset) % 5)
+    assert np.array_equal(out[:, 0], expected)
+
+
+@pytest.mark.parametrize('block_frames', [1, 7, 100, 1000])
+def test_blocks_join_into_the_whole_mix(block_frames):
+    rng = np.random.default_rng(1)
+    arrays = [
+        rng.uniform(-0.8, 0.8, (17, 2)).astype(np.float32),
+        rng.uniform(-0.8, 0.8, (29, 1)).astype(np.float32),
+        rng.uniform(-0.8, 0.8, (5, 2)).astype(np.float32),
+    ]
+    gains = [0.7, 1.0, 0.4]
+    n_frames = 500
+
+    blocks = list(iter_mix_blocks(arrays, gains, n_frames, block_frames, frame_rate=1000))
+    assert all(len(block) == block_frames for block in blocks[:-1])
+    assert np.allclose(np.concatenate(blocks), mix_layers(arrays, gains, n_frames), atol=1e-6)
+
+
+def test_mono_layer_plays_on_both_channels_of_stereo_mix():
+    mono = np.array([[0.1], [0.2]], dtype=np.float32)
+    stereo = np.array([[0.3, -0.3]], dtype=np.float32)
+    mixed = mix_layers([mono, stereo], [1.0, 1.0], 2, limit=False)
+    assert np.allclose(mixed, [[0.4, -0.2], [0.5, -0.1]])
+
+
+def test_layouts_are_conformed():
+    mono = np.array([[0.5], [-0.5]], dtype=np.float32)
+    stereo = np.array([[0.2, 0.4], [-1.0, 0.0]], dtype=np.float32)
+
+    assert np.array_equal(conform_array(mono, 44100, channels=2), [[0.5, 0.5], [-0.5, -0.5]])
+    assert np.allclose(conform_array(stereo, 44100, channels=1), [[0.3], [-0.5]])
+    assert np.array_equal(conform_array(stereo, 44100, 44100, 2), stereo)
+
+    tone = np.sin(2 * np.pi * 100 * np.arange(44100) / 44100).astype(np.float32)[:, None]
+    resampled = conform_array(tone, 44100, 22050, 2)
+    assert resampled.shape == (22050, 2)
+    assert resampled.dtype == np.float32
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from analysis_index import AnalysisIndex
+from benchmarks.synth_library import generate_library
+from music_mixer_logic import MusicMixer, plan_hash
+from sample_cache import DecodedSampleCache
+from workspace import Workspace
+
+
+@pytest.fixture
+def library(tmp_path):
+    root = str(tmp_path / 'library')
+    generate_library(root, 24, ('wav',), frame_rate=22050, seed=1, max_bars=1)
+    return root
+
+
+def new_mixer(library, tmp_path, index, seed):
+    return MusicMixer(
+        samples_dir=library, analysis_index=index, analysis_workers=1, sample_cache=DecodedSampleCache(),
+        workspace=Workspace(str(tmp_path / 'workspace')), seed=seed,
+    )
+
+
+def test_same_seed_plans_same_composition_across_analysis(library, tmp_path):
+    index = AnalysisIndex(os.path.join(str(tmp_path), 'analysis_index.sqlite'))
+    mixer = new_mixer(library, tmp_path, index, seed=7)
+    first = mixer.plan_composition(3)
+    assert first['layers']
+
+    # Resolving analyzes the picked samples, which must not change the next pick
+    resolved = mixer.resolve_plan(first)
+    assert mixer.plan_composition(3) == first
+
+    # Neither may analysis another mixer adds to the shared index
+    other = new_mixer(library, tmp_path, index, seed=None)
+    other.analyze_samples(other.get_all_samples())
+
+    fresh = new_mixer(library, tmp_path, index, seed=7)
+    again = fresh.plan_composition(3)
+    assert again == first
+
+    # The render cache is keyed by the hash of the resolved plan
+    assert plan_hash(fresh.resolve_plan(again)) == plan_hash(resolved)
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from analysis_index import AnalysisIndex
+from music_mixer_logic import MusicMixer
+from sample_cache import DecodedSampleCache
+from workspace import Workspace
+
+
+def make_library(root, names):
+    os.makedirs(root)
+    for name in names:
+        open(os.path.join(root, name), 'wb').close()
+    return root
+
+
+@pytest.fixture
+def make_mixer(tmp_path):
+    def make(names, detected_key='1A'):
+        library = make_library(str(tmp_path / 'library'), names)
+        mixer = MusicMixer(
+            samples_dir=library, analysis_index=AnalysisIndex(str(tmp_path / 'analysis_index.sqlite')),
+            analysis_workers=1, sample_cache=DecodedSampleCache(), workspace=Workspace(str(tmp_path / 'workspace')),
+        )
+
+        # Every sample decodes; unlabelled ones are detected in a key that clashes with 8A
+        mixer.analyze_samples = lambda samples, progress_callback=None: 0
+        mixer.get_features = lambda path: {}
+        mixer.get_bpm = lambda path: 128
+        mixer.get_sample_key = lambda path: mixer._filename_key(path) or detected_key
+        mixer.get_layer_volume = lambda path, category, rng=None: 0.5
+        return mixer
+    return make
+
+
+def bass_plan(mixer, name):
+    return {
+        'seed': 3, 'bpm': 128, 'key': '8A', 'resolved': False,
+        'layers': [{'category': 'bass', 'sample': os.path.join(mixer.samples_dir, name),
+                    'original_bpm': None, 'key': None, 'volume': None}],
+    }
+
+
+UNLABELLED = [f"Bass Loop {i:02d}.wav" for i in range(40)]
+
+
+def test_clashing_unlabelled_samples_fall_back_to_labelled_compatible_key(make_mixer):
+    mixer = make_mixer(UNLABELLED + ["Bass 3A 01.wav", "Bass 9A 01.wav"])
+    layers = mixer.resolve_plan(bass_plan(mixer, UNLABELLED[0]))['layers']
+    assert [os.path.basename(layer['sample']) for layer in layers] == ["Bass 9A 01.wav"]
+    assert layers[0]['key'] == '9A'
+
+
+def test_layer_is_dropped_when_every_sample_clashes(make_mixer):
+    mixer = make_mixer(UNLABELLED + ["Bass 3A 01.wav"])
+    assert mixer.resolve_plan(bass_plan(mixer, UNLABELLED[0]))['layers'] == []
+
+
+def test_compatible_detected_key_is_kept(make_mixer):
+    mixer = make_mixer(UNLABELLED, detected_key='9A')
+    layers = mixer.resolve_plan(bass_plan(mixer, UNLABELLED[0]))['layers']
+    assert [layer['key'] for layer in layers] == ['9A']
+
+
+def test_undetected_tempo_is_labelled_as_fallback(make_mixer):
+    mixer = make_mixer(UNLABELLED, detected_key='9A')
+    mixer.get_bpm = lambda path: None
+    layers = mixer.resolve_plan(bass_plan(mixer, UNLABELLED[0]))['layers']
+    assert len(layers) == 1
+    assert layers[0]['original_bpm'] == 128
+    assert (layers[0]['bpm_method'], layers[0]['bpm_confidence']) == ('fallback', 0.0)
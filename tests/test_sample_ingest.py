@@ -0,0 +1,125 @@
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+
+import sample_ingest
+from sample_ingest import check_archive_limits, extract_audio_members, list_audio_members
+
+
+def build_archive(members, compression=zipfile.ZIP_DEFLATED):
+    """In-memory archive of (name, data) members"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def member_paths(buffer):
+    with zipfile.ZipFile(buffer) as archive:
+        return sorted(path for _, path in list_audio_members(archive))
+
+
+def test_members_outside_target_are_skipped():
+    buffer = build_archive([
+        ('../escape.wav', b'x'),
+        ('kit/../../escape.wav', b'x'),
+        ('C:/escape.wav', b'x'),
+        ('C:escape.wav', b'x'),
+        ('/absolute/kick.wav', b'x'),
+        ('..\\escape.wav', b'x'),
+        ('kit/./snare.wav', b'x'),
+    ])
+    assert member_paths(buffer) == [os.path.join('absolute', 'kick.wav'), os.path.join('kit', 'snare.wav')]
+
+
+def test_metadata_hidden_and_non_audio_members_are_skipped():
+    buffer = build_archive([
+        ('__MACOSX/kit/._kick.wav', b'x'),
+        ('kit/.hidden.wav', b'x'),
+        ('.git/sample.wav', b'x'),
+        ('kit/nested.zip', b'x'),
+        ('kit/readme.txt', b'x'),
+        ('kit/kick.WAV', b'x'),
+    ])
+    assert member_paths(buffer) == [os.path.join('kit', 'kick.WAV')]
+
+
+def test_too_many_entries_is_refused(tmp_path):
+    buffer = build_archive([(f'kit/{i}.txt', b'') for i in range(5)] + [('kit/kick.wav', b'x')])
+    with pytest.raises(ValueError, match='entries'):
+        extract_audio_members(buffer, str(tmp_path), max_members=5)
+    assert not os.listdir(tmp_path)
+
+
+def test_too_large_total_is_refused(tmp_path):
+    buffer = build_archive([('kick.wav', b'x' * 600), ('snare.wav', b'x' * 600)])
+    with pytest.raises(ValueError, match='larger'):
+        extract_audio_members(buffer, str(tmp_path), max_bytes=1000)
+    assert not os.listdir(tmp_path)
+
+    buffer.seek(0)
+    assert extract_audio_members(buffer, str(tmp_path), max_bytes=1200) == 2
+
+
+def test_suspicious_compression_ratio_is_refused(monkeypatch):
+    monkeypatch.setattr(sample_ingest, 'RATIO_CHECK_MIN_BYTES', 1024)
+    buffer = build_archive([('bomb.wav', b'\0' * 256 * 1024)])
+    with zipfile.ZipFile(buffer) as archive:
+        with pytest.raises(ValueError, match='compression ratio'):
+            check_archive_limits(archive, list_audio_members(archive))
+
+    # Small members are never checked, whatever their ratio
+    monkeypatch.setattr(sample_ingest, 'RATIO_CHECK_MIN_BYTES', 1024 * 1024)
+    with zipfile.ZipFile(buffer) as archive:
+        assert check_archive_limits(archive, list_audio_members(archive)) == 256 * 1024
+
+
+def understate_size(buffer, file_size):
+    """Rewrite the uncompressed size of the only member in both of its headers"""
+    data = bytearray(buffer.getvalue())
+    local = data.find(b'PK\x03\x04')
+    central = data.find(b'PK\x01\x02')
+    struct.pack_into('<I', data, local + 22, file_size)
+    struct.pack_into('<I', data, central + 24, file_size)
+    return io.BytesIO(bytes(data))
+
+
+def test_member_understating_its_size_is_not_written_past_the_header(tmp_path):
+    buffer = understate_size(build_archive([('kick.wav', b'\0' * 64 * 1024)]), 100)
+    with zipfile.ZipFile(buffer) as archive:
+        assert check_archive_limits(archive, list_audio_members(archive), max_bytes=1000) == 100
+
+    with pytest.raises((ValueError, zipfile.BadZipFile)):
+        extract_audio_members(buffer, str(tmp_path), max_bytes=1000)
+    assert os.path.getsize(tmp_path / 'kick.wav') <= 1000
+
+
+def test_uploads_sharing_a_name_are_all_kept(tmp_path):
+    uploads = []
+    for folder in ('first', 'second'):
+        os.makedirs(tmp_path / folder)
+        with open(tmp_path / folder / 'Kick 124.wav', 'wb') as output:
+            output.write(folder.encode())
+        with zipfile.ZipFile(tmp_path / folder / 'Drums.zip', 'w') as archive:
+            archive.writestr('Kick 124.wav', folder)
+        uploads += [str(tmp_path / folder / 'Kick 124.wav'), str(tmp_path / folder / 'Drums.zip')]
+
+    target = tmp_path / 'samples'
+    os.makedirs(target)
+    assert sample_ingest.ingest_uploads(uploads, str(target)) == {'audio_files': 4, 'archives': 2, 'skipped': 0}
+
+    kept = sorted(
+        (os.path.relpath(os.path.join(root, name), target), open(os.path.join(root, name)).read())
+        for root, _, names in os.walk(target) for name in names
+    )
+    assert kept == [
+        (os.path.join('Drums (copy 2)', 'Kick 124.wav'), 'second'),
+        (os.path.join('Drums', 'Kick 124.wav'), 'first'),
+        ('Kick 124 (copy 2).wav', 'second'),
+        ('Kick 124.wav', 'first'),
+    ]
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from time_stretch import stretch
+
+
+@pytest.mark.parametrize('speed', [0.9, 1.1])
+def test_beat_slice_stretch_has_no_clicks_at_beats(speed):
+    frame_rate, bpm = 22050, 128
+    t = np.arange(frame_rate * 8) / frame_rate
+    data = (0.5 * np.sin(2 * np.pi * 61 * t)).astype(np.float32)[:, None]
+
+    result = stretch(data, frame_rate, speed, 'beat_slice', bpm=bpm)
+    assert len(result) == int(round(len(data) / speed))
+
+    # Largest sample-to-sample step stays near that of the sustained tone itself
+    largest_step = np.abs(np.diff(data[:, 0])).max()
+    assert np.abs(np.diff(result[:, 0])).max() < 3 * largest_step
@@ -0,0 +1,84 @@
+import os
+import time
+
+import workspace as workspace_module
+from workspace import Workspace
+
+
+def add_entry(workspace, name, size, age, area='mixes'):
+    """Create file of size in area, last used age seconds ago"""
+    path = os.path.join(workspace.area(area), name)
+    with open(path, 'wb') as output:
+        output.write(b'\0' * size)
+    last_used = time.time() - age
+    os.utime(path, (last_used, last_used))
+    return path
+
+
+def add_dir_entry(workspace, name, size, age, area='uploads'):
+    """Create directory entry holding one file, marked as last used age seconds ago"""
+    path = os.path.join(workspace.area(area), name)
+    os.makedirs(path)
+    with open(os.path.join(path, 'kick.wav'), 'wb') as output:
+        output.write(b'\0' * size)
+    workspace.touch(path)
+    last_used = time.time() - age
+    os.utime(os.path.join(path, workspace_module.LAST_USED_MARKER), (last_used, last_used))
+    os.utime(path, (last_used, last_used))
+    return path
+
+
+def test_sweep_evicts_expired_entries(tmp_path):
+    workspace = Workspace(str(tmp_path), max_bytes=0, ttl_seconds=3600)
+    expired = add_entry(workspace, 'old.wav', 10, age=7200)
+    recent = add_entry(workspace, 'new.wav', 10, age=10)
+
+    assert workspace.sweep() == 10
+    assert not os.path.exists(expired)
+    assert os.path.exists(recent)
+    assert workspace.evicted_entries == 1
+
+
+def test_sweep_evicts_least_recently_used_until_under_quota(tmp_path):
+    workspace = Workspace(str(tmp_path), max_bytes=250, ttl_seconds=0)
+    oldest = add_entry(workspace, 'a.wav', 100, age=3000)
+    older = add_dir_entry(workspace, 'b', 100, age=2000)
+    newer = add_entry(workspace, 'c.wav', 100, age=1000, area='renders')
+    newest = add_entry(workspace, 'd.wav', 100, age=500)
+
+    assert workspace.sweep() == 200
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(older)
+    assert os.path.exists(newer)
+    assert os.path.exists(newest)
+
+
+def test_sweep_spares_recently_used_entries_over_quota(tmp_path):
+    workspace = Workspace(str(tmp_path), max_bytes=100, ttl_seconds=0)
+    stale = add_entry(workspace, 'a.wav', 100, age=workspace_module.EVICTION_GRACE_SECONDS * 2)
+    fresh = add_entry(workspace, 'b.wav', 100, age=1)
+    in_use = add_entry(workspace, 'c.wav', 100, age=workspace_module.EVICTION_GRACE_SECONDS * 3)
+    workspace.touch(in_use)
+
+    # Only the stale entry is past the grace period, the workspace stays over quota
+    assert workspace.sweep() == 100
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+    assert os.path.exists(in_use)
+
+
+def test_sweep_keeps_held_entries(tmp_path):
+    workspace = Workspace(str(tmp_path), max_bytes=100, ttl_seconds=3600)
+    held = add_dir_entry(workspace, 'session', 500, age=7200)
+    other = add_entry(workspace, 'a.wav', 50, age=600)
+    workspace.hold(held)
+
+    # Held entries don't count toward the quota either
+    assert workspace.sweep() == 0
+    assert os.path.exists(held)
+    assert os.path.exists(other)
+
+    workspace.release(held)
+    assert workspace.sweep() == 500
+    assert not os.path.exists(held)
+    assert os.path.exists(other)
@@ -0,0 +1,78 @@
+import librosa
+import numpy as np
+
+TEMPO_MODES = ('resample', 'phase_vocoder', 'beat_slice')
+
+# Fade applied to both ends of each beat slice to avoid clicks
+SLICE_FADE_MS = 5
+
+
+def resample_stretch(data, frame_rate, speed):
+    """Change tempo by resampling, which also shifts pitch"""
+    return librosa.resample(data.T, orig_sr=int(frame_rate * speed), target_sr=frame_rate).T
+
+
+def phase_vocoder_stretch(data, frame_rate, speed):
+    """Change tempo with a phase vocoder, keeping pitch"""
+    return librosa.effects.time_stretch(np.ascontiguousarray(data.T), rate=speed).T
+
+
+def beat_slice_stretch(data, frame_rate, speed, bpm=None):
+    """Change tempo by moving beat slices to the new grid, keeping pitch
+
+    Callers pass bpm for audio already cut to whole bars at that tempo,
+    whose beats then lie on a regular grid; beats are only tracked when
+    the tempo is unknown
+    """
+    if bpm:
+        beats = np.round(np.arange(0, len(data), frame_rate * 60 / bpm))
+    else:
+        try:
+            _, beats = librosa.beat.beat_track(y=data.mean(axis=1), sr=frame_rate, units='samples')
+        except Exception:
+            beats = np.array([], dtype=int)
+
+    bounds = np.unique(np.concatenate([[0], beats, [len(data)]]).astype(int))
+    new_bounds = np.round(bounds / speed).astype(int)
+
+    out = np.zeros((new_bounds[-1], data.shape[1]), dtype=np.float32)
+    fade_length = int(frame_rate * SLICE_FADE_MS / 1000)
+
+    for start, end, new_start, new_end in zip(bounds[:-1], bounds[1:], new_bounds[:-1], new_bounds[1:]):
+        count = min(end - start, new_end - new_start)
+        if count <= 0:
+            continue
+
+        # Slices are cut short or followed by a gap, so both of their ends are
+        # faded; otherwise each beat would click against its neighbour or silence
+        piece = data[start:start + count].copy()
+        fade = min(fade_length, count // 2)
+        if fade > 0:
+            ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+            piece[:fade] *= ramp
+            piece[count - fade:] *= ramp[::-1]
+        out[new_start:new_start + count] = piece
+
+    return out
+
+
+def stretch(data, frame_rate, speed, mode='resample', bpm=None):
+    """Change tempo of float array of shape (frames, channels) by speed factor
+
+    Results aren't cached here; callers keep the prepared sample in their
+    own cache under its file, speed ratio and mode
+    """
+    if mode not in TEMPO_MODES:
+        raise ValueError(f"Unknown tempo mode: {mode}")
+
+    if speed == 1.0 or len(data) == 0:
+        return data
+
+    if mode == 'phase_vocoder':
+        result = phase_vocoder_stretch(data, frame_rate, speed)
+    elif mode == 'beat_slice':
+        result = beat_slice_stretch(data, frame_rate, speed, bpm)
+    else:
+        result = resample_stretch(data, frame_rate, speed)
+
+    return np.ascontiguousarray(result, dtype=np.float32)
@@ -0,0 +1,307 @@
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Stages of the generation pipeline, in the order they run
+PIPELINE_STAGES = ('scan', 'classify', 'analyze', 'decode', 'loop', 'stretch', 'mix', 'encode')
+
+# Set MUSIC_MIXER_TRACE_MEMORY=1 to record the peak Python/numpy allocation of
+# every stage with tracemalloc; it slows allocation down and is process-wide,
+# so it's meant for profiling single mixes
+TRACE_MEMORY = os.environ.get("MUSIC_MIXER_TRACE_MEMORY", "").lower() in ("1", "true", "yes")
+
+_current_trace = contextvars.ContextVar('music_mixer_trace', default=None)
+
+# Innermost open stage of the active trace, as
+# [start wall, start cpu, nested wall, nested cpu, peak memory, parent, thread id];
+# threads started with contextvars.copy_context().run nest under the stage
+# that was open when they started
+_current_stage = contextvars.ContextVar('music_mixer_stage', default=None)
+
+
+def peak_rss_bytes():
+    """Highest resident memory of the process so far, None where unknown"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Trace:
+    """Wall time, CPU time and memory of pipeline stages run while the trace is active
+
+    Stage times are exclusive: time spent in a nested stage counts only
+    towards that stage, so the stages add up to the traced total. A stage
+    run in a helper thread counts its CPU time only towards itself. Memory
+    peaks are those seen while the stage was open, nested stages included
+    """
+
+    def __init__(self, name='mix', memory=TRACE_MEMORY):
+        self.name = name
+        self.memory = memory
+        self.stages = defaultdict(lambda: {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_memory_bytes': 0})
+        self.caches = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self.counters = defaultdict(int)
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self._lock = threading.Lock()
+
+        self._token = None
+        self._stage_token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._token = _current_trace.set(self)
+        self._stage_token = _current_stage.set(None)
+        self._start = (time.perf_counter(), time.thread_time())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_seconds += time.perf_counter() - self._start[0]
+        self.cpu_seconds += time.thread_time() - self._start[1]
+        _current_stage.reset(self._stage_token)
+        _current_trace.reset(self._token)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        get_metrics().record(self)
+        return False
+
+    @staticmethod
+    def _memory_checkpoint():
+        """Fold the allocation peak since the last checkpoint into the innermost open stage"""
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        frame = _current_stage.get()
+        if frame is not None:
+            frame[4] = max(frame[4], peak)
+
+    @contextmanager
+    def stage(self, name, calls=1):
+        """Time the enclosed code as calls (usually one) of stage"""
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            self._memory_checkpoint()
+        parent = _current_stage.get()
+        frame = [time.perf_counter(), time.thread_time(), 0.0, 0.0, 0, parent, threading.get_ident()]
+        token = _current_stage.set(frame)
+        try:
+            yield
+        finally:
+            if memory:
+                self._memory_checkpoint()
+            _current_stage.reset(token)
+            wall = time.perf_counter() - frame[0]
+            cpu = time.thread_time() - frame[1]
+
+            with self._lock:
+                record = self.stages[name]
+                record['calls'] += calls
+                record['wall_seconds'] += wall - frame[2]
+                record['cpu_seconds'] += cpu - frame[3]
+                record['peak_memory_bytes'] = max(record['peak_memory_bytes'], frame[4])
+
+                if parent is not None:
+                    parent[2] += wall
+                    if parent[6] == frame[6]:
+                        parent[3] += cpu
+                    parent[4] = max(parent[4], frame[4])
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def cache_lookup(self, cache, hit):
+        self.caches[cache]['hits' if hit else 'misses'] += 1
+
+    def report(self):
+        """Get trace as a JSON-serializable dict"""
+        order = list(PIPELINE_STAGES) + sorted(set(self.stages) - set(PIPELINE_STAGES))
+        stages = {}
+        for name in order:
+            if name not in self.stages:
+                continue
+            record = self.stages[name]
+            stages[name] = {
+                'calls': record['calls'],
+                'wall_seconds': round(record['wall_seconds'], 4),
+                'cpu_seconds': round(record['cpu_seconds'], 4),
+            }
+            if self.memory:
+                stages[name]['peak_memory_bytes'] = record['peak_memory_bytes']
+
+        caches = {}
+        for name, lookups in self.caches.items():
+            total = lookups['hits'] + lookups['misses']
+            caches[name] = dict(lookups, hit_rate=round(lookups['hits'] / total, 3) if total else 0.0)
+
+        staged = sum(record['wall_seconds'] for record in self.stages.values())
+        return {
+            'name': self.name,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'unstaged_seconds': round(max(self.wall_seconds - staged, 0.0), 4),
+            'stages': stages,
+            'bytes_decoded': self.counters.get('bytes_decoded', 0),
+            'counters': {name: value for name, value in self.counters.items() if name != 'bytes_decoded'},
+            'caches': caches,
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+
+
+def current_trace():
+    """Get trace active in this context, None if nothing is traced"""
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name, calls=1):
+    """Time the enclosed code as a stage of the active trace, if there is one"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name, calls):
+        yield
+
+
+def count(name, amount=1):
+    """Add to a counter of the active trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(name, amount)
+
+
+def cache_lookup(cache, hit):
+    """Record a cache hit or miss in the active trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.cache_lookup(cache, hit)
+
+
+def traced(name):
+    """Decorate function so every call is timed as a call of stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_iter(name, iterable, calls=1):
+    """Yield items of iterable, timing all its steps together as calls (usually one) of stage"""
+    iterator = iter(iterable)
+    while True:
+        with stage(name, calls):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        # Only the first step counts the call, later ones just add time
+        calls = 0
+        yield item
+
+
+class Metrics:
+    """Stage totals of all finished traces, written as Prometheus text for scraping"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.traces = defaultdict(lambda: {'count': 0, 'wall_seconds': 0.0})
+        self.stages = defaultdict(lambda: {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+        self.caches = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self.bytes_decoded = 0
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        """Add finished trace to the totals and rewrite the metrics file"""
+        with self._lock:
+            self.traces[trace.name]['count'] += 1
+            self.traces[trace.name]['wall_seconds'] += trace.wall_seconds
+            for name, record in trace.stages.items():
+                for field in ('calls', 'wall_seconds', 'cpu_seconds'):
+                    self.stages[name][field] += record[field]
+            for name, lookups in trace.caches.items():
+                self.caches[name]['hits'] += lookups['hits']
+                self.caches[name]['misses'] += lookups['misses']
+            self.bytes_decoded += trace.counters.get('bytes_decoded', 0)
+
+            if self.path:
+                try:
+                    self._write()
+                except OSError as e:
+                    print(f"Could not write metrics file: {e}")
+
+    def render(self):
+        """Get totals in Prometheus text exposition format"""
+        series = [
+            ('music_mixer_traces_total', 'counter', 'Finished traced operations',
+             [(f'name="{name}"', total['count']) for name, total in self.traces.items()]),
+            ('music_mixer_trace_seconds_total', 'counter', 'Wall time of traced operations',
+             [(f'name="{name}"', total['wall_seconds']) for name, total in self.traces.items()]),
+            ('music_mixer_stage_calls_total', 'counter', 'Calls of pipeline stages',
+             [(f'stage="{name}"', record['calls']) for name, record in self.stages.items()]),
+            ('music_mixer_stage_seconds_total', 'counter', 'Exclusive wall time of pipeline stages',
+             [(f'stage="{name}"', record['wall_seconds']) for name, record in self.stages.items()]),
+            ('music_mixer_stage_cpu_seconds_total', 'counter', 'Exclusive CPU time of pipeline stages',
+             [(f'stage="{name}"', record['cpu_seconds']) for name, record in self.stages.items()]),
+            ('music_mixer_cache_hits_total', 'counter', 'Cache hits',
+             [(f'cache="{name}"', lookups['hits']) for name, lookups in self.caches.items()]),
+            ('music_mixer_cache_misses_total', 'counter', 'Cache misses',
+             [(f'cache="{name}"', lookups['misses']) for name, lookups in self.caches.items()]),
+            ('music_mixer_decoded_bytes_total', 'counter', 'Bytes of sample audio decoded',
+             [('', self.bytes_decoded)]),
+            ('music_mixer_peak_rss_bytes', 'gauge', 'Highest resident memory of the process',
+             [('', peak_rss_bytes() or 0)]),
+        ]
+
+        lines = []
+        for metric, kind, help_text, values in series:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for labels, value in values:
+                # Exact values, rounding would make rate() over long-running counters stepped
+                value = str(value) if isinstance(value, int) else repr(float(value))
+                lines.append(f"{metric}{{{labels}}} {value}" if labels else f"{metric} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def _write(self):
+        path = self.path.replace('{pid}', str(os.getpid()))
+        # Write under a private name so scrapers never read half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+
+_shared_metrics = None
+_shared_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Get process-wide metrics, written to MUSIC_MIXER_METRICS_FILE when set
+
+    A {pid} in the file name is replaced by the process id, so worker
+    processes don't overwrite each other's totals
+    """
+    global _shared_metrics
+    with _shared_metrics_lock:
+        if _shared_metrics is None:
+            _shared_metrics = Metrics(os.environ.get("MUSIC_MIXER_METRICS_FILE"))
+        return _shared_metrics
@@ -0,0 +1,249 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from analysis_index import get_cache_dir
+
+# Subdirectories of the workspace whose entries can be evicted
+WORKSPACE_AREAS = ('renders', 'mixes', 'uploads')
+
+# Defaults, override with MUSIC_MIXER_WORKSPACE_MB, MUSIC_MIXER_WORKSPACE_TTL_HOURS
+# and MUSIC_MIXER_JANITOR_SECONDS
+DEFAULT_QUOTA_MB = 2048
+DEFAULT_TTL_HOURS = 24
+DEFAULT_JANITOR_SECONDS = 300
+
+# Entries used this recently are never evicted to meet the quota
+EVICTION_GRACE_SECONDS = 60
+
+# File inside directory entries whose mtime records their last use, so
+# marking a directory as used doesn't change the directory itself
+LAST_USED_MARKER = '.last_used'
+
+
+def _entry_size(path):
+    """Size of file or total size of files under directory"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, name))
+            except OSError:
+                pass
+    return total
+
+
+class Workspace:
+    """Generated mixes, renders and uploads under one directory, kept within a quota and TTL"""
+
+    def __init__(self, root, max_bytes=DEFAULT_QUOTA_MB * 1024 * 1024, ttl_seconds=DEFAULT_TTL_HOURS * 3600):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self.evicted_entries = 0
+        self.evicted_bytes = 0
+        self.last_sweep = None
+        self.last_sweep_seconds = None
+
+        # Entries in use by live sessions, never evicted until released
+        self._held = set()
+
+        self._lock = threading.Lock()
+        self._janitor = None
+        self._stop = threading.Event()
+
+    def area(self, name):
+        """Get directory of workspace area, creating it if missing"""
+        if name not in WORKSPACE_AREAS:
+            raise ValueError(f"Unknown workspace area: {name}")
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def unique_name(prefix, suffix=''):
+        """Name that is unique even for files created in the same second"""
+        return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}{suffix}"
+
+    def new_path(self, area, prefix, suffix=''):
+        """Get unique file path in area"""
+        return os.path.join(self.area(area), self.unique_name(prefix, suffix))
+
+    def new_dir(self, area, prefix):
+        """Create unique directory in area"""
+        return tempfile.mkdtemp(prefix=f"{prefix}_", dir=self.area(area))
+
+    @staticmethod
+    def touch(path):
+        """Mark entry as recently used"""
+        try:
+            if os.path.isdir(path):
+                path = os.path.join(path, LAST_USED_MARKER)
+                if not os.path.exists(path):
+                    open(path, 'a').close()
+            os.utime(path)
+        except OSError:
+            pass
+
+    def hold(self, path):
+        """Keep entry from being evicted while it is in use"""
+        with self._lock:
+            self._held.add(os.path.abspath(path))
+
+    def release(self, path):
+        """Let entry be evicted again"""
+        with self._lock:
+            self._held.discard(os.path.abspath(path))
+
+    @staticmethod
+    def _last_used(item):
+        last_used = item.stat().st_mtime
+        if item.is_dir(follow_symlinks=False):
+            try:
+                last_used = max(last_used, os.stat(os.path.join(item.path, LAST_USED_MARKER)).st_mtime)
+            except OSError:
+                pass
+        return last_used
+
+    def contains(self, path, area=None):
+        """Check if path is inside the workspace, or inside one area of it"""
+        base = os.path.join(self.root, area) if area else self.root
+        return os.path.abspath(path).startswith(base + os.sep)
+
+    def _entries(self):
+        """List (last used, size, path, area) of every top-level entry in all areas"""
+        entries = []
+        for name in WORKSPACE_AREAS:
+            path = os.path.join(self.root, name)
+            try:
+                with os.scandir(path) as items:
+                    for item in items:
+                        try:
+                            entries.append((self._last_used(item), _entry_size(item.path), item.path, name))
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return entries
+
+    def _remove(self, path, size):
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            return False
+
+        self.evicted_entries += 1
+        self.evicted_bytes += size
+        return True
+
+    def sweep(self):
+        """Evict expired entries, then least recently used ones until under quota
+
+        Held entries are neither evicted nor counted toward the quota.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            now = time.time()
+            freed = 0
+            kept = []
+
+            for entry in self._entries():
+                last_used, size, path, _ = entry
+                if path in self._held:
+                    continue
+                if self.ttl_seconds and now - last_used > self.ttl_seconds:
+                    if self._remove(path, size):
+                        freed += size
+                        continue
+                kept.append(entry)
+
+            total = sum(entry[1] for entry in kept)
+            if self.max_bytes:
+                for last_used, size, path, _ in sorted(kept):
+                    if total <= self.max_bytes:
+                        break
+                    if now - last_used < EVICTION_GRACE_SECONDS:
+                        break
+                    if self._remove(path, size):
+                        freed += size
+                        total -= size
+
+            self.last_sweep = now
+            self.last_sweep_seconds = time.perf_counter() - start
+            return freed
+
+    def usage(self):
+        """Get space used per area and eviction counters"""
+        areas = {name: {'entries': 0, 'bytes': 0} for name in WORKSPACE_AREAS}
+        for _, size, _, name in self._entries():
+            areas[name]['entries'] += 1
+            areas[name]['bytes'] += size
+
+        with self._lock:
+            return {
+                'root': self.root,
+                'areas': areas,
+                'bytes': sum(area['bytes'] for area in areas.values()),
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'evicted_entries': self.evicted_entries,
+                'evicted_bytes': self.evicted_bytes,
+                'last_sweep': self.last_sweep,
+                'last_sweep_seconds': self.last_sweep_seconds,
+            }
+
+    def start_janitor(self, interval=DEFAULT_JANITOR_SECONDS):
+        """Sweep the workspace periodically in a background thread"""
+        if self._janitor is not None and self._janitor.is_alive():
+            return self._janitor
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Workspace cleanup failed: {e}")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._janitor = threading.Thread(target=run, name="workspace-janitor", daemon=True)
+        self._janitor.start()
+        return self._janitor
+
+    def stop_janitor(self):
+        self._stop.set()
+        if self._janitor is not None:
+            self._janitor.join()
+            self._janitor = None
+
+
+_shared_workspace = None
+_shared_workspace_lock = threading.Lock()
+
+
+def get_workspace():
+    """Get process-wide workspace in the cache directory"""
+    global _shared_workspace
+    with _shared_workspace_lock:
+        if _shared_workspace is None:
+            quota_mb = float(os.environ.get("MUSIC_MIXER_WORKSPACE_MB", DEFAULT_QUOTA_MB))
+            ttl_hours = float(os.environ.get("MUSIC_MIXER_WORKSPACE_TTL_HOURS", DEFAULT_TTL_HOURS))
+            _shared_workspace = Workspace(get_cache_dir(), int(quota_mb * 1024 * 1024), ttl_hours * 3600)
+        return _shared_workspace
+
+
+def start_shared_janitor():
+    """Start the background janitor of the shared workspace"""
+    interval = float(os.environ.get("MUSIC_MIXER_JANITOR_SECONDS", DEFAULT_JANITOR_SECONDS))
+    return get_workspace().start_janitor(interval)